@@ -0,0 +1,267 @@
+import os
+import numpy as np
+from external_sort import grouped_slots
+
+# Default location of the IVF index written by train_model.py
+IVF_INDEX_PATH = 'models/ivf_index'
+
+# Arrays saved as separate .npy files so they can be memory-mapped
+INDEX_ARRAYS = ('centroids', 'list_offsets', 'list_rows', 'list_vectors')
+
+# Number of inverted lists searched per query unless overridden
+DEFAULT_NPROBE = 8
+
+# Rows assigned to lists per block when building the index
+ASSIGN_BLOCK_SIZE = 65536
+
+# Rows the coarse quantizer is fitted on; every row is still assigned to a list
+QUANTIZER_SAMPLE_SIZE = 262144
+
+
+def default_n_lists(n_tracks):
+    """Pick a number of inverted lists that grows with the square root of the catalog"""
+    return int(max(8, round(np.sqrt(n_tracks))))
+
+
+def _squared_distances(X, centroids):
+    """Squared euclidean distances between rows of X and the centroids"""
+    return (
+        np.einsum('ij,ij->i', X, X)[:, None]
+        - 2 * X @ centroids.T
+        + np.einsum('ij,ij->i', centroids, centroids)[None, :]
+    )
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest neighbour index.
+
+    A coarse quantizer (a set of centroids) partitions the catalog into
+    inverted lists. A query only scans the lists of its `nprobe` nearest
+    centroids, so its cost is roughly n_lists + nprobe * N / n_lists
+    distance computations instead of N.
+    """
+
+    def __init__(self, centroids, list_offsets, list_rows, list_vectors):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.list_offsets = np.asarray(list_offsets, dtype=np.int64)
+        self.list_rows = np.asarray(list_rows, dtype=np.int32)
+        self.list_vectors = np.asarray(list_vectors, dtype=np.float32)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @property
+    def n_tracks(self):
+        return len(self.list_rows)
+
+    @staticmethod
+    def fit_centroids(features, n_lists=None, random_state=42, sample_size=QUANTIZER_SAMPLE_SIZE):
+        """Fit the coarse quantizer on a random sample of at most `sample_size` rows"""
+        # Imported here so serving processes that only search never load sklearn
+        from sklearn.cluster import MiniBatchKMeans
+        n_lists = min(n_lists or default_n_lists(len(features)), len(features))
+        rng = np.random.default_rng(random_state)
+        sample = np.sort(rng.choice(len(features), min(sample_size, len(features)), replace=False))
+        quantizer = MiniBatchKMeans(
+            n_clusters=n_lists, random_state=random_state,
+            batch_size=4096, n_init=3
+        )
+        quantizer.fit(np.asarray(features[sample], dtype=np.float32))
+        return quantizer.cluster_centers_.astype(np.float32)
+
+    @staticmethod
+    def assign_blocks(features, centroids):
+        """Yield (start, block, nearest list per row) over memory-bounded blocks of rows"""
+        for start in range(0, len(features), ASSIGN_BLOCK_SIZE):
+            block = np.asarray(features[start:start + ASSIGN_BLOCK_SIZE], dtype=np.float32)
+            yield start, block, _squared_distances(block, centroids).argmin(axis=1)
+
+    @classmethod
+    def build(cls, features, centroids=None, n_lists=None, random_state=42):
+        """
+        Build an index over scaled features.
+
+        Args:
+            features (array): Scaled feature matrix, one row per track
+            centroids (array): Coarse quantizer centroids, e.g. the fitted
+                KMeans cluster_centers_. A finer set is fitted when omitted.
+            n_lists (int): Number of lists to fit when centroids are omitted
+            random_state (int): Seed for the coarse quantizer
+
+        Returns:
+            IVFIndex
+        """
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        if centroids is None:
+            centroids = cls.fit_centroids(features, n_lists, random_state)
+        centroids = np.asarray(centroids, dtype=np.float32)
+
+        # Assign every track to its nearest centroid in memory-bounded blocks
+        assignments = np.empty(len(features), dtype=np.int32)
+        for start, block, nearest in cls.assign_blocks(features, centroids):
+            assignments[start:start + len(block)] = nearest
+
+        # Lay the lists out contiguously so a probe is a single slice
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=len(centroids))
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        return cls(centroids, offsets, order, features[order])
+
+    @classmethod
+    def write(cls, features, path=IVF_INDEX_PATH, n_lists=None, random_state=42):
+        """
+        Build an index straight into its saved layout, for features larger than memory.
+
+        The coarse quantizer is fitted on a sample. Then one pass over blocks
+        counts the list sizes, and a second pass writes every row into the
+        memory-mapped list arrays. Assignments are recomputed rather than stored.
+
+        Returns:
+            IVFIndex loaded memory-mapped from `path`
+        """
+        centroids = cls.fit_centroids(features, n_lists, random_state)
+        counts = np.zeros(len(centroids), dtype=np.int64)
+        for _, _, nearest in cls.assign_blocks(features, centroids):
+            counts += np.bincount(nearest, minlength=len(centroids))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'centroids.npy'), centroids)
+        np.save(os.path.join(path, 'list_offsets.npy'), offsets)
+        list_rows = np.lib.format.open_memmap(
+            os.path.join(path, 'list_rows.npy'), mode='w+', dtype=np.int32, shape=(len(features),)
+        )
+        list_vectors = np.lib.format.open_memmap(
+            os.path.join(path, 'list_vectors.npy'), mode='w+', dtype=np.float32, shape=features.shape
+        )
+        cursors = offsets[:-1].copy()
+        for start, block, nearest in cls.assign_blocks(features, centroids):
+            slots = grouped_slots(nearest, cursors)
+            list_rows[slots] = np.arange(start, start + len(block))
+            list_vectors[slots] = block
+        list_rows.flush()
+        list_vectors.flush()
+        del list_rows, list_vectors
+        return load_ivf_index(path)
+
+    def probe(self, queries, nprobe=DEFAULT_NPROBE):
+        """Return the ids of the `nprobe` nearest lists for each query"""
+        nprobe = max(1, min(int(nprobe), self.n_lists))
+        distances = _squared_distances(queries, self.centroids)
+        if nprobe == self.n_lists:
+            return np.argsort(distances, axis=1)
+        return np.argpartition(distances, nprobe - 1, axis=1)[:, :nprobe]
+
+    def list_slots(self, lists):
+        """Positions in list_rows / list_vectors of every member of the given lists"""
+        return np.concatenate([
+            np.arange(self.list_offsets[l], self.list_offsets[l + 1]) for l in lists
+        ] or [np.empty(0, dtype=np.int64)])
+
+    def filtered_candidates(self, query, k, nprobe, row_filter):
+        """
+        Members of the nearest lists that pass row_filter, probing `nprobe`
+        lists at a time in centroid order until at least k are found.
+        """
+        ranked = np.argsort(_squared_distances(query[None, :], self.centroids)[0], kind='stable')
+        nprobe = max(1, int(nprobe))
+        found = []
+        n_found = 0
+        for start in range(0, self.n_lists, nprobe):
+            slots = self.list_slots(ranked[start:start + nprobe])
+            # Rejected rows are skipped before any distance is computed
+            slots = slots[row_filter.allows(self.list_rows[slots])]
+            found.append(slots)
+            n_found += len(slots)
+            if n_found >= k:
+                break
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def search(self, queries, k=10, nprobe=DEFAULT_NPROBE, row_filter=None):
+        """
+        Find approximate nearest neighbours.
+
+        Args:
+            queries (array): Scaled query vectors
+            k (int): Number of neighbours per query
+            nprobe (int): Number of inverted lists scanned per query
+            row_filter (RowFilter): Only return rows it allows; further lists
+                are probed while fewer than k allowed rows were found
+
+        Returns:
+            (distances, indices) arrays of shape (n_queries, k), closest first.
+            Rows with fewer than k candidates are padded with inf / -1.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+
+        probed = self.probe(queries, nprobe) if row_filter is None else [None] * len(queries)
+        for i, (query, lists) in enumerate(zip(queries, probed)):
+            if row_filter is None:
+                candidates = self.list_slots(lists)
+            else:
+                candidates = self.filtered_candidates(query, k, nprobe, row_filter)
+            if len(candidates) == 0:
+                continue
+
+            diff = self.list_vectors[candidates] - query
+            candidate_distances = np.einsum('ij,ij->i', diff, diff)
+
+            m = min(k, len(candidates))
+            top = np.argpartition(candidate_distances, m - 1)[:m] if m < len(candidates) else np.arange(m)
+            top = top[np.argsort(candidate_distances[top], kind='stable')]
+
+            distances[i, :m] = np.sqrt(candidate_distances[top])
+            indices[i, :m] = self.list_rows[candidates[top]]
+
+        return distances, indices
+
+    def measure_recall(self, features, k=10, nprobe_values=(1, 2, 4, 8, 16),
+                       n_queries=1000, exact_model=None, random_state=42):
+        """
+        Measure recall@k against exact search on a sample of catalog tracks.
+
+        Args:
+            features (array): Scaled feature matrix the index was built on
+            k (int): Neighbours compared per query
+            nprobe_values (tuple): nprobe settings to evaluate
+            n_queries (int): Number of sampled query tracks
+            exact_model (NearestNeighbors): Fitted exact model; without one the
+                ground truth comes from a blocked brute-force scan
+            random_state (int): Seed for the query sample
+
+        Returns:
+            dict mapping nprobe to recall@k
+        """
+        rng = np.random.default_rng(random_state)
+        sample = np.sort(rng.choice(len(features), min(n_queries, len(features)), replace=False))
+        queries = np.asarray(features[sample], dtype=np.float32)
+
+        if exact_model is None:
+            # Imported here so the index itself does not depend on the quantized copy
+            from quantized_features import scan
+            _, truth = scan(queries, features, k)
+        else:
+            _, truth = exact_model.kneighbors(queries, n_neighbors=k)
+
+        report = {}
+        for nprobe in nprobe_values:
+            _, approx = self.search(queries, k, nprobe)
+            hits = sum(len(np.intersect1d(a, t)) for a, t in zip(approx, truth))
+            report[int(nprobe)] = hits / truth.size
+        return report
+
+    def save(self, path=IVF_INDEX_PATH):
+        os.makedirs(path, exist_ok=True)
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+
+
+def load_ivf_index(path=IVF_INDEX_PATH, mmap=True):
+    """Load an IVF index written by IVFIndex.save, memory-mapping the arrays by default"""
+    mmap_mode = 'r' if mmap else None
+    return IVFIndex(*(np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode) for name in INDEX_ARRAYS))
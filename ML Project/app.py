@@ -1,32 +1,122 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response, g
 import pandas as pd
 import numpy as np
 import os
+import time
 import datetime
+import threading
 from spotify_utils import SpotifyAPI, RecommendationEngine
-from fuzzywuzzy import process
+from model_bundle import bundle_exists, current_bundle_version, resident_memory
+from training_jobs import TrainingManager, TrainingInProgress
+import metrics
 
 app = Flask(__name__)
 
-# Initialize Spotify API and Recommendation Engine
-spotify_api = SpotifyAPI()
+# Upper bounds on seeds, neighbours per seed and nprobe of a single batch recommendation request
+MAX_BATCH_SEEDS = 500
+MAX_BATCH_RECOMMENDATIONS = 100
+MAX_NPROBE = 1024
 
-# Load processed tracks for local recommendations
-def load_processed_tracks():
-    try:
-        return pd.read_csv('models/processed_tracks.csv')
-    except Exception as e:
-        print(f"Error loading processed tracks: {e}")
-        return None
+# Upper bound on playlists and total tracks scored by a single request
+MAX_SCORED_PLAYLISTS = 100
+MAX_SCORED_TRACKS = 20000
 
-processed_tracks = load_processed_tracks()
+# Seconds between checks for a bundle made current by another worker process
+BUNDLE_CHECK_INTERVAL = 5
 
-# Check if models directory exists, if not, we need to train the model first
-if not os.path.exists('models') or not os.path.exists('models/processed_tracks.csv'):
+# Initialize Spotify API and Recommendation Engine
+spotify_api = SpotifyAPI()
+
+# Models load lazily from the current bundle, so startup only reads its manifest
+if not bundle_exists():
     print("Models not found. Please run train_model.py first.")
     recommendation_engine = None
 else:
-    recommendation_engine = RecommendationEngine()
+    recommendation_engine = RecommendationEngine(spotify_api=spotify_api)
+
+def load_engine(bundle_path=None):
+    """Build an engine with every component loaded, so swapping it in never stalls requests"""
+    return RecommendationEngine(bundle_path, spotify_api=spotify_api).warm_up()
+
+def swap_engine(engine):
+    """Serve a new engine; requests already running finish on the one they started with"""
+    global recommendation_engine
+    recommendation_engine = engine
+
+# Background training, one job at a time; validated models are swapped in live
+training_manager = TrainingManager(load_engine, swap_engine)
+
+last_bundle_check = 0.0
+reload_lock = threading.Lock()
+
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+
+@app.after_request
+def remember_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def record_request_metrics(exc):
+    """Runs even when a view raises, so failed requests and their latency are counted as 500s"""
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    status = 500 if exc is not None else g.get('response_status', 500)
+    metrics.finish_request(route, request.method, status)
+
+@metrics.REGISTRY.collected('spotify_cache_lookups', 'Spotify response cache lookups, by result', 'counter', ('result',))
+def collect_cache_lookups():
+    stats = spotify_api.cache.stats()
+    return [(('hit',), stats['hits']), (('shared_hit',), stats['shared_hits']), (('miss',), stats['misses'])]
+
+@metrics.REGISTRY.collected('spotify_cache_hit_ratio', 'Share of Spotify cache lookups served from the cache')
+def collect_cache_hit_ratio():
+    return [((), spotify_api.cache.stats()['hit_rate'])]
+
+@metrics.REGISTRY.collected('model_bundle_info', 'Model bundle being served', labelnames=('version', 'created_at'))
+def collect_bundle_info():
+    if recommendation_engine is None:
+        return []
+    bundle = recommendation_engine.bundle
+    return [((bundle.version, bundle.manifest['created_at']), 1)]
+
+@metrics.REGISTRY.collected('catalog_tracks', 'Tracks in the served catalog')
+def collect_catalog_tracks():
+    if recommendation_engine is None:
+        return []
+    return [((), recommendation_engine.bundle.manifest['n_tracks'])]
+
+@metrics.REGISTRY.collected('training_job_running', 'Whether a training job is running in this process')
+def collect_training_running():
+    return [((), int(training_manager.running))]
+
+@metrics.REGISTRY.collected('process_resident_memory_bytes', 'Resident memory of this worker process')
+def collect_resident_memory():
+    rss = resident_memory()
+    return [((), rss)] if rss is not None else []
+
+def reload_current_bundle():
+    try:
+        swap_engine(load_engine())
+    except Exception as e:
+        app.logger.error(f"Failed to load the current model bundle: {str(e)}")
+    finally:
+        reload_lock.release()
+
+@app.before_request
+def check_for_new_bundle():
+    """Pick up a bundle published by another worker, loading it in the background"""
+    global last_bundle_check
+    now = time.monotonic()
+    if now - last_bundle_check < BUNDLE_CHECK_INTERVAL or training_manager.running:
+        return
+    last_bundle_check = now
+    
+    version = current_bundle_version()
+    serving = recommendation_engine.bundle.version if recommendation_engine is not None else None
+    if version and version != serving and reload_lock.acquire(blocking=False):
+        threading.Thread(target=reload_current_bundle, daemon=True).start()
 
 @app.route('/')
 def index():
@@ -49,20 +139,55 @@ def index():
 
 @app.route('/setup', methods=['POST'])
 def setup():
-    # This route will be called to train the model
-    import subprocess
-    subprocess.Popen(['python', 'train_model.py'])
-    return jsonify({'status': 'Training started. This may take a few minutes.'})
-
-@app.route('/search', methods=['GET'])
-def search():
-    query = request.args.get('query', '')
-    if not query:
-        return jsonify([])
-    
-    results = spotify_api.search_tracks(query)
+    # This route will be called to train the model in the background
+    data = request.get_json(silent=True) or {}
+    try:
+        chunksize = int(data['chunksize']) if data.get('chunksize') else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'chunksize must be an integer'}), 400
     
-    # Format the results
+    try:
+        job = training_manager.start(streaming=bool(data.get('streaming', False)), chunksize=chunksize)
+    except TrainingInProgress as e:
+        # A job running in another worker process has no state here
+        job = training_manager.last_job if training_manager.running else None
+        return jsonify({'error': str(e), 'job': job.to_dict() if job is not None else None}), 409
+    
+    return jsonify({
+        'status': 'Training started. This may take a few minutes.',
+        'job': job.to_dict()
+    }), 202
+
+@app.route('/setup/status', methods=['GET'])
+def setup_status():
+    """Progress of the latest training job and the model version being served"""
+    job = training_manager.last_job
+    return jsonify({
+        'job': job.to_dict() if job is not None else None,
+        'serving_version': recommendation_engine.bundle.version if recommendation_engine is not None else None
+    })
+
+@app.route('/model_info', methods=['GET'])
+def model_info():
+    """Version of the served model bundle and what its components cost to load"""
+    if recommendation_engine is None:
+        return jsonify({'error': 'Models not loaded'}), 404
+    
+    bundle = recommendation_engine.bundle
+    return jsonify({
+        'version': bundle.version,
+        'created_at': bundle.manifest['created_at'],
+        'n_tracks': bundle.manifest['n_tracks'],
+        'loaded_components': bundle.load_report
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Request latencies, Spotify and engine timings, cache hit rates and model version"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+def format_search_results(results):
+    """Format Spotify track search results for the front end"""
     formatted_results = []
     for track in results:
         image_url = None
@@ -76,50 +201,150 @@ def search():
             'album': track['album']['name'],
             'image': image_url
         })
+    return formatted_results
+
+@app.route('/search', methods=['GET'])
+def search():
+    query = request.args.get('query', '')
+    if not query:
+        return jsonify([])
+    
+    results = spotify_api.search_tracks(query)
     
-    return jsonify(formatted_results)
+    return jsonify(format_search_results(results))
+
+def parse_bounded_int(value, name, maximum):
+    """Parse a JSON field or query parameter as an int between 1 and maximum, raising ValueError otherwise"""
+    # bool is an int subclass, but true/false is never a meaningful count
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f'{name} must be an integer')
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+    if not 1 <= number <= maximum:
+        raise ValueError(f'{name} must be between 1 and {maximum}')
+    return number
+
+def parse_optional_number(args, key):
+    """A finite float query parameter, None when absent; raises ValueError when unparseable"""
+    value = args.get(key)
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f'{key} must be a number')
+    if not np.isfinite(number):
+        raise ValueError(f'{key} must be a finite number')
+    return number
+
+def parse_similarity_filters(args):
+    """
+    Similarity constraints from query parameters (see FilterIndex.compile).
+    
+    mood, activity and time_of_day may be repeated to accept any of several
+    labels; min_year/max_year and min_tempo/max_tempo bound ranges, and
+    exclude_artist may be repeated.
+    
+    Raises:
+        ValueError: On a range bound that is not a number
+    """
+    filters = {}
+    for column in ('mood', 'activity', 'time_of_day'):
+        values = args.getlist(column)
+        if values:
+            filters[column] = values
+    for column, low_key, high_key in (('release_year', 'min_year', 'max_year'), ('tempo', 'min_tempo', 'max_tempo')):
+        low, high = parse_optional_number(args, low_key), parse_optional_number(args, high_key)
+        if low is not None or high is not None:
+            filters[column] = (low, high)
+    artists = args.getlist('exclude_artist')
+    if artists:
+        filters['exclude_artists'] = artists
+    return filters
 
 @app.route('/recommendations', methods=['GET'])
 def get_recommendations():
     track_id = request.args.get('track_id', '')
+    try:
+        nprobe = parse_bounded_int(request.args['nprobe'], 'nprobe', MAX_NPROBE) if 'nprobe' in request.args else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     if not track_id or recommendation_engine is None:
         return jsonify([])
     
-    similar_tracks = recommendation_engine.get_similar_tracks(track_id)
+    try:
+        similar_tracks = recommendation_engine.get_similar_tracks(
+            track_id, nprobe=nprobe, filters=parse_similarity_filters(request.args)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(similar_tracks)
+
+@app.route('/recommendations/batch', methods=['POST'])
+def get_batch_recommendations():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    
+    track_ids = data.get('track_ids', [])
+    if not isinstance(track_ids, list) or not all(isinstance(track_id, str) for track_id in track_ids):
+        return jsonify({'error': 'track_ids must be a list of strings'}), 400
+    if len(track_ids) > MAX_BATCH_SEEDS:
+        return jsonify({
+            'error': f'At most {MAX_BATCH_SEEDS} track_ids are allowed per request'
+        }), 400
+    
+    try:
+        n_recommendations = parse_bounded_int(data.get('n_recommendations', 10), 'n_recommendations',
+                                              MAX_BATCH_RECOMMENDATIONS)
+        nprobe = parse_bounded_int(data['nprobe'], 'nprobe', MAX_NPROBE) if data.get('nprobe') is not None else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if not track_ids or recommendation_engine is None:
+        return jsonify({'results': {}, 'merged': [], 'missing': track_ids})
+    
+    similar_tracks = recommendation_engine.get_similar_tracks_batch(track_ids, n_recommendations, nprobe)
     
     return jsonify(similar_tracks)
 
 @app.route('/mood_playlist', methods=['GET'])
 def mood_playlist():
     mood = request.args.get('mood', '')
+    seed = request.args.get('seed', None, type=int)
     
     if not mood or recommendation_engine is None:
         return jsonify([])
     
-    tracks = recommendation_engine.get_mood_playlist(mood)
+    tracks = recommendation_engine.get_mood_playlist(mood, seed=seed)
     
     return jsonify(tracks)
 
 @app.route('/activity_playlist', methods=['GET'])
 def activity_playlist():
     activity = request.args.get('activity', '')
+    seed = request.args.get('seed', None, type=int)
     
     if not activity or recommendation_engine is None:
         return jsonify([])
     
-    tracks = recommendation_engine.get_activity_playlist(activity)
+    tracks = recommendation_engine.get_activity_playlist(activity, seed=seed)
     
     return jsonify(tracks)
 
 @app.route('/time_playlist', methods=['GET'])
 def time_playlist():
     time_of_day = request.args.get('time', '')
+    seed = request.args.get('seed', None, type=int)
     
     if not time_of_day or recommendation_engine is None:
         return jsonify([])
     
-    tracks = recommendation_engine.get_time_of_day_playlist(time_of_day)
+    tracks = recommendation_engine.get_time_of_day_playlist(time_of_day, seed=seed)
     
     return jsonify(tracks)
 
@@ -147,6 +372,31 @@ def diversity():
     
     return jsonify({'score': score})
 
+@app.route('/playlist_scores', methods=['POST'])
+def playlist_scores():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    
+    playlists = data.get('playlists', [])
+    if not isinstance(playlists, list) or not all(
+        isinstance(playlist, list) and all(isinstance(track_id, str) for track_id in playlist)
+        for playlist in playlists
+    ):
+        return jsonify({'error': 'playlists must be a list of lists of track IDs'}), 400
+    
+    if not playlists or recommendation_engine is None:
+        return jsonify({'scores': [{'compatibility': 0, 'diversity': 0, 'genre_overlap': 0} for _ in playlists]})
+    
+    if len(playlists) > MAX_SCORED_PLAYLISTS or sum(len(p) for p in playlists) > MAX_SCORED_TRACKS:
+        return jsonify({
+            'error': f'At most {MAX_SCORED_PLAYLISTS} playlists and {MAX_SCORED_TRACKS} tracks are allowed per request'
+        }), 400
+    
+    scores = recommendation_engine.score_playlists(playlists)
+    
+    return jsonify({'scores': scores})
+
 @app.route('/calculate_diversity_score', methods=['POST'])
 def calculate_diversity_score():
     """
@@ -188,22 +438,24 @@ def local_song_search():
     """
     Search for songs in the local database using fuzzy matching.
     """
-    if processed_tracks is None:
+    if recommendation_engine is None:
         return jsonify({'error': 'Processed tracks not loaded'})
     
+    processed_tracks = recommendation_engine.tracks_df
+    song_index = recommendation_engine.song_index
+    
     query = request.args.get('query', '').strip()
     if not query:
         return jsonify([])
     
     # Fuzzy search across track names
-    song_names = processed_tracks['track_name'].tolist()
-    matches = process.extract(query, song_names, limit=5)  # Limit to 5 results
+    matches = song_index.extract(query, limit=5)  # Limit to 5 results
     
     # Collect matching songs
     results = []
     for match, score in matches:
         if score >= 70:  # 70% similarity threshold
-            song_rows = processed_tracks[processed_tracks['track_name'] == match]
+            song_rows = processed_tracks.iloc[song_index.rows(match)]
             for _, song in song_rows.iterrows():
                 results.append({
                     'name': song['track_name'],
@@ -221,40 +473,39 @@ def local_song_recommendations():
     """
     Get recommendations for a song from the local database.
     """
-    if processed_tracks is None:
+    if recommendation_engine is None:
         return jsonify({'error': 'Processed tracks not loaded'})
     
+    processed_tracks = recommendation_engine.tracks_df
+    song_index = recommendation_engine.song_index
+    
     song_name = request.args.get('song_name', '').strip()
     if not song_name:
         return jsonify([])
     
     # Find the song in the dataset
-    song_row = processed_tracks[processed_tracks['track_name'] == song_name]
+    song_row = processed_tracks.iloc[song_index.rows(song_name)]
     
     if song_row.empty:
         # Use fuzzy matching if exact match not found
-        song_names = processed_tracks['track_name'].tolist()
-        match = process.extractOne(song_name, song_names)
+        match = song_index.extract_one(song_name)
         
         if match and match[1] >= 80:  # 80% similarity threshold
-            song_row = processed_tracks[processed_tracks['track_name'] == match[0]]
+            song_row = processed_tracks.iloc[song_index.rows(match[0])]
         else:
             return jsonify({'error': 'Song not found'})
     
     # Get the first matching song
     base_song = song_row.iloc[0]
     
-    # Find similar songs based on mood and activity
-    similar_songs = processed_tracks[
-        (processed_tracks['mood'] == base_song['mood']) | 
-        (processed_tracks['activity'] == base_song['activity'])
-    ]
-    
-    # Exclude the base song
-    similar_songs = similar_songs[similar_songs['track_name'] != base_song['track_name']]
+    # Closest songs sharing the base song's mood or activity, excluding the base song
+    row_filter = recommendation_engine.compile_filters({'mood': base_song['mood']}).union(
+        recommendation_engine.compile_filters({'activity': base_song['activity']})
+    ).exclude(song_index.rows(base_song['track_name']))
+    _, indices = recommendation_engine.find_filtered_neighbors(int(song_row.index[0]), row_filter, 5)
     
     # Take top 5 recommendations
-    recommendations = similar_songs.head(5)
+    recommendations = processed_tracks.iloc[indices[0][indices[0] >= 0]]
     
     results = []
     for _, song in recommendations.iterrows():
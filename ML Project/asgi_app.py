@@ -0,0 +1,150 @@
+"""
+Async (ASGI) serving mode.
+
+/search is served natively async: upstream Spotify calls go through a
+pooled, non-blocking HTTP client with a per-call timeout, so slow upstream
+calls never hold a worker thread. Every other route is served by the Flask
+app in app.py through a2wsgi's WSGI adapter on a bounded thread pool, which
+keeps the endpoints and response shapes identical to the WSGI app.
+
+Run with:
+
+    uvicorn asgi_app:app --workers 4
+"""
+import os
+import json
+import time
+import asyncio
+from urllib.parse import parse_qs
+import httpx
+from a2wsgi import WSGIMiddleware
+import app as flask_app_module
+import metrics
+
+flask_app = flask_app_module.app
+spotify_api = flask_app_module.spotify_api
+
+# Threads running the CPU-bound engine routes
+ENGINE_WORKERS = int(os.getenv('ENGINE_WORKERS', 4))
+
+# Upstream connection pool size and per-call timeout in seconds
+SPOTIFY_MAX_CONNECTIONS = int(os.getenv('SPOTIFY_MAX_CONNECTIONS', 20))
+SPOTIFY_TIMEOUT = float(os.getenv('SPOTIFY_TIMEOUT', 5))
+
+wsgi_app = WSGIMiddleware(flask_app, workers=ENGINE_WORKERS)
+upstream = None
+
+
+def create_upstream_client():
+    """Pooled async client for the Spotify Web API"""
+    return httpx.AsyncClient(
+        base_url=spotify_api.sp.prefix,
+        timeout=httpx.Timeout(SPOTIFY_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=SPOTIFY_MAX_CONNECTIONS,
+            max_keepalive_connections=SPOTIFY_MAX_CONNECTIONS
+        )
+    )
+
+
+async def send_response(send, status, body, headers=()):
+    await send({'type': 'http.response.start', 'status': status, 'headers': list(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, payload, status=200):
+    await send_response(
+        send, status, json.dumps(payload).encode(),
+        [(b'content-type', b'application/json')]
+    )
+
+
+async def search(scope, send):
+    """
+    Async equivalent of app.search with the same cache and response shape.
+
+    Returns:
+        tuple: (status code, seconds spent waiting on Spotify) for the request metrics
+    """
+    params = parse_qs(scope['query_string'].decode())
+    query = params.get('query', [''])[0]
+    if not query:
+        await send_json(send, [])
+        return 200, 0.0
+
+    cache_key = spotify_api.search_cache_key(query)
+    # The cache may read its SQLite store, so lookups stay off the event loop
+    results = await asyncio.to_thread(spotify_api.cache.get, cache_key)
+    upstream_seconds = 0.0
+
+    if results is None:
+        start = time.perf_counter()
+        error = None
+        try:
+            # Token refreshes are blocking, so they run on a thread
+            headers = await asyncio.to_thread(spotify_api.get_auth_headers)
+            response = await upstream.get(
+                'search', params={'q': query, 'type': 'track', 'limit': 10}, headers=headers
+            )
+            response.raise_for_status()
+            results = response.json()['tracks']['items']
+        except Exception as e:
+            # Token failures and malformed payloads are upstream errors too
+            error = e
+        upstream_seconds = time.perf_counter() - start
+        metrics.UPSTREAM_LATENCY.observe(upstream_seconds, operation='search')
+
+        if error is not None:
+            metrics.UPSTREAM_ERRORS.inc(operation='search')
+            if isinstance(error, httpx.TimeoutException):
+                status, payload = 504, {'error': 'Spotify search timed out'}
+            else:
+                status, payload = 502, {'error': 'Spotify search failed', 'details': str(error)}
+            await send_json(send, payload, status)
+            return status, upstream_seconds
+        await asyncio.to_thread(spotify_api.cache.set, cache_key, results)
+
+    await send_json(send, flask_app_module.format_search_results(results))
+    return 200, upstream_seconds
+
+
+async def lifespan(receive, send):
+    global upstream
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            upstream = create_upstream_client()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await upstream.aclose()
+            wsgi_app.executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    if scope['type'] != 'http':
+        return
+
+    if scope['path'] == '/search' and scope['method'] == 'GET':
+        start = time.perf_counter()
+        # Anything search does not answer itself reaches the client as a 500
+        status, upstream_seconds = 500, 0.0
+        try:
+            status, upstream_seconds = await search(scope, send)
+        finally:
+            metrics.observe_request('/search', 'GET', status, time.perf_counter() - start, upstream_seconds)
+        return
+
+    # Local routes run the Flask views on the adapter's bounded thread pool
+    await wsgi_app(scope, receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run('asgi_app:app', host='127.0.0.1', port=int(os.getenv('PORT', 8000)))
@@ -0,0 +1,404 @@
+"""
+Benchmarks for the training and serving hot paths on synthetic catalogs.
+
+For each catalog size a synthetic dataset is generated (and reused on later
+runs), the models are trained with every train_model.py stage timed, and
+the engine, SongRecommender and app routes are timed against the bundle.
+Spotify calls go to a local fake_spotify server. Each size runs in its own
+process so memory and caches do not carry over.
+
+Results are written as JSON, tagged with the git commit, so runs can be
+compared across commits:
+
+    python benchmark.py --sizes 10k 1m 10m --output results.json
+    python benchmark.py --sizes 10k --compare baseline.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import argparse
+import platform
+import threading
+import subprocess
+import multiprocessing
+from queue import Empty
+import numpy as np
+import pandas as pd
+
+# Catalog sizes accepted on the command line
+CATALOG_SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+
+# Sizes from which training runs out-of-core with train_model.train_streaming
+STREAMING_MIN_TRACKS = 1_000_000
+
+# Rows generated and written per chunk of a synthetic catalog
+GENERATE_CHUNKSIZE = 500_000
+
+BENCHMARK_DIR = 'benchmarks'
+FAKE_SPOTIFY_PORT = 8765
+
+# Timed calls per operation, after untimed warm-up calls
+REPEATS = 50
+WARMUP = 3
+
+# Tracks per scored playlist
+PLAYLIST_SIZE = 50
+
+# Relative slowdown reported as a regression by --compare
+REGRESSION_THRESHOLD = 0.10
+
+# Seconds between checks that a catalog size's child process is still alive
+RESULT_POLL_SECONDS = 5
+
+WORDS = ['love', 'night', 'dance', 'blue', 'fire', 'heart', 'dream', 'rain', 'sun', 'road',
+         'home', 'gold', 'wild', 'city', 'song', 'summer', 'light', 'river', 'storm', 'star']
+GENRES = ['pop', 'rock', 'hip hop', 'jazz', 'indie', 'edm', 'r&b', 'country', 'metal', 'folk',
+          'soul', 'latin', 'blues', 'punk', 'reggae', 'classical', 'house', 'techno', 'k-pop', 'trap']
+
+
+def generate_catalog(n_tracks, path, seed=0):
+    """
+    Write a synthetic dataset with the columns train_model.py expects.
+
+    Names and genre strings are drawn from fixed pools, audio features are
+    uniform over their usual ranges, and about 1% of rows repeat an earlier
+    track_id so deduplication is exercised.
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array(sorted({
+        ' '.join(rng.choice(WORDS, rng.integers(1, 4))).title() for _ in range(20000)
+    }))
+    genre_sets = np.array([
+        ', '.join(rng.choice(GENRES, rng.integers(0, 4), replace=False)) for _ in range(2000)
+    ])
+
+    tmp_path = path + '.tmp'
+    for start in range(0, n_tracks, GENERATE_CHUNKSIZE):
+        n = min(GENERATE_CHUNKSIZE, n_tracks - start)
+        ids = np.arange(start, start + n)
+        # Repeat an id from an earlier chunk for ~1% of rows
+        if start:
+            repeats = rng.random(n) < 0.01
+            ids[repeats] = rng.integers(0, start, repeats.sum())
+        chunk = pd.DataFrame({
+            'track_id': np.char.add('id', np.char.zfill(ids.astype(str), 9)),
+            'track_name': names[rng.integers(0, len(names), n)],
+            'artist': np.char.add('Artist ', rng.integers(0, max(2, n_tracks // 20), n).astype(str)),
+            'album': np.char.add('Album ', rng.integers(0, max(2, n_tracks // 10), n).astype(str)),
+            'release_year': rng.integers(1960, 2024, n),
+            'genres': genre_sets[rng.integers(0, len(genre_sets), n)],
+            'danceability': rng.random(n).round(3),
+            'energy': rng.random(n).round(3),
+            'valence': rng.random(n).round(3),
+            'tempo': rng.uniform(50, 200, n).round(3),
+            'loudness': rng.uniform(-40, 0, n).round(3),
+            'speechiness': rng.random(n).round(3),
+            'acousticness': rng.random(n).round(3),
+            'liveness': rng.random(n).round(3),
+            'instrumentalness': rng.random(n).round(3)
+        })
+        chunk.to_csv(tmp_path, mode='a' if start else 'w', header=not start, index=False)
+    os.replace(tmp_path, path)
+
+
+def time_calls(func, args_list, warmup=WARMUP):
+    """
+    Time func over a list of argument tuples.
+
+    Returns:
+        dict: Call count and latency statistics in milliseconds
+    """
+    for args in args_list[:warmup]:
+        func(*args)
+    timings = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings = np.array(timings)
+    return {
+        'calls': len(timings),
+        'mean_ms': round(float(timings.mean()), 3),
+        'p50_ms': round(float(np.percentile(timings, 50)), 3),
+        'p95_ms': round(float(np.percentile(timings, 95)), 3),
+        'min_ms': round(float(timings.min()), 3)
+    }
+
+
+def time_training(dataset_path, streaming):
+    """
+    Train a bundle, timing each stage reported through train_model's progress callback.
+
+    Returns:
+        dict: Seconds per stage (in order) and in total
+    """
+    import train_model
+
+    stages = {}
+    last = {'stage': None, 'start': time.perf_counter()}
+
+    def progress(message, fraction):
+        now = time.perf_counter()
+        if last['stage'] is not None:
+            stages[last['stage']] = stages.get(last['stage'], 0.0) + now - last['start']
+        last['stage'], last['start'] = message.rstrip('.'), now
+
+    start = time.perf_counter()
+    if streaming:
+        train_model.train_streaming(dataset_path, progress=progress)
+    else:
+        train_model.train(dataset_path, progress=progress)
+    end = time.perf_counter()
+    # The last stage runs until the bundle is published
+    stages[last['stage']] = stages.get(last['stage'], 0.0) + end - last['start']
+    return {
+        'mode': 'streaming' if streaming else 'in_memory',
+        'stages_s': {name: round(seconds, 3) for name, seconds in stages.items()},
+        'total_s': round(end - start, 3)
+    }
+
+
+def start_fake_spotify(port=FAKE_SPOTIFY_PORT):
+    """Serve fake_spotify in a background thread and point SpotifyAPI at it"""
+    from werkzeug.serving import make_server
+    import fake_spotify
+
+    # Keep the per-request log of the fake server out of the benchmark output
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', port, fake_spotify.create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['SPOTIFY_API_URL'] = f'http://127.0.0.1:{port}/v1/'
+    return server
+
+
+def time_serving(repeats=REPEATS, seed=0):
+    """Time the engine, SongRecommender and app routes on the current bundle"""
+    from spotify_utils import SpotifyAPI, RecommendationEngine
+    from song_recommender import SongRecommender
+    import app as app_module
+
+    rng = np.random.default_rng(seed)
+    feature_db = os.path.join(BENCHMARK_DIR, f'features-{uuid.uuid4().hex[:8]}.db')
+    engine = RecommendationEngine(spotify_api=SpotifyAPI(), feature_store_path=feature_db)
+    results = {}
+    try:
+        start = time.perf_counter()
+        engine.warm_up()
+        results['engine_warm_up'] = {'seconds': round(time.perf_counter() - start, 3)}
+
+        tracks = engine.tracks_df
+        n_tracks = len(tracks)
+        track_ids = tracks['track_id'].to_numpy()
+        names = tracks['track_name'].to_numpy()
+
+        def sample_ids(size):
+            return track_ids[rng.choice(n_tracks, size, replace=False)].tolist()
+
+        def sample_queries():
+            # Mix exact names with misspelt ones (one character dropped)
+            queries = []
+            for name in names[rng.choice(n_tracks, repeats, replace=False)]:
+                cut = rng.integers(0, len(name))
+                queries.append((name if rng.random() < 0.5 else name[:cut] + name[cut + 1:],))
+            return queries
+
+        seeds = [(track_id,) for track_id in sample_ids(repeats)]
+        results['get_similar_tracks'] = time_calls(engine.get_similar_tracks, seeds)
+
+        for method, column in (('get_mood_playlist', 'mood'),
+                               ('get_activity_playlist', 'activity'),
+                               ('get_time_of_day_playlist', 'time_of_day')):
+            labels = list(engine.category_buckets[column])
+            args = [(labels[i % len(labels)],) for i in range(repeats)]
+            results[method] = time_calls(getattr(engine, method), args)
+
+        playlists = [(sample_ids(PLAYLIST_SIZE),) for _ in range(repeats)]
+        results['calculate_compatibility_score'] = time_calls(engine.calculate_compatibility_score, playlists)
+        results['calculate_diversity_score'] = time_calls(engine.calculate_diversity_score, playlists)
+
+        # Playlists of tracks missing from the catalog are enriched from the fake Spotify API
+        off_catalog = [([f'bench{uuid.uuid4().hex[:18]}' for _ in range(PLAYLIST_SIZE)],) for _ in range(repeats)]
+        results['score_playlist_off_catalog'] = time_calls(engine.score_playlist, off_catalog)
+
+        start = time.perf_counter()
+        recommender = SongRecommender()
+        results['song_recommender_init'] = {'seconds': round(time.perf_counter() - start, 3)}
+        results['song_recommender_find_closest_song'] = time_calls(recommender.find_closest_song, sample_queries())
+        results['song_recommender_search_songs'] = time_calls(recommender.search_songs, sample_queries())
+
+        # Serve requests from the engine built above through the Flask test client
+        app_module.swap_engine(engine)
+        client = app_module.app.test_client()
+
+        def get(path, **params):
+            response = client.get(path, query_string=params)
+            assert response.status_code == 200, (path, response.status_code)
+
+        results['route_local_song_search'] = time_calls(
+            lambda query: get('/local_song_search', query=query), sample_queries()
+        )
+        mood = next(iter(engine.category_buckets['mood']))
+        results['route_mood_playlist'] = time_calls(
+            lambda: get('/mood_playlist', mood=mood), [()] * repeats
+        )
+        return results
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(feature_db + suffix):
+                os.remove(feature_db + suffix)
+
+
+def run_size(label, n_tracks, streaming, repeats, workdir, results):
+    """Generate, train and benchmark one catalog size inside workdir (run in a child process)"""
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    server = start_fake_spotify()
+    try:
+        dataset_path = f'catalog_{label}.csv'
+        generation = None
+        if not os.path.exists(dataset_path):
+            start = time.perf_counter()
+            generate_catalog(n_tracks, dataset_path)
+            generation = round(time.perf_counter() - start, 3)
+
+        result = {
+            'size': label,
+            'n_rows': n_tracks,
+            'generate_s': generation,
+            'training': time_training(dataset_path, streaming),
+            'serving': time_serving(repeats)
+        }
+        from model_bundle import resident_memory
+        rss = resident_memory()
+        result['rss_mb'] = round(rss / 2 ** 20, 1) if rss is not None else None
+        results.put(result)
+    except BaseException as e:
+        results.put({'size': label, 'error': f'{type(e).__name__}: {e}'})
+        raise
+    finally:
+        server.shutdown()
+
+
+def wait_for_result(label, process, queue):
+    """
+    The result of a run_size child, or an error entry if it exits without
+    sending one (e.g. killed by the OOM killer at the larger sizes).
+    """
+    while True:
+        try:
+            return queue.get(timeout=RESULT_POLL_SECONDS)
+        except Empty:
+            if process.is_alive():
+                continue
+        # The child may have sent its result just before exiting
+        try:
+            return queue.get(timeout=RESULT_POLL_SECONDS)
+        except Empty:
+            return {'size': label, 'error': f'Benchmark process exited with code {process.exitcode}'}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def latency_metrics(run):
+    """Flatten one run into {metric name: value}, lower is better for all of them"""
+    metrics = {}
+    for size in run['results']:
+        if 'error' in size:
+            continue
+        prefix = size['size']
+        for stage, seconds in size['training']['stages_s'].items():
+            metrics[f'{prefix}/train/{stage}'] = seconds
+        metrics[f'{prefix}/train/total'] = size['training']['total_s']
+        for name, stats in size['serving'].items():
+            metrics[f'{prefix}/{name}'] = stats.get('p50_ms', stats.get('seconds'))
+    return metrics
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """
+    Print metrics shared by two runs with their relative change.
+
+    Returns:
+        list: Names of metrics slower than the baseline by more than threshold
+    """
+    before, after = latency_metrics(baseline), latency_metrics(current)
+    regressions = []
+    print(f"Comparing {baseline.get('commit')} -> {current.get('commit')}")
+    for name in sorted(set(before) & set(after)):
+        change = (after[name] - before[name]) / before[name] if before[name] else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"  {name:<60} {before[name]:>10.3f} {after[name]:>10.3f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark training and serving on synthetic catalogs")
+    parser.add_argument('--sizes', nargs='+', default=['10k'], choices=list(CATALOG_SIZES),
+                        help="Catalog sizes to benchmark")
+    parser.add_argument('--repeats', type=int, default=REPEATS, help="Timed calls per operation")
+    parser.add_argument('--workdir', default=os.path.join(BENCHMARK_DIR, 'work'),
+                        help="Where synthetic catalogs and bundles are kept between runs")
+    parser.add_argument('--streaming', choices=['auto', 'always', 'never'], default='auto',
+                        help=f"Out-of-core training; 'auto' streams from {STREAMING_MIN_TRACKS} tracks")
+    parser.add_argument('--output', help="JSON results file, benchmarks/results-<commit>.json by default")
+    parser.add_argument('--compare', help="Earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    run = {
+        'commit': git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeats': args.repeats,
+        'results': []
+    }
+
+    context = multiprocessing.get_context('spawn')
+    for label in args.sizes:
+        n_tracks = CATALOG_SIZES[label]
+        streaming = args.streaming == 'always' or (args.streaming == 'auto' and n_tracks >= STREAMING_MIN_TRACKS)
+        print(f"Benchmarking {label} catalog ({'streaming' if streaming else 'in-memory'} training)...")
+        queue = context.Queue()
+        workdir = os.path.abspath(os.path.join(args.workdir, label))
+        process = context.Process(target=run_size, args=(label, n_tracks, streaming, args.repeats, workdir, queue))
+        process.start()
+        result = wait_for_result(label, process, queue)
+        process.join()
+        run['results'].append(result)
+        if 'error' in result:
+            print(f"  failed: {result['error']}")
+
+    output = args.output or os.path.join(BENCHMARK_DIR, f"results-{run['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(run, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), run)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {REGRESSION_THRESHOLD:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+Catalog lookup structures built at training time and memory-mapped at serve time.
+
+Both are plain .npy arrays, so every worker process maps the same pages
+instead of building its own dict or per-label arrays on the heap.
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+from external_sort import ExternalSorter, grouped_slots
+
+# Columns grouped by the category index
+CATEGORY_COLUMNS = ('mood', 'activity', 'time_of_day')
+
+# Rows read back at once when the writers finish an index
+WRITE_BLOCK_SIZE = 1 << 20
+
+
+def encode_ids(track_ids):
+    """Track ids as a fixed-width UTF-8 bytes array"""
+    return np.char.encode(np.asarray(track_ids, dtype=str), 'utf-8')
+
+
+def _load(path, name, mmap):
+    return np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r' if mmap else None)
+
+
+class TrackIdIndex:
+    """
+    Map track_ids to row positions with a sorted fixed-width id array.
+
+    Lookups are binary searches (vectorized for many ids) over an array that
+    can be memory-mapped, instead of a per-process hash table.
+    """
+
+    def __init__(self, sorted_ids, positions):
+        self.sorted_ids = sorted_ids
+        self.positions = positions
+
+    @classmethod
+    def build(cls, encoded_ids):
+        """Build from encode_ids output, in row order (chunks may be concatenated)"""
+        order = np.argsort(encoded_ids, kind='stable')
+        return cls(encoded_ids[order], order.astype(np.int64))
+
+    def __len__(self):
+        return len(self.sorted_ids)
+
+    def lookup(self, track_ids):
+        """
+        Row positions of many track_ids.
+
+        Returns:
+            np.ndarray: int64 positions, -1 where the id is not in the catalog
+        """
+        encoded = [str(track_id).encode('utf-8') for track_id in track_ids]
+        result = np.full(len(encoded), -1, dtype=np.int64)
+        if not encoded or not len(self.sorted_ids):
+            return result
+
+        # Longer ids cannot be in the catalog and would be truncated by the dtype
+        width = self.sorted_ids.dtype.itemsize
+        fits = np.array([len(key) <= width for key in encoded])
+        keys = np.array([key if ok else b'' for key, ok in zip(encoded, fits)], dtype=self.sorted_ids.dtype)
+
+        slots = np.minimum(np.searchsorted(self.sorted_ids, keys), len(self.sorted_ids) - 1)
+        found = fits & (self.sorted_ids[slots] == keys)
+        result[found] = self.positions[slots[found]]
+        return result
+
+    def get(self, track_id, default=None):
+        position = self.lookup([track_id])[0]
+        return int(position) if position >= 0 else default
+
+    def __contains__(self, track_id):
+        return self.lookup([track_id])[0] >= 0
+
+    def __getitem__(self, track_id):
+        position = self.get(track_id)
+        if position is None:
+            raise KeyError(track_id)
+        return position
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'sorted_ids.npy'), self.sorted_ids)
+        np.save(os.path.join(path, 'positions.npy'), self.positions)
+
+
+def load_track_id_index(path, mmap=True):
+    return TrackIdIndex(_load(path, 'sorted_ids', mmap), _load(path, 'positions', mmap))
+
+
+class TrackIdIndexWriter:
+    """
+    Write a TrackIdIndex chunk by chunk.
+
+    Chunks are sorted into runs in `spool_dir` and merged straight into the
+    memory-mapped output arrays, so the ids are never held in memory at once.
+    """
+
+    def __init__(self, path, spool_dir):
+        self.path = path
+        self.sorter = ExternalSorter(spool_dir, 'track-ids')
+
+    def write(self, track_ids):
+        """Append the track_ids of the next rows"""
+        start = self.sorter.n_pairs
+        self.sorter.add(encode_ids(track_ids), np.arange(start, start + len(track_ids)))
+
+    def close(self):
+        os.makedirs(self.path, exist_ok=True)
+        n_tracks = self.sorter.n_pairs
+        sorted_ids = np.lib.format.open_memmap(
+            os.path.join(self.path, 'sorted_ids.npy'), mode='w+',
+            dtype=self.sorter.key_dtype or np.dtype('S1'), shape=(n_tracks,)
+        )
+        positions = np.lib.format.open_memmap(
+            os.path.join(self.path, 'positions.npy'), mode='w+', dtype=np.int64, shape=(n_tracks,)
+        )
+        offset = 0
+        for keys, rows in self.sorter.merged():
+            sorted_ids[offset:offset + len(keys)] = keys
+            positions[offset:offset + len(rows)] = rows
+            offset += len(keys)
+        sorted_ids.flush()
+        positions.flush()
+
+
+class LabelCodes:
+    """
+    Integer label code per row of one column, written to a memory-mapped array.
+
+    Codes follow first appearance while chunks are added (-1 for missing
+    labels); `finish` renumbers them in sorted label order and counts them.
+    """
+
+    def __init__(self, path, n_rows):
+        self.codes = np.lib.format.open_memmap(path, mode='w+', dtype=np.int32, shape=(n_rows,))
+        self.vocabulary = {}
+        self.n_written = 0
+        self.labels = None
+        self.counts = None
+
+    def add(self, values):
+        codes, uniques = pd.factorize(pd.Series(values))
+        # The extra last entry maps pandas' -1 for missing values to -1
+        mapping = np.array(
+            [self.vocabulary.setdefault(str(label), len(self.vocabulary)) for label in uniques] + [-1],
+            dtype=np.int32
+        )
+        self.codes[self.n_written:self.n_written + len(codes)] = mapping[codes]
+        self.n_written += len(codes)
+
+    def finish(self, block_size=WRITE_BLOCK_SIZE):
+        self.labels = sorted(self.vocabulary)
+        remap = np.full(len(self.labels) + 1, -1, dtype=np.int32)
+        remap[[self.vocabulary[label] for label in self.labels]] = np.arange(len(self.labels))
+        self.counts = np.zeros(len(self.labels), dtype=np.int64)
+        for start in range(0, self.n_written, block_size):
+            block = remap[self.codes[start:start + block_size]]
+            self.codes[start:start + len(block)] = block
+            self.counts += np.bincount(block[block >= 0], minlength=len(self.labels))
+        self.codes.flush()
+
+    def blocks(self, block_size=WRITE_BLOCK_SIZE):
+        """Yield (start, codes) for consecutive blocks of rows"""
+        for start in range(0, self.n_written, block_size):
+            yield start, np.asarray(self.codes[start:start + block_size])
+
+
+class CategoryIndex:
+    """
+    Row positions grouped by label for each category column.
+
+    Per column, `rows` holds every row position ordered by label (ascending
+    positions within a label) and `offsets` marks where each label starts.
+    """
+
+    def __init__(self, labels, rows, offsets):
+        self.labels = labels
+        self.rows = rows
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, tracks, columns=CATEGORY_COLUMNS):
+        labels, rows, offsets = {}, {}, {}
+        for column in columns:
+            categories = tracks[column].astype('category').cat
+            codes = categories.codes.to_numpy()
+            order = np.argsort(codes, kind='stable')
+            # Rows without a label sort first and are skipped
+            start = np.count_nonzero(codes < 0)
+            counts = np.bincount(codes[codes >= 0], minlength=len(categories.categories))
+            labels[column] = [str(label) for label in categories.categories]
+            rows[column] = order[start:].astype(np.int64)
+            offsets[column] = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(labels, rows, offsets)
+
+    def buckets(self, column):
+        """Dict of label -> row positions (views into the shared arrays)"""
+        rows, offsets = self.rows[column], self.offsets[column]
+        return {
+            label: rows[offsets[i]:offsets[i + 1]]
+            for i, label in enumerate(self.labels[column])
+        }
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'labels.json'), 'w') as f:
+            json.dump(self.labels, f, indent=2)
+        for column in self.labels:
+            np.save(os.path.join(path, f'{column}_rows.npy'), self.rows[column])
+            np.save(os.path.join(path, f'{column}_offsets.npy'), self.offsets[column])
+
+
+class CategoryIndexWriter:
+    """Write a CategoryIndex chunk by chunk, keeping label codes in memory-mapped spool files"""
+
+    def __init__(self, path, n_tracks, spool_dir, columns=CATEGORY_COLUMNS):
+        self.path = path
+        self.codes = {
+            column: LabelCodes(os.path.join(spool_dir, f'category-{column}.npy'), n_tracks) for column in columns
+        }
+
+    def write(self, tracks):
+        for column, codes in self.codes.items():
+            codes.add(tracks[column])
+
+    def close(self):
+        os.makedirs(self.path, exist_ok=True)
+        labels = {}
+        for column, codes in self.codes.items():
+            codes.finish()
+            labels[column] = codes.labels
+            offsets = np.concatenate([[0], np.cumsum(codes.counts)]).astype(np.int64)
+            np.save(os.path.join(self.path, f'{column}_offsets.npy'), offsets)
+            rows = np.lib.format.open_memmap(
+                os.path.join(self.path, f'{column}_rows.npy'), mode='w+', dtype=np.int64, shape=(int(offsets[-1]),)
+            )
+            # Counting sort: rows land in label order, ascending within a label
+            cursors = offsets[:-1].copy()
+            for start, block in codes.blocks():
+                labelled = np.flatnonzero(block >= 0)
+                rows[grouped_slots(block[labelled], cursors)] = start + labelled
+            rows.flush()
+        with open(os.path.join(self.path, 'labels.json'), 'w') as f:
+            json.dump(labels, f, indent=2)
+
+
+def load_category_index(path, mmap=True):
+    with open(os.path.join(path, 'labels.json')) as f:
+        labels = json.load(f)
+    return CategoryIndex(
+        labels,
+        {column: _load(path, f'{column}_rows', mmap) for column in labels},
+        {column: _load(path, f'{column}_offsets', mmap) for column in labels}
+    )
@@ -0,0 +1,209 @@
+"""
+Clustering quality metrics for catalogs of any size under a memory budget.
+
+sklearn's silhouette_score builds an N x N distance matrix, so it needs
+O(N^2) time and memory. Here:
+
+- Calinski-Harabasz and Davies-Bouldin are computed exactly in two
+  streaming passes over row blocks: per-cluster counts and sums first,
+  then distances to the centroids.
+- The silhouette is estimated on independent stratified samples (every
+  cluster keeps its share of the sample) drawn during the second pass,
+  with a t confidence interval across the samples.
+
+Rows are read block by block, so features can be a memory-mapped array and
+labels a function assigning clusters to a block (e.g. kmeans.predict).
+Block sizes and the silhouette's distance chunks are derived from
+`memory_limit`, and `traced_memory` checks the peak against it.
+"""
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+from scipy import stats
+from sklearn import config_context
+from sklearn.metrics import silhouette_samples
+
+# Working memory budget in bytes
+DEFAULT_MEMORY_LIMIT = 256 * 2 ** 20
+
+# Rows per silhouette sample and number of independent samples
+SILHOUETTE_SAMPLE_SIZE = 10000
+SILHOUETTE_ROUNDS = 5
+
+# Smallest per-cluster share of a silhouette sample
+MIN_CLUSTER_SAMPLE = 20
+
+CONFIDENCE = 0.95
+
+# float64 block-sized arrays alive at once while scoring a block
+BLOCK_COPIES = 6
+
+
+def block_rows(n_dims, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """Rows per block so one block and its temporaries use a quarter of the budget"""
+    return max(1, memory_limit // 4 // (BLOCK_COPIES * n_dims * 8))
+
+
+def iter_blocks(features, labels, block_size):
+    """Yield (start, float64 rows, labels) for consecutive blocks of rows"""
+    for start in range(0, len(features), block_size):
+        block = np.asarray(features[start:start + block_size], dtype=np.float64)
+        block_labels = labels(block) if callable(labels) else labels[start:start + len(block)]
+        yield start, block, np.asarray(block_labels, dtype=np.int64)
+
+
+def cluster_sums(features, labels, block_size):
+    """Pass 1: (rows per label, feature sums per label) indexed by label value"""
+    counts = np.zeros(0, dtype=np.int64)
+    sums = np.zeros((0, features.shape[1]))
+    for _, block, block_labels in iter_blocks(features, labels, block_size):
+        n_labels = max(len(counts), int(block_labels.max()) + 1)
+        if n_labels > len(counts):
+            counts = np.pad(counts, (0, n_labels - len(counts)))
+            sums = np.pad(sums, ((0, n_labels - len(sums)), (0, 0)))
+        counts += np.bincount(block_labels, minlength=n_labels)
+        for j in range(block.shape[1]):
+            sums[:, j] += np.bincount(block_labels, weights=block[:, j], minlength=n_labels)
+    return counts, sums
+
+
+def sample_quotas(counts, sample_size):
+    """Rows drawn per cluster: proportional to its size, at least MIN_CLUSTER_SAMPLE, at most all"""
+    quotas = np.maximum(np.rint(sample_size * counts / counts.sum()), MIN_CLUSTER_SAMPLE).astype(np.int64)
+    return np.minimum(quotas, counts)
+
+
+def stratified_silhouette(samples, counts):
+    """Silhouette of one stratified sample, with each cluster weighted by its share of the catalog"""
+    rows, sample_labels = samples
+    values = silhouette_samples(rows, sample_labels)
+    present = np.flatnonzero(counts)
+    means = np.array([values[sample_labels == label].mean() for label in present])
+    return float(np.average(means, weights=counts[present]))
+
+
+def evaluate_clustering(features, labels, memory_limit=DEFAULT_MEMORY_LIMIT,
+                        sample_size=SILHOUETTE_SAMPLE_SIZE, n_rounds=SILHOUETTE_ROUNDS,
+                        confidence=CONFIDENCE, random_state=42):
+    """
+    Compute clustering metrics in bounded memory.
+
+    Args:
+        features (array): Feature matrix the clusters were fitted on (may be memory-mapped)
+        labels (array or callable): Cluster label per row, or a function
+            assigning labels to a block of rows
+        memory_limit (int): Working memory budget in bytes
+        sample_size (int): Rows per silhouette sample
+        n_rounds (int): Independent silhouette samples
+        confidence (float): Level of the silhouette confidence interval
+
+    Returns:
+        dict: silhouette estimate and (low, high) interval, exact
+        calinski_harabasz and davies_bouldin, and the sizes used
+    """
+    n_rows, n_dims = features.shape
+    block_size = block_rows(n_dims, memory_limit)
+    counts, sums = cluster_sums(features, labels, block_size)
+    present = np.flatnonzero(counts)
+    if len(present) < 2:
+        raise ValueError("Clustering metrics need at least 2 non-empty clusters")
+    centroids = np.zeros_like(sums)
+    centroids[present] = sums[present] / counts[present, None]
+
+    # A sample covering every row is the exact silhouette, no need to repeat it
+    quotas = sample_quotas(counts, sample_size)
+    if quotas.sum() == n_rows:
+        n_rounds = 1
+
+    # Within-cluster ordinals drawn for every round, found while streaming pass 2
+    rng = np.random.default_rng(random_state)
+    chosen = [[np.sort(rng.choice(count, quota, replace=False)) for count, quota in zip(counts, quotas)]
+              for _ in range(n_rounds)]
+    samples = [([], []) for _ in range(n_rounds)]
+    seen = np.zeros(len(counts), dtype=np.int64)
+
+    # Pass 2: distances to the own centroid, and the sampled rows
+    within = 0.0
+    distance_sums = np.zeros(len(counts))
+    for _, block, block_labels in iter_blocks(features, labels, block_size):
+        offsets = block - centroids[block_labels]
+        squared = np.einsum('ij,ij->i', offsets, offsets)
+        within += squared.sum()
+        distance_sums += np.bincount(block_labels, weights=np.sqrt(squared), minlength=len(counts))
+
+        for label in np.unique(block_labels):
+            members = np.flatnonzero(block_labels == label)
+            ordinals = seen[label] + np.arange(len(members))
+            for round_chosen, (rows, sample_labels) in zip(chosen, samples):
+                picked = members[np.isin(ordinals, round_chosen[label], assume_unique=True)]
+                rows.append(block[picked])
+                sample_labels.append(np.full(len(picked), label))
+            seen[label] += len(members)
+
+    # Calinski-Harabasz: between- over within-cluster dispersion
+    n_clusters = len(present)
+    mean = sums[present].sum(axis=0) / n_rows
+    between = float(np.sum(counts[present] * np.sum((centroids[present] - mean) ** 2, axis=1)))
+    calinski_harabasz = 1.0 if within == 0 else between * (n_rows - n_clusters) / (within * (n_clusters - 1))
+
+    # Davies-Bouldin: mean over clusters of the worst (S_i + S_j) / d(c_i, c_j)
+    spread = distance_sums[present] / counts[present]
+    centroid_distances = np.sqrt(np.sum((centroids[present, None] - centroids[None, present]) ** 2, axis=2))
+    if np.allclose(spread, 0) or np.allclose(centroid_distances, 0):
+        davies_bouldin = 0.0
+    else:
+        centroid_distances[centroid_distances == 0] = np.inf
+        davies_bouldin = float(np.mean(np.max((spread[:, None] + spread[None, :]) / centroid_distances, axis=1)))
+
+    # The silhouette's chunked distance computation gets a quarter of the budget
+    with config_context(working_memory=max(1, memory_limit // 4 // 2 ** 20)):
+        estimates = np.array([
+            stratified_silhouette((np.concatenate(rows), np.concatenate(sample_labels)), counts)
+            for rows, sample_labels in samples
+        ])
+    silhouette = float(estimates.mean())
+    if len(estimates) > 1:
+        margin = stats.t.ppf((1 + confidence) / 2, len(estimates) - 1) * estimates.std(ddof=1) / np.sqrt(len(estimates))
+    else:
+        margin = 0.0
+
+    return {
+        'n_rows': int(n_rows),
+        'n_clusters': int(n_clusters),
+        'silhouette': silhouette,
+        'silhouette_interval': (silhouette - margin, silhouette + margin),
+        'silhouette_samples': [float(estimate) for estimate in estimates],
+        'silhouette_sample_size': int(quotas.sum()),
+        'calinski_harabasz': float(calinski_harabasz),
+        'davies_bouldin': davies_bouldin,
+        'block_size': int(block_size)
+    }
+
+
+@contextmanager
+def traced_memory(limit=None):
+    """
+    Trace Python and numpy allocations made inside the block.
+
+    Yields a dict whose 'peak' is set on exit; raises MemoryError when the
+    peak exceeded `limit` bytes.
+    """
+    usage = {}
+    tracemalloc.start()
+    try:
+        yield usage
+    finally:
+        usage['peak'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    if limit is not None and usage['peak'] > limit:
+        raise MemoryError(f"Peak memory {usage['peak'] / 2 ** 20:.1f} MB exceeded the {limit / 2 ** 20:.0f} MB limit")
+
+
+def print_clustering_report(result, confidence=CONFIDENCE):
+    low, high = result['silhouette_interval']
+    print(f"Tracks: {result['n_rows']}, clusters: {result['n_clusters']}")
+    print(f"Silhouette Score: {result['silhouette']:.4f} "
+          f"({confidence:.0%} CI {low:.4f} to {high:.4f}, "
+          f"{len(result['silhouette_samples'])} stratified samples of {result['silhouette_sample_size']} tracks)")
+    print(f"Calinski-Harabasz Index: {result['calinski_harabasz']:.4f}")
+    print(f"Davies-Bouldin Index: {result['davies_bouldin']:.4f}")
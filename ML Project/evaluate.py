@@ -1,25 +1,22 @@
-import joblib
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from sklearn.metrics import silhouette_score
+from model_bundle import load_bundle
+from cluster_metrics import evaluate_clustering, print_clustering_report
+from quantized_features import exact_search
 
 # Load trained models
 print("Loading trained models...")
-scaler = joblib.load("models/scaler.pkl")
-pca = joblib.load("models/pca.pkl")
-kmeans = joblib.load("models/kmeans.pkl")
-nn_model = joblib.load("models/nearest_neighbors.pkl")
+bundle = load_bundle()
+scaler = bundle.scaler
+pca = bundle.pca
+kmeans = bundle.kmeans
+nn_model = bundle.nn_model
 
-# Load the processed dataset
+# Load the processed dataset; features are the memory-mapped scaled matrix the models were fitted on
 print("Loading processed dataset...")
-df = pd.read_csv("models/processed_tracks.csv")
-
-# Select feature columns
-audio_features = ['danceability', 'energy', 'valence', 'tempo', 'loudness', 
-                  'speechiness', 'acousticness', 'liveness', 'instrumentalness']
-
-features_scaled = df[audio_features].values
+store = bundle.track_store
+features_scaled = bundle.scaled_features
 
 # ==============================
 # 1. PCA Evaluation
@@ -42,27 +39,31 @@ plt.show()
 print("\n--- K-Means Clustering Evaluation ---")
 print("Inertia (Lower is better):", kmeans.inertia_)
 
-labels = kmeans.labels_
-silhouette = silhouette_score(features_scaled, labels)
-print("Silhouette Score (Closer to 1 is better):", silhouette)
+# Streaming metrics with a sampled silhouette, so memory stays bounded on any catalog size
+print_clustering_report(evaluate_clustering(features_scaled, kmeans.predict))
+print("(Silhouette closer to 1, Calinski-Harabasz higher and Davies-Bouldin lower are better)")
 
 # ==============================
 # 3. Nearest Neighbors Evaluation
 # ==============================
 print("\n--- Evaluating Nearest Neighbors Recommendations ---")
 sample_index = 5  # Change index to test different songs
-song_features = features_scaled[sample_index].reshape(1, -1)
+song_features = np.asarray(features_scaled[sample_index], dtype=np.float64).reshape(1, -1)
 
-distances, indices = nn_model.kneighbors(song_features)
+if nn_model is None:
+    distances, indices = exact_search(song_features, features_scaled, 10)
+else:
+    distances, indices = nn_model.kneighbors(song_features)
 
 # Display original song
 print("\nOriginal Song:")
-print(df.iloc[sample_index][['track_name', 'artist', 'genres', 'mood', 'activity']])
+print(store.frame([sample_index]).iloc[0][['track_name', 'artist', 'genres', 'mood', 'activity']])
 
 # Display recommended songs
 print("\nRecommended Songs:")
-for i, idx in enumerate(indices[0]):
-    print(f"{i+1}. {df.iloc[idx]['track_name']} by {df.iloc[idx]['artist']} - {df.iloc[idx]['genres']} - Mood: {df.iloc[idx]['mood']}")
+recommended = store.frame(indices[0])
+for i, (_, track) in enumerate(recommended.iterrows()):
+    print(f"{i+1}. {track['track_name']} by {track['artist']} - {track['genres']} - Mood: {track['mood']}")
 
 # ==============================
 # 4. Scaler Evaluation
@@ -0,0 +1,226 @@
+"""
+Offline recall and latency evaluation of the neighbour search backends.
+
+Samples seed tracks from a model bundle and computes their exact top-k
+neighbours with a blocked float32 scan. Then runs every backend over the
+same seeds in batches on a pool of worker threads and reports recall@k,
+queries per second, p50/p99 latency per call and index memory in one
+table:
+
+- exact: the sklearn NearestNeighbors model (SEARCH_BACKEND=exact), or a
+  blocked scan when the bundle was trained without it
+- graph: precomputed neighbour graph lookups (needs k <= the graph's k)
+- ivf(nprobe=N): the IVF index (SEARCH_BACKEND=ivf)
+- int8/float16(rerank=R): quantized scans re-ranked exactly (SEARCH_BACKEND=quantized)
+- pca(rerank=R): brute-force scan in the PCA space of the bundle,
+  re-ranked exactly in the full space when R > 0
+
+Usage:
+
+    python evaluate_indexes.py
+    python evaluate_indexes.py --queries 5000 --workers 8 --nprobe 4 8 16 32 --json
+"""
+import os
+import time
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from threadpoolctl import threadpool_limits
+from model_bundle import load_bundle
+from ann_index import DEFAULT_NPROBE
+from quantized_features import QuantizedFeatures, QUANTIZED_DTYPES, scan, rerank, exact_search
+
+BACKEND_FAMILIES = ('exact', 'graph', 'ivf', 'quantized', 'pca')
+
+# Defaults of the sweep
+N_QUERIES = 2000
+K = 10
+BATCH_SIZE = 1
+# One thread per core, so the latency percentiles are not inflated by time slicing
+WORKERS = min(4, os.cpu_count() or 1)
+NPROBE_VALUES = (1, 2, 4, DEFAULT_NPROBE, 16, 32)
+RERANK_FACTORS = (1, 4, 8)
+
+# Rows projected into the PCA space at once
+PROJECT_BLOCK_SIZE = 65536
+
+
+def pca_projection(pca, features, block_size=PROJECT_BLOCK_SIZE):
+    """float32 PCA coordinates of every row, projected block by block"""
+    projected = np.empty((len(features), pca.n_components_), dtype=np.float32)
+    for start in range(0, len(features), block_size):
+        projected[start:start + block_size] = pca.transform(
+            np.asarray(features[start:start + block_size], dtype=np.float64)
+        )
+    return projected
+
+
+def build_backends(bundle, k, families=BACKEND_FAMILIES, nprobe_values=NPROBE_VALUES,
+                   rerank_factors=RERANK_FACTORS):
+    """
+    Search functions to evaluate.
+
+    Returns:
+        list of (name, search, memory bytes), where search maps seed row
+        positions to neighbour row positions of shape (n_seeds, k)
+    """
+    features = bundle.scaled_features
+
+    def queries(positions):
+        return np.asarray(features[positions], dtype=np.float32)
+
+    backends = []
+    if 'exact' in families and bundle.nn_model is None:
+        backends.append(('exact', lambda positions: exact_search(queries(positions), features, k)[1], features.nbytes))
+    elif 'exact' in families:
+        nn_model = bundle.nn_model
+        backends.append((
+            'exact', lambda positions: nn_model.kneighbors(queries(positions).astype(np.float64), k)[1],
+            nn_model.n_samples_fit_ * nn_model.n_features_in_ * 8
+        ))
+
+    if 'graph' in families and bundle.knn_graph is not None and k <= bundle.knn_graph.k:
+        graph = bundle.knn_graph
+        backends.append((
+            'graph', lambda positions: graph.neighbors(positions, k)[1],
+            graph.indices.nbytes + graph.distances.nbytes
+        ))
+
+    if 'ivf' in families and bundle.ivf_index is not None:
+        ivf = bundle.ivf_index
+        size = sum(getattr(ivf, name).nbytes for name in ('centroids', 'list_offsets', 'list_rows', 'list_vectors'))
+        for nprobe in nprobe_values:
+            backends.append((
+                f'ivf(nprobe={nprobe})',
+                lambda positions, nprobe=nprobe: ivf.search(queries(positions), k, nprobe)[1],
+                size
+            ))
+
+    if 'quantized' in families:
+        for dtype in QUANTIZED_DTYPES:
+            quantized = bundle.quantized_features if bundle.quantized_features.dtype == dtype \
+                else QuantizedFeatures.build(features, dtype)
+            for factor in rerank_factors:
+                backends.append((
+                    f'{dtype}(rerank={factor})',
+                    lambda positions, quantized=quantized, factor=factor: quantized.search(
+                        queries(positions), k, exact_features=features, rerank_factor=factor
+                    )[1],
+                    quantized.nbytes
+                ))
+
+    if 'pca' in families:
+        pca = bundle.pca
+        projected = pca_projection(pca, features)
+
+        def pca_search(positions, factor):
+            candidates = scan(projected[positions], projected, k * max(factor, 1))[1]
+            if factor == 0:
+                return candidates
+            return rerank(queries(positions), candidates, features, k)[1]
+
+        for factor in (0,) + tuple(rerank_factors):
+            backends.append((
+                f'pca(rerank={factor})', lambda positions, factor=factor: pca_search(positions, factor),
+                projected.nbytes
+            ))
+
+    return backends
+
+
+def measure_backend(search, seeds, truth, batch_size=BATCH_SIZE, workers=WORKERS):
+    """
+    Run one backend over every seed and compare with the ground truth.
+
+    Returns:
+        dict: recall@k, queries per second, p50/p99 latency per call in ms
+    """
+    batches = [seeds[start:start + batch_size] for start in range(0, len(seeds), batch_size)]
+
+    def timed_search(batch):
+        start = time.perf_counter()
+        found = search(batch)
+        return found, time.perf_counter() - start
+
+    # One untimed call loads lazily loaded components and pages in the arrays
+    search(batches[0])
+
+    # Single-threaded BLAS per worker, so concurrent calls do not oversubscribe the cores
+    start = time.perf_counter()
+    with threadpool_limits(1), ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(timed_search, batches))
+    wall = time.perf_counter() - start
+
+    found = np.concatenate([batch_found for batch_found, _ in results])
+    latencies = np.array([seconds for _, seconds in results]) * 1000
+    hits = sum(len(np.intersect1d(f[f >= 0], t)) for f, t in zip(found, truth))
+    return {
+        'recall': hits / truth.size,
+        'qps': len(seeds) / wall,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99))
+    }
+
+
+def evaluate(bundle, n_queries=N_QUERIES, k=K, batch_size=BATCH_SIZE, workers=WORKERS,
+             families=BACKEND_FAMILIES, nprobe_values=NPROBE_VALUES, rerank_factors=RERANK_FACTORS,
+             random_state=42):
+    """
+    Evaluate every backend on the same sampled seed tracks.
+
+    Returns:
+        list of dicts, one per backend, with its name, memory and measurements
+    """
+    features = bundle.scaled_features
+    rng = np.random.default_rng(random_state)
+    seeds = rng.choice(len(features), min(n_queries, len(features)), replace=False)
+
+    print(f"Computing exact top-{k} for {len(seeds)} seed tracks...")
+    _, truth = scan(np.asarray(features[seeds], dtype=np.float32), features, k)
+
+    results = []
+    for name, search, memory in build_backends(bundle, k, families, nprobe_values, rerank_factors):
+        print(f"Measuring {name}...")
+        results.append({
+            'backend': name,
+            'memory_mb': memory / 2 ** 20,
+            **measure_backend(search, seeds, truth, batch_size, workers)
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare recall and latency of the neighbour search backends")
+    parser.add_argument('--bundle', default=None, help="Model bundle path, the current one by default")
+    parser.add_argument('--queries', type=int, default=N_QUERIES, help="Seed tracks sampled from the catalog")
+    parser.add_argument('--k', type=int, default=K, help="Neighbours per query")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Seeds per search call")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="Threads issuing search calls")
+    parser.add_argument('--backends', nargs='+', choices=BACKEND_FAMILIES, default=list(BACKEND_FAMILIES),
+                        help="Backend families to evaluate")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=list(NPROBE_VALUES), help="IVF nprobe settings")
+    parser.add_argument('--rerank', type=int, nargs='+', default=list(RERANK_FACTORS),
+                        help="Re-ranking factors of the quantized and PCA backends")
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    args = parser.parse_args()
+
+    bundle = load_bundle(args.bundle)
+    results = evaluate(
+        bundle, args.queries, args.k, args.batch_size, args.workers,
+        args.backends, args.nprobe, args.rerank
+    )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"\nModel bundle {bundle.version}: {len(bundle.scaled_features)} tracks, "
+          f"{args.queries} seeds, batches of {args.batch_size} on {args.workers} threads")
+    print(f"{'backend':<22} {'recall@' + str(args.k):>10} {'QPS':>10} {'p50 ms':>9} {'p99 ms':>9} {'memory':>11}")
+    for result in results:
+        print(f"{result['backend']:<22} {result['recall']:>10.4f} {result['qps']:>10.0f} "
+              f"{result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} {result['memory_mb']:>8.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
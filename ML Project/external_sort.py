@@ -0,0 +1,132 @@
+"""
+Building blocks for writing catalog-sized arrays without holding them in memory.
+
+- ExternalSorter: sorts (key, row) pairs added chunk by chunk. Each chunk is
+  sorted and written as a run of .npy files, and `merged` streams every pair
+  in key order by merging the memory-mapped runs a block at a time.
+- ArrayAppender: a 1-d .npy file of unknown final length, appended to in
+  chunks and given its header on close.
+- grouped_slots: destination slots of a block of rows in an array grouped
+  by label (a counting sort), so grouped layouts are filled block by block.
+"""
+import os
+import shutil
+import numpy as np
+
+# Pairs buffered across all runs while merging
+MERGE_BUFFER_BYTES = 64 * 2 ** 20
+
+# Smallest block read from each run, however many runs there are
+MIN_MERGE_BLOCK = 1024
+
+
+class ExternalSorter:
+    """Sort (key, row) pairs that do not fit in memory, see the module docstring"""
+
+    def __init__(self, spool_dir, name='sort'):
+        self.spool_dir = spool_dir
+        self.name = name
+        self.runs = []
+        self.n_pairs = 0
+        self.key_dtype = None
+
+    def add(self, keys, rows):
+        """Sort a chunk of pairs and spool it as one run"""
+        keys = np.asarray(keys)
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(keys):
+            return
+        order = np.argsort(keys, kind='stable')
+        run = os.path.join(self.spool_dir, f'{self.name}-{len(self.runs):05d}')
+        np.save(f'{run}-keys.npy', keys[order])
+        np.save(f'{run}-rows.npy', rows[order])
+        self.runs.append(run)
+        self.n_pairs += len(keys)
+        # Fixed-width byte keys of later chunks may be wider
+        self.key_dtype = keys.dtype if self.key_dtype is None else np.promote_types(self.key_dtype, keys.dtype)
+
+    def merged(self, buffer_bytes=MERGE_BUFFER_BYTES):
+        """
+        Yield (keys, rows) blocks that together hold every pair in key order.
+
+        Equal keys may be split across consecutive blocks.
+        """
+        runs = [(np.load(f'{run}-keys.npy', mmap_mode='r'), np.load(f'{run}-rows.npy', mmap_mode='r'))
+                for run in self.runs]
+        if not runs:
+            return
+        block_size = max(MIN_MERGE_BLOCK, buffer_bytes // (len(runs) * (self.key_dtype.itemsize + 8)))
+        cursors = [0] * len(runs)
+
+        while True:
+            active = [i for i, (keys, _) in enumerate(runs) if cursors[i] < len(keys)]
+            if not active:
+                return
+
+            # Pairs up to the smallest last key of a partly loaded run are final
+            bound = None
+            for i in active:
+                keys = runs[i][0]
+                end = cursors[i] + block_size
+                if end < len(keys) and (bound is None or keys[end - 1] < bound):
+                    bound = keys[end - 1]
+
+            block_keys, block_rows = [], []
+            for i in active:
+                keys, rows = runs[i]
+                stop = min(cursors[i] + block_size, len(keys))
+                if bound is not None:
+                    stop = cursors[i] + int(np.searchsorted(keys[cursors[i]:stop], bound, side='right'))
+                block_keys.append(np.asarray(keys[cursors[i]:stop], dtype=self.key_dtype))
+                block_rows.append(np.asarray(rows[cursors[i]:stop]))
+                cursors[i] = stop
+
+            keys, rows = np.concatenate(block_keys), np.concatenate(block_rows)
+            order = np.argsort(keys, kind='stable')
+            yield keys[order], rows[order]
+
+
+class ArrayAppender:
+    """Write a 1-d .npy array chunk by chunk when its length is only known at the end"""
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.n_written = 0
+        self._file = open(f'{path}.part', 'wb')
+
+    def append(self, values):
+        values = np.asarray(values, dtype=self.dtype)
+        values.tofile(self._file)
+        self.n_written += len(values)
+
+    def close(self):
+        """Prepend the .npy header; returns the array memory-mapped read-only"""
+        self._file.close()
+        with open(self.path, 'wb') as out, open(f'{self.path}.part', 'rb') as data:
+            np.lib.format.write_array_header_1_0(out, {
+                'descr': np.lib.format.dtype_to_descr(self.dtype),
+                'fortran_order': False,
+                'shape': (self.n_written,)
+            })
+            shutil.copyfileobj(data, out)
+        os.remove(f'{self.path}.part')
+        return np.load(self.path, mmap_mode='r')
+
+
+def grouped_slots(groups, cursors):
+    """
+    Destination slots of a block of rows in a layout grouped by `groups`.
+
+    Rows keep their block order within a group. `cursors` holds the next free
+    slot of every group and is advanced past the block's rows.
+    """
+    groups = np.asarray(groups, dtype=np.int64)
+    order = np.argsort(groups, kind='stable')
+    counts = np.bincount(groups, minlength=len(cursors))
+    starts = np.cumsum(counts) - counts
+    sorted_groups = groups[order]
+    slots = np.empty(len(groups), dtype=np.int64)
+    slots[order] = cursors[sorted_groups] + np.arange(len(groups)) - starts[sorted_groups]
+    cursors += counts
+    return slots
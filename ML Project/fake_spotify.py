@@ -0,0 +1,135 @@
+"""
+Local fake of the Spotify Web API endpoints used by this project.
+
+Responses are deterministic functions of the requested IDs, so enrichment,
+caching and benchmarks can run without network access or credentials.
+Point SpotifyAPI at it with:
+
+    SPOTIFY_API_URL=http://127.0.0.1:8001/v1/ python app.py
+"""
+import argparse
+import hashlib
+import itertools
+import threading
+from flask import Flask, request, jsonify
+
+# Maximum IDs accepted per request, as enforced by Spotify
+MAX_TRACKS_PER_REQUEST = 50
+MAX_AUDIO_FEATURES_PER_REQUEST = 100
+
+
+def _unit(track_id, salt):
+    """Deterministic pseudo-random number in [0, 1) for an ID"""
+    digest = hashlib.md5(f'{salt}:{track_id}'.encode()).digest()
+    return int.from_bytes(digest[:4], 'big') / 2 ** 32
+
+
+def fake_track(track_id):
+    artist_id = f'artist{int(_unit(track_id, "artist") * 1000)}'
+    return {
+        'id': track_id,
+        'name': f'Track {track_id}',
+        'artists': [{'id': artist_id, 'name': f'Artist {artist_id}'}],
+        'album': {
+            'name': f'Album {track_id[:4]}',
+            'images': [{'url': f'https://example.com/{track_id}.jpg', 'height': 640, 'width': 640}]
+        },
+        'popularity': int(_unit(track_id, 'popularity') * 100)
+    }
+
+
+def fake_audio_features(track_id):
+    return {
+        'id': track_id,
+        'danceability': _unit(track_id, 'danceability'),
+        'energy': _unit(track_id, 'energy'),
+        'key': int(_unit(track_id, 'key') * 12),
+        'loudness': -40 * _unit(track_id, 'loudness'),
+        'mode': int(_unit(track_id, 'mode') * 2),
+        'speechiness': _unit(track_id, 'speechiness'),
+        'acousticness': _unit(track_id, 'acousticness'),
+        'instrumentalness': _unit(track_id, 'instrumentalness'),
+        'liveness': _unit(track_id, 'liveness'),
+        'valence': _unit(track_id, 'valence'),
+        'tempo': 50 + 150 * _unit(track_id, 'tempo'),
+        'duration_ms': 120000 + int(_unit(track_id, 'duration') * 180000)
+    }
+
+
+def create_app(throttle_every=0, retry_after=0):
+    """
+    Build the fake API.
+
+    Args:
+        throttle_every (int): Answer every Nth request with 429, 0 to disable
+        retry_after (int): Retry-After seconds sent with 429 responses
+    """
+    app = Flask(__name__)
+    counter = itertools.count(1)
+    lock = threading.Lock()
+    app.config['request_log'] = []
+
+    @app.before_request
+    def throttle():
+        with lock:
+            n = next(counter)
+            app.config['request_log'].append(request.path)
+        if throttle_every and n % throttle_every == 0:
+            response = jsonify({'error': {'status': 429, 'message': 'API rate limit exceeded'}})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+
+    def requested_ids(limit):
+        ids = [i for i in request.args.get('ids', '').split(',') if i]
+        if len(ids) > limit:
+            return None
+        return ids
+
+    @app.route('/v1/search')
+    def search():
+        query = request.args.get('q', '')
+        limit = int(request.args.get('limit', 10))
+        prefix = hashlib.md5(query.encode()).hexdigest()[:8]
+        items = [fake_track(f'{prefix}{i:02d}') for i in range(limit)]
+        return jsonify({'tracks': {'items': items, 'total': limit}})
+
+    @app.route('/v1/tracks/')
+    @app.route('/v1/tracks')
+    def tracks():
+        ids = requested_ids(MAX_TRACKS_PER_REQUEST)
+        if ids is None:
+            return jsonify({'error': {'status': 400, 'message': 'Too many ids requested'}}), 400
+        return jsonify({'tracks': [fake_track(i) for i in ids]})
+
+    @app.route('/v1/tracks/<track_id>')
+    def track(track_id):
+        return jsonify(fake_track(track_id))
+
+    @app.route('/v1/audio-features/')
+    @app.route('/v1/audio-features')
+    def audio_features():
+        ids = requested_ids(MAX_AUDIO_FEATURES_PER_REQUEST)
+        if ids is None:
+            return jsonify({'error': {'status': 400, 'message': 'Too many ids requested'}}), 400
+        return jsonify({'audio_features': [fake_audio_features(i) for i in ids]})
+
+    @app.route('/v1/artists/<artist_id>')
+    def artist(artist_id):
+        return jsonify({'id': artist_id, 'name': f'Artist {artist_id}', 'genres': ['pop']})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake Spotify API")
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--throttle-every', type=int, default=0,
+                        help="Answer every Nth request with 429")
+    parser.add_argument('--retry-after', type=int, default=0)
+    args = parser.parse_args()
+    create_app(args.throttle_every, args.retry_after).run(port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import sqlite3
+import threading
+import time
+import pandas as pd
+
+# Default location of the off-catalog feature cache
+TRACK_FEATURE_DB_PATH = 'models/track_features.sqlite'
+
+# Column dtypes of enriched track feature frames
+TRACK_FEATURE_DTYPES = {
+    'track_id': 'object',
+    'name': 'object',
+    'artist': 'object',
+    'danceability': 'float64',
+    'energy': 'float64',
+    'key': 'int32',
+    'loudness': 'float64',
+    'mode': 'int32',
+    'speechiness': 'float64',
+    'acousticness': 'float64',
+    'instrumentalness': 'float64',
+    'liveness': 'float64',
+    'valence': 'float64',
+    'tempo': 'float64',
+    'duration_ms': 'int64'
+}
+
+SQLITE_TYPES = {'object': 'TEXT', 'float64': 'REAL', 'int32': 'INTEGER', 'int64': 'INTEGER'}
+
+# Track IDs per SELECT, below SQLite's bound-parameter limit
+LOOKUP_BATCH_SIZE = 500
+
+
+def empty_feature_frame():
+    return pd.DataFrame(columns=list(TRACK_FEATURE_DTYPES)).astype(TRACK_FEATURE_DTYPES)
+
+
+class TrackFeatureStore:
+    """
+    Persistent cache of audio features and metadata for tracks that are not
+    in the processed catalog, keyed by track_id.
+
+    Backed by SQLite so it survives restarts and is shared by every worker
+    on the host. Each thread uses its own connection.
+    """
+
+    def __init__(self, path=TRACK_FEATURE_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        columns = ', '.join(
+            f'{col} {SQLITE_TYPES[dtype]}' + (' PRIMARY KEY' if col == 'track_id' else ' NOT NULL')
+            for col, dtype in TRACK_FEATURE_DTYPES.items()
+        )
+        with self._connection() as conn:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS track_features ({columns}, fetched_at REAL NOT NULL)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, track_ids):
+        """
+        Look up cached features.
+
+        Returns:
+            DataFrame with TRACK_FEATURE_DTYPES columns for the track_ids that
+            are cached, in no particular order
+        """
+        track_ids = list(dict.fromkeys(track_ids))
+        columns = ', '.join(TRACK_FEATURE_DTYPES)
+        rows = []
+        for start in range(0, len(track_ids), LOOKUP_BATCH_SIZE):
+            batch = track_ids[start:start + LOOKUP_BATCH_SIZE]
+            placeholders = ', '.join('?' * len(batch))
+            rows.extend(self._connection().execute(
+                f'SELECT {columns} FROM track_features WHERE track_id IN ({placeholders})', batch
+            ).fetchall())
+        if not rows:
+            return empty_feature_frame()
+        return pd.DataFrame(rows, columns=list(TRACK_FEATURE_DTYPES)).astype(TRACK_FEATURE_DTYPES)
+
+    def put(self, features):
+        """Insert or refresh the rows of a feature frame"""
+        if len(features) == 0:
+            return
+        columns = list(TRACK_FEATURE_DTYPES) + ['fetched_at']
+        placeholders = ', '.join('?' * len(columns))
+        fetched_at = time.time()
+        rows = [
+            tuple(row) + (fetched_at,)
+            for row in features[list(TRACK_FEATURE_DTYPES)].astype(object).itertuples(index=False)
+        ]
+        with self._connection() as conn:
+            conn.executemany(
+                f'INSERT OR REPLACE INTO track_features ({", ".join(columns)}) VALUES ({placeholders})', rows
+            )
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM track_features').fetchone()[0]
@@ -0,0 +1,391 @@
+"""
+Per-attribute bitmaps for filtered similarity search.
+
+Every bitmap is a packed bit array over row positions (bit r of byte r // 8,
+little-endian bit order), so combining constraints costs one pass over
+n_tracks / 8 bytes whatever their selectivity:
+
+- mood / activity / time_of_day: one bitmap per label.
+- release_year / tempo: prefix bitmaps of rows below each of RANGE_BINS
+  quantile thresholds, giving a bin-aligned superset of any range. Exact
+  bounds are checked against the per-row values of the candidates only.
+- artist exclusion: row positions grouped by artist, cleared from the result.
+
+All arrays are written into the model bundle and memory-mapped at serve time.
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+from catalog_index import CATEGORY_COLUMNS, encode_ids, LabelCodes, WRITE_BLOCK_SIZE
+from external_sort import ExternalSorter, ArrayAppender
+
+# Default location of the filter index written by train_model.py
+FILTER_INDEX_PATH = 'models/filter_index'
+
+# Numeric columns filterable by an inclusive (low, high) range
+RANGE_COLUMNS = ('release_year', 'tempo')
+
+# Quantile bins per range column; a range bitmap over-selects by at most two bins
+RANGE_BINS = 32
+
+# Values sampled per range column to place the bin thresholds when writing chunk by chunk
+RANGE_SAMPLE_SIZE = 100000
+
+EXCLUDE_COLUMN = 'artist'
+
+# Filter key listing artists whose tracks are left out
+EXCLUDE_KEY = 'exclude_artists'
+
+# Set bits of every byte value, for popcount on NumPy releases without bitwise_count
+BYTE_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def pack(mask):
+    return np.packbits(mask, bitorder='little')
+
+
+def popcount(bitmap):
+    return int(BYTE_POPCOUNT[bitmap].sum(dtype=np.int64))
+
+
+def clear_bits(bitmap, rows):
+    """Clear the bits of the given row positions in place"""
+    rows = np.asarray(rows, dtype=np.int64)
+    np.bitwise_and.at(bitmap, rows >> 3, ~np.left_shift(1, rows & 7).astype(np.uint8))
+
+
+def bitmap_rows(bitmap):
+    """Row positions of the set bits, unpacking only the non-zero bytes"""
+    nonzero = np.flatnonzero(bitmap)
+    bits = np.unpackbits(bitmap[nonzero][:, None], axis=1, bitorder='little')
+    byte_index, bit = np.nonzero(bits)
+    return nonzero[byte_index].astype(np.int64) * 8 + bit
+
+
+class RowFilter:
+    """
+    Constraints compiled against a FilterIndex.
+
+    `bitmap` holds every row that may match (exact for labels and artist
+    exclusion, bin-aligned for ranges) and `ranges` the exact bounds still
+    to check on candidate rows.
+    """
+
+    def __init__(self, bitmap, ranges=()):
+        self.bitmap = bitmap
+        self.ranges = list(ranges)
+
+    @property
+    def estimated_count(self):
+        """Number of rows in the bitmap, an upper bound on the matching rows"""
+        return popcount(self.bitmap)
+
+    def allows(self, rows):
+        """Boolean mask of the given row positions that satisfy every constraint"""
+        rows = np.asarray(rows, dtype=np.int64)
+        valid = rows >= 0
+        safe = np.where(valid, rows, 0)
+        ok = valid & ((self.bitmap[safe >> 3] >> (safe & 7)) & 1).astype(bool)
+        for values, low, high in self.ranges:
+            selected = values[safe]
+            if low is not None:
+                ok &= selected >= low
+            if high is not None:
+                ok &= selected <= high
+        return ok
+
+    def rows(self):
+        """Row positions of every matching track, ascending"""
+        rows = bitmap_rows(self.bitmap)
+        return rows[self.allows(rows)] if self.ranges else rows
+
+    def union(self, other):
+        """Rows matching either filter; only for filters without range constraints"""
+        if self.ranges or other.ranges:
+            raise ValueError("Only label and artist filters can be combined with OR")
+        return RowFilter(self.bitmap | other.bitmap)
+
+    def exclude(self, rows):
+        """Copy of the filter with the given row positions removed"""
+        bitmap = self.bitmap.copy()
+        clear_bits(bitmap, rows)
+        return RowFilter(bitmap, self.ranges)
+
+
+class FilterIndex:
+    """Packed per-attribute bitmaps over the catalog, see the module docstring"""
+
+    def __init__(self, n_tracks, labels, bitmaps, thresholds, values, prefixes,
+                 artist_names, artist_rows, artist_offsets):
+        self.n_tracks = n_tracks
+        self.labels = labels
+        self.bitmaps = bitmaps
+        self.thresholds = thresholds
+        self.values = values
+        self.prefixes = prefixes
+        self.artist_names = artist_names
+        self.artist_rows = artist_rows
+        self.artist_offsets = artist_offsets
+
+    @classmethod
+    def build(cls, tracks):
+        """Build from a frame with the category, range and artist columns, one row per track"""
+        n_tracks = len(tracks)
+        labels, bitmaps = {}, {}
+        for column in CATEGORY_COLUMNS:
+            codes, uniques = pd.factorize(tracks[column], sort=True)
+            labels[column] = [str(label) for label in uniques]
+            bitmaps[column] = np.stack([pack(codes == i) for i in range(len(uniques))]) if len(uniques) \
+                else np.zeros((0, (n_tracks + 7) // 8), dtype=np.uint8)
+
+        thresholds, values, prefixes = {}, {}, {}
+        for column in RANGE_COLUMNS:
+            column_values = tracks[column].to_numpy()
+            present = column_values[~pd.isna(column_values)]
+            quantiles = np.linspace(0, 1, RANGE_BINS + 1)[1:-1]
+            thresholds[column] = np.unique(np.quantile(present, quantiles)) if len(present) else np.array([])
+            values[column] = column_values
+            prefixes[column] = np.stack([pack(column_values < t) for t in thresholds[column]]) \
+                if len(thresholds[column]) else np.zeros((0, (n_tracks + 7) // 8), dtype=np.uint8)
+
+        codes, uniques = pd.factorize(tracks[EXCLUDE_COLUMN], sort=True)
+        order = np.argsort(codes, kind='stable')
+        start = np.count_nonzero(codes < 0)
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        return cls(
+            n_tracks, labels, bitmaps, thresholds, values, prefixes,
+            encode_ids(np.asarray(uniques, dtype=str)),
+            order[start:].astype(np.int64),
+            np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        )
+
+    def all_rows(self):
+        """Bitmap with every row set"""
+        bitmap = np.full((self.n_tracks + 7) // 8, 0xFF, dtype=np.uint8)
+        if self.n_tracks % 8:
+            bitmap[-1] = (1 << (self.n_tracks % 8)) - 1
+        return bitmap
+
+    def label_bitmap(self, column, values):
+        """Rows whose `column` label is any of `values`"""
+        if isinstance(values, str):
+            values = [values]
+        bitmap = np.zeros((self.n_tracks + 7) // 8, dtype=np.uint8)
+        for value in values:
+            if value in self.labels[column]:
+                bitmap |= self.bitmaps[column][self.labels[column].index(value)]
+        return bitmap
+
+    def range_bitmap(self, column, low, high):
+        """Bin-aligned superset of the rows with low <= value <= high"""
+        thresholds, prefixes = self.thresholds[column], self.prefixes[column]
+        bitmap = self.all_rows()
+        if low is not None:
+            below = np.searchsorted(thresholds, low, side='right') - 1
+            if below >= 0:
+                bitmap &= ~prefixes[below]
+        if high is not None:
+            above = np.searchsorted(thresholds, high, side='right')
+            if above < len(thresholds):
+                bitmap &= prefixes[above]
+        return bitmap
+
+    def artist_positions(self, artists):
+        """Row positions of every track by the given artists (exact names)"""
+        names = self.artist_names
+        if not len(names) or not artists:
+            return np.empty(0, dtype=np.int64)
+        encoded = [str(artist).encode('utf-8') for artist in artists]
+        keys = np.array([key for key in encoded if len(key) <= names.dtype.itemsize], dtype=names.dtype)
+        slots = np.minimum(np.searchsorted(names, keys), len(names) - 1)
+        found = slots[names[slots] == keys]
+        return np.concatenate(
+            [self.artist_rows[self.artist_offsets[i]:self.artist_offsets[i + 1]] for i in found]
+            or [np.empty(0, dtype=np.int64)]
+        )
+
+    def compile(self, filters):
+        """
+        Compile constraints into a RowFilter.
+
+        Args:
+            filters (dict): Any of 'mood', 'activity', 'time_of_day' (a label
+                or list of labels), 'release_year', 'tempo' (inclusive
+                (low, high), either end may be None) and 'exclude_artists'
+                (list of artist names)
+
+        Returns:
+            RowFilter
+
+        Raises:
+            ValueError: On unknown keys or malformed ranges
+        """
+        bitmap = self.all_rows()
+        ranges = []
+        for key, value in filters.items():
+            if key in CATEGORY_COLUMNS:
+                bitmap &= self.label_bitmap(key, value)
+            elif key in RANGE_COLUMNS:
+                try:
+                    low, high = (None if v is None else float(v) for v in value)
+                except (TypeError, ValueError):
+                    raise ValueError(f"Filter '{key}' must be a (low, high) pair of numbers")
+                if low is not None and high is not None and low > high:
+                    raise ValueError(f"Filter '{key}' has low > high")
+                bitmap &= self.range_bitmap(key, low, high)
+                ranges.append((self.values[key], low, high))
+            elif key == EXCLUDE_KEY:
+                clear_bits(bitmap, self.artist_positions([value] if isinstance(value, str) else list(value)))
+            else:
+                raise ValueError(f"Unknown filter '{key}'")
+        return RowFilter(bitmap, ranges)
+
+    def save(self, path=FILTER_INDEX_PATH):
+        os.makedirs(path, exist_ok=True)
+        meta = {
+            'n_tracks': self.n_tracks,
+            'labels': self.labels,
+            'thresholds': {column: [float(t) for t in values] for column, values in self.thresholds.items()}
+        }
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        for column in self.labels:
+            np.save(os.path.join(path, f'{column}_bitmaps.npy'), self.bitmaps[column])
+        for column in self.thresholds:
+            np.save(os.path.join(path, f'{column}_values.npy'), self.values[column])
+            np.save(os.path.join(path, f'{column}_prefixes.npy'), self.prefixes[column])
+        np.save(os.path.join(path, 'artist_names.npy'), self.artist_names)
+        np.save(os.path.join(path, 'artist_rows.npy'), self.artist_rows)
+        np.save(os.path.join(path, 'artist_offsets.npy'), self.artist_offsets)
+
+
+class FilterIndexWriter:
+    """
+    Write a FilterIndex chunk by chunk.
+
+    Label codes and range values go to memory-mapped files and artists to an
+    external sort, and the bitmaps are packed from them block by block on
+    close. Range thresholds are quantiles of a uniform sample of the values;
+    any thresholds give correct results, since exact bounds are always
+    checked against the values.
+    """
+
+    def __init__(self, path, n_tracks, spool_dir, random_state=42):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.n_tracks = int(n_tracks)
+        self.n_written = 0
+        self.codes = {
+            column: LabelCodes(os.path.join(spool_dir, f'filter-{column}.npy'), n_tracks) for column in CATEGORY_COLUMNS
+        }
+        self.values = {
+            column: np.lib.format.open_memmap(
+                os.path.join(path, f'{column}_values.npy'), mode='w+', dtype=np.float64, shape=(n_tracks,)
+            )
+            for column in RANGE_COLUMNS
+        }
+        self.samples = {column: [] for column in RANGE_COLUMNS}
+        self.sample_rate = min(1.0, RANGE_SAMPLE_SIZE / max(self.n_tracks, 1))
+        self.rng = np.random.default_rng(random_state)
+        self.artists = ExternalSorter(spool_dir, 'artists')
+
+    def write(self, tracks):
+        """Append a chunk with the category, range and artist columns"""
+        end = self.n_written + len(tracks)
+        for column, codes in self.codes.items():
+            codes.add(tracks[column])
+        sampled = self.rng.random(len(tracks)) < self.sample_rate
+        for column in RANGE_COLUMNS:
+            values = pd.to_numeric(tracks[column], errors='coerce').to_numpy(dtype=np.float64)
+            self.values[column][self.n_written:end] = values
+            self.samples[column].append(values[sampled & ~np.isnan(values)])
+        artists = tracks[EXCLUDE_COLUMN]
+        named = ~pd.isna(artists).to_numpy()
+        self.artists.add(encode_ids(artists[named].astype(str)), self.n_written + np.flatnonzero(named))
+        self.n_written = end
+
+    def write_bitmaps(self, name, n_bitmaps, masks):
+        """Pack masks(start, stop) -> (n_bitmaps, rows) bools into an (n_bitmaps, n_bytes) array"""
+        bitmaps = np.lib.format.open_memmap(
+            os.path.join(self.path, f'{name}.npy'), mode='w+', dtype=np.uint8,
+            shape=(n_bitmaps, (self.n_tracks + 7) // 8)
+        )
+        # Blocks are a multiple of 8 rows, so each one packs into whole bytes
+        for start in range(0, self.n_tracks if n_bitmaps else 0, WRITE_BLOCK_SIZE):
+            stop = min(start + WRITE_BLOCK_SIZE, self.n_tracks)
+            bitmaps[:, start // 8:(stop + 7) // 8] = np.packbits(masks(start, stop), axis=1, bitorder='little')
+        bitmaps.flush()
+
+    def write_artists(self):
+        """Artist names in sorted order, their track rows grouped by name, and group offsets"""
+        names = ArrayAppender(os.path.join(self.path, 'artist_names.npy'), self.artists.key_dtype or np.dtype('S1'))
+        offsets = ArrayAppender(os.path.join(self.path, 'artist_offsets.npy'), np.int64)
+        rows = np.lib.format.open_memmap(
+            os.path.join(self.path, 'artist_rows.npy'), mode='w+', dtype=np.int64, shape=(self.artists.n_pairs,)
+        )
+        offsets.append([0])
+        written, previous = 0, None
+        for keys, block_rows in self.artists.merged():
+            rows[written:written + len(keys)] = block_rows
+            starts = np.flatnonzero(np.concatenate([[keys[0] != previous], keys[1:] != keys[:-1]]))
+            names.append(keys[starts])
+            boundaries = written + starts
+            offsets.append(boundaries[boundaries > 0])
+            written += len(keys)
+            previous = keys[-1]
+        offsets.append([written])
+        names.close()
+        offsets.close()
+        rows.flush()
+
+    def close(self):
+        if self.n_written != self.n_tracks:
+            raise ValueError(f"Filter index writer expected {self.n_tracks} tracks, got {self.n_written}")
+
+        labels = {}
+        for column, codes in self.codes.items():
+            codes.finish()
+            labels[column] = codes.labels
+            label_ids = np.arange(len(codes.labels))[:, None]
+            self.write_bitmaps(f'{column}_bitmaps', len(codes.labels),
+                               lambda start, stop: codes.codes[start:stop][None, :] == label_ids)
+
+        thresholds = {}
+        for column, values in self.values.items():
+            values.flush()
+            present = np.concatenate(self.samples[column])
+            quantiles = np.linspace(0, 1, RANGE_BINS + 1)[1:-1]
+            thresholds[column] = np.unique(np.quantile(present, quantiles)) if len(present) else np.array([])
+            column_thresholds = thresholds[column][:, None]
+            self.write_bitmaps(f'{column}_prefixes', len(thresholds[column]),
+                               lambda start, stop: values[start:stop][None, :] < column_thresholds)
+
+        self.write_artists()
+        meta = {
+            'n_tracks': self.n_tracks,
+            'labels': labels,
+            'thresholds': {column: [float(t) for t in values] for column, values in thresholds.items()}
+        }
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+
+def load_filter_index(path=FILTER_INDEX_PATH, mmap=True):
+    """Load a filter index written by FilterIndex.save, memory-mapping the arrays by default"""
+    mmap_mode = 'r' if mmap else None
+
+    def load(name):
+        return np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    return FilterIndex(
+        meta['n_tracks'],
+        meta['labels'],
+        {column: load(f'{column}_bitmaps') for column in meta['labels']},
+        {column: np.array(values) for column, values in meta['thresholds'].items()},
+        {column: load(f'{column}_values') for column in meta['thresholds']},
+        {column: load(f'{column}_prefixes') for column in meta['thresholds']},
+        load('artist_names'), load('artist_rows'), load('artist_offsets')
+    )
@@ -0,0 +1,209 @@
+import os
+import json
+import numpy as np
+from scipy import sparse
+from external_sort import ArrayAppender
+
+# Default location of the track x genre matrix
+GENRE_MATRIX_PATH = 'models/genre_matrix'
+
+# CSR arrays saved as separate .npy files so they can be memory-mapped
+MATRIX_ARRAYS = ('data', 'indices', 'indptr')
+
+# Rows of the playlist compared at a time when averaging pairwise Jaccard
+JACCARD_BLOCK_SIZE = 1024
+
+# Tracks per block when GenreMatrixWriter lays out the CSR arrays
+WRITE_BLOCK_SIZE = 1 << 20
+
+
+def split_genres(genres):
+    """Lower-cased, stripped, de-duplicated genre tokens of one comma-separated string"""
+    if not isinstance(genres, str):
+        return []
+    return list(dict.fromkeys(token for token in (g.strip() for g in genres.lower().split(',')) if token))
+
+
+def encode_genres(genres, vocabulary):
+    """
+    Genre ids of consecutive tracks, growing the vocabulary as new genres appear.
+
+    Returns:
+        (ids of every track concatenated, ascending within a track; genres per track)
+    """
+    indices, lengths = [], []
+    for value in genres:
+        ids = sorted(vocabulary.setdefault(token, len(vocabulary)) for token in split_genres(value))
+        indices.extend(ids)
+        lengths.append(len(ids))
+    return np.array(indices, dtype=np.int64), np.array(lengths, dtype=np.int64)
+
+
+def index_dtype(n_values):
+    """One index dtype for indices and indptr, so scipy can use them without copying"""
+    return np.int32 if n_values < np.iinfo(np.int32).max else np.int64
+
+
+class GenreMatrixBuilder:
+    """
+    Incrementally builds the genre vocabulary and the track x genre matrix in memory.
+
+    Genre strings are added in track order, in one go or chunk by chunk.
+    """
+
+    def __init__(self):
+        self.vocabulary = {}
+        self._indices = []
+        self._lengths = []
+
+    def add(self, genres):
+        """Append the genre strings of consecutive tracks"""
+        indices, lengths = encode_genres(genres, self.vocabulary)
+        self._indices.append(indices)
+        self._lengths.append(lengths)
+
+    def build(self):
+        indices = np.concatenate(self._indices or [np.empty(0, dtype=np.int64)])
+        lengths = np.concatenate(self._lengths or [np.empty(0, dtype=np.int64)])
+        dtype = index_dtype(len(indices))
+        indptr = np.zeros(len(lengths) + 1, dtype=dtype)
+        np.cumsum(lengths, out=indptr[1:])
+        matrix = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), indices.astype(dtype), indptr),
+            shape=(len(lengths), len(self.vocabulary))
+        )
+        return GenreMatrix(matrix, list(self.vocabulary))
+
+
+class GenreMatrixWriter:
+    """
+    Write a genre matrix chunk by chunk straight into its saved layout.
+
+    Genre ids and per-track counts are appended to spool files, and the CSR
+    arrays are written from them block by block on close, so only the
+    vocabulary is held in memory.
+    """
+
+    def __init__(self, path, spool_dir):
+        self.path = path
+        self.vocabulary = {}
+        self._indices = ArrayAppender(os.path.join(spool_dir, 'genre-indices.npy'), np.int64)
+        self._lengths = ArrayAppender(os.path.join(spool_dir, 'genre-lengths.npy'), np.int64)
+
+    def write(self, genres):
+        """Append the genre strings of consecutive tracks"""
+        indices, lengths = encode_genres(genres, self.vocabulary)
+        self._indices.append(indices)
+        self._lengths.append(lengths)
+
+    def close(self):
+        """Write the CSR arrays and vocabulary; returns the matrix loaded memory-mapped"""
+        spooled_indices, lengths = self._indices.close(), self._lengths.close()
+        os.makedirs(self.path, exist_ok=True)
+        n_values, n_tracks = len(spooled_indices), len(lengths)
+        dtype = index_dtype(n_values)
+
+        def output(name, array_dtype, size):
+            return np.lib.format.open_memmap(
+                os.path.join(self.path, f'{name}.npy'), mode='w+', dtype=array_dtype, shape=(size,)
+            )
+
+        data, indices, indptr = output('data', np.float32, n_values), output('indices', dtype, n_values), \
+            output('indptr', dtype, n_tracks + 1)
+        for start in range(0, n_values, WRITE_BLOCK_SIZE):
+            data[start:start + WRITE_BLOCK_SIZE] = 1
+            indices[start:start + WRITE_BLOCK_SIZE] = spooled_indices[start:start + WRITE_BLOCK_SIZE]
+        indptr[0] = 0
+        for start in range(0, n_tracks, WRITE_BLOCK_SIZE):
+            block = np.cumsum(lengths[start:start + WRITE_BLOCK_SIZE]) + indptr[start]
+            indptr[start + 1:start + 1 + len(block)] = block
+        for array in (data, indices, indptr):
+            array.flush()
+        del data, indices, indptr, spooled_indices, lengths
+        os.remove(self._indices.path)
+        os.remove(self._lengths.path)
+
+        with open(os.path.join(self.path, 'vocabulary.json'), 'w') as f:
+            json.dump({'shape': [n_tracks, len(self.vocabulary)], 'vocabulary': list(self.vocabulary)}, f)
+        return load_genre_matrix(self.path)
+
+
+def build_genre_matrix(genres):
+    """Build a GenreMatrix from one comma-separated genre string per track"""
+    builder = GenreMatrixBuilder()
+    builder.add(genres)
+    return builder.build()
+
+
+class GenreMatrix:
+    """
+    Sparse binary track x genre matrix (CSR) and its genre vocabulary.
+
+    Row i holds the genres of the track at row position i of the track
+    store, so genre statistics are sparse matrix operations instead of
+    string parsing.
+    """
+
+    def __init__(self, matrix, vocabulary):
+        self.matrix = matrix
+        self.vocabulary = list(vocabulary)
+        self.genre_counts = np.diff(matrix.indptr)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def genres(self, position):
+        """Genre names of one track"""
+        start, stop = self.matrix.indptr[position], self.matrix.indptr[position + 1]
+        return [self.vocabulary[i] for i in self.matrix.indices[start:stop]]
+
+    def unique_genre_count(self, positions):
+        """Number of distinct genres across the given tracks"""
+        return np.unique(self.matrix[positions].indices).size
+
+    def overlap(self, positions, other_positions):
+        """Number of genres shared by each pair of tracks, as a sparse matrix"""
+        return self.matrix[positions] @ self.matrix[other_positions].T
+
+    def jaccard(self, positions, other_positions):
+        """
+        Jaccard similarity of the genre sets of each pair of tracks.
+
+        Returns:
+            np.ndarray: len(positions) x len(other_positions), 0 where both
+            tracks have no genres
+        """
+        shared = self.overlap(positions, other_positions).toarray().astype(np.float64)
+        union = self.genre_counts[positions][:, None] + self.genre_counts[other_positions][None, :] - shared
+        return np.divide(shared, union, out=np.zeros_like(shared), where=union > 0)
+
+    def mean_pairwise_jaccard(self, positions, block_size=JACCARD_BLOCK_SIZE):
+        """Mean Jaccard similarity over the distinct pairs of the given tracks, in row blocks"""
+        positions = np.asarray(positions)
+        n = len(positions)
+        if n < 2:
+            return 0.0
+        total = 0.0
+        for start in range(0, n, block_size):
+            block = self.jaccard(positions[start:start + block_size], positions)
+            # Only count pairs (i, j) with j > i
+            upper = np.arange(block.shape[1])[None, :] > np.arange(start, start + len(block))[:, None]
+            total += block[upper].sum()
+        return float(total / (n * (n - 1) / 2))
+
+    def save(self, path=GENRE_MATRIX_PATH):
+        os.makedirs(path, exist_ok=True)
+        for name in MATRIX_ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self.matrix, name))
+        with open(os.path.join(path, 'vocabulary.json'), 'w') as f:
+            json.dump({'shape': list(self.matrix.shape), 'vocabulary': self.vocabulary}, f)
+
+
+def load_genre_matrix(path=GENRE_MATRIX_PATH, mmap=True):
+    """Load a genre matrix written by GenreMatrix.save, memory-mapping the arrays by default"""
+    mmap_mode = 'r' if mmap else None
+    with open(os.path.join(path, 'vocabulary.json')) as f:
+        meta = json.load(f)
+    data, indices, indptr = (np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode) for name in MATRIX_ARRAYS)
+    matrix = sparse.csr_matrix((data, indices, indptr), shape=tuple(meta['shape']), copy=False)
+    return GenreMatrix(matrix, meta['vocabulary'])
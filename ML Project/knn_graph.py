@@ -0,0 +1,116 @@
+import os
+import numpy as np
+from joblib import Parallel, delayed
+
+# Default location of the neighbour graph written by train_model.py
+KNN_GRAPH_PATH = 'models/knn_graph'
+
+# Neighbours stored per track (the track itself is the first entry)
+KNN_GRAPH_K = 20
+
+# Query rows processed per block; bounds the working memory of each worker
+KNN_GRAPH_BLOCK_SIZE = 8192
+
+INDICES_FILE = 'indices.npy'
+DISTANCES_FILE = 'distances.npy'
+
+
+class KNNGraph:
+    """
+    Precomputed k-nearest-neighbour graph over the catalog.
+
+    Row i of `indices` holds the row positions of the k nearest tracks to
+    track i (closest first, including track i itself) and row i of
+    `distances` the matching euclidean distances in scaled feature space.
+    """
+
+    def __init__(self, indices, distances):
+        self.indices = indices
+        self.distances = distances
+
+    @property
+    def k(self):
+        return self.indices.shape[1]
+
+    def __len__(self):
+        return len(self.indices)
+
+    def neighbors(self, positions, n_neighbors):
+        """Look up the first n_neighbors neighbours of the given row positions"""
+        n_neighbors = min(n_neighbors, self.k)
+        return (
+            np.asarray(self.distances[positions, :n_neighbors]),
+            np.asarray(self.indices[positions, :n_neighbors])
+        )
+
+
+def build_knn_graph(features, k=KNN_GRAPH_K, path=KNN_GRAPH_PATH, nn_model=None,
+                    block_size=KNN_GRAPH_BLOCK_SIZE, n_jobs=-1, search=None):
+    """
+    Compute the full k-nearest-neighbour graph in blocks across multiple cores.
+
+    The graph is written straight into memory-mapped .npy files, so only one
+    block of query results per worker is held in memory at a time.
+
+    Args:
+        features (array): Scaled feature matrix, one row per track
+        k (int): Neighbours stored per track
+        path (str): Directory to write the graph into
+        nn_model (NearestNeighbors): Fitted exact model, fitted here if omitted
+        block_size (int): Query rows per block
+        n_jobs (int): Number of worker threads, -1 for all cores
+        search (callable): (queries, k) -> (distances, indices) used instead
+            of nn_model, e.g. an approximate search over features larger
+            than memory
+
+    Returns:
+        KNNGraph backed by the written files
+    """
+    k = min(k, len(features))
+    if search is None:
+        features = np.asarray(features)
+        if nn_model is None:
+            from sklearn.neighbors import NearestNeighbors
+            nn_model = NearestNeighbors(n_neighbors=k).fit(features)
+
+        def search(queries, n_neighbors):
+            return nn_model.kneighbors(queries, n_neighbors=n_neighbors)
+
+    os.makedirs(path, exist_ok=True)
+    indices = np.lib.format.open_memmap(
+        os.path.join(path, INDICES_FILE), mode='w+', dtype=np.int32, shape=(len(features), k)
+    )
+    distances = np.lib.format.open_memmap(
+        os.path.join(path, DISTANCES_FILE), mode='w+', dtype=np.float32, shape=(len(features), k)
+    )
+
+    def query_block(start):
+        block_distances, block_indices = search(np.asarray(features[start:start + block_size]), k)
+        indices[start:start + len(block_indices)] = block_indices
+        distances[start:start + len(block_distances)] = block_distances
+
+    # Tree and brute-force queries release the GIL, so threads share the
+    # fitted model and the output files without copying them
+    Parallel(n_jobs=n_jobs, prefer='threads')(
+        delayed(query_block)(start) for start in range(0, len(features), block_size)
+    )
+
+    indices.flush()
+    distances.flush()
+    return KNNGraph(indices, distances)
+
+
+def knn_graph_exists(path=KNN_GRAPH_PATH):
+    return all(
+        os.path.exists(os.path.join(path, name)) for name in (INDICES_FILE, DISTANCES_FILE)
+    )
+
+
+def load_knn_graph(path=KNN_GRAPH_PATH, mmap=True):
+    """Load a neighbour graph, memory-mapping the arrays by default"""
+    mmap_mode = 'r' if mmap else None
+    indices = np.load(os.path.join(path, INDICES_FILE), mmap_mode=mmap_mode)
+    distances = np.load(os.path.join(path, DISTANCES_FILE), mmap_mode=mmap_mode)
+    if indices.shape != distances.shape:
+        raise ValueError(f"Neighbour graph at {path} is inconsistent: array shapes do not match")
+    return KNNGraph(indices, distances)
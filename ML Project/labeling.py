@@ -0,0 +1,94 @@
+import operator
+import numpy as np
+import pandas as pd
+
+# Comparison operators usable in label rules
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+# Declarative label rules. Each label family maps to an ordered list of
+# (label, conditions) pairs and a default. The first rule whose conditions
+# all hold wins. A condition is (feature, op, value), or
+# (feature, 'between', (low, high)) for an inclusive range. New families
+# (e.g. a 'season' tag) only need a new entry here.
+LABEL_RULES = {
+    'mood': {
+        'rules': [
+            # High valence and energy = Happy
+            ('Happy', [('valence', '>', 0.6), ('energy', '>', 0.6)]),
+            # Low valence, high energy = Angry
+            ('Angry', [('valence', '<', 0.4), ('energy', '>', 0.6)]),
+            # High valence, low energy = Relaxed
+            ('Relaxed', [('valence', '>', 0.6), ('energy', '<', 0.4)]),
+            # Low valence, low energy = Sad
+            ('Sad', [('valence', '<', 0.4), ('energy', '<', 0.4)]),
+        ],
+        'default': 'Neutral'
+    },
+    'activity': {
+        'rules': [
+            # High tempo and energy = Workout
+            ('Workout', [('tempo', '>', 120), ('energy', '>', 0.7)]),
+            # High acousticness, low energy = Study/Focus
+            ('Study/Focus', [('acousticness', '>', 0.6), ('energy', '<', 0.5)]),
+            # High danceability and energy = Party
+            ('Party', [('danceability', '>', 0.7), ('energy', '>', 0.6)]),
+            # Moderate tempo, low energy = Relaxation
+            ('Relaxation', [('tempo', 'between', (70, 110)), ('energy', '<', 0.4)]),
+        ],
+        'default': 'General'
+    },
+    'time_of_day': {
+        'rules': [
+            # High energy and tempo = Morning
+            ('Morning', [('energy', '>', 0.7), ('tempo', '>', 110)]),
+            # Moderate energy and valence = Afternoon
+            ('Afternoon', [('energy', 'between', (0.4, 0.7)), ('valence', '>=', 0.5)]),
+            # Low energy, low tempo = Evening
+            ('Evening', [('energy', '<', 0.4), ('tempo', '<', 100)]),
+            # Low energy, high valence = Night
+            ('Night', [('energy', '<', 0.5), ('valence', '>', 0.6)]),
+        ],
+        'default': 'Any Time'
+    }
+}
+
+
+def _condition_mask(df, feature, op, value):
+    """Evaluate a single rule condition as a whole-column boolean mask"""
+    values = df[feature].to_numpy()
+    if op == 'between':
+        low, high = value
+        return (values >= low) & (values <= high)
+    return OPERATORS[op](values, value)
+
+
+def assign_label_family(df, family):
+    """
+    Assign one label family to every row with first-match-wins semantics.
+
+    Args:
+        df (DataFrame): Tracks with the audio features referenced by the rules
+        family (dict): Entry of LABEL_RULES with 'rules' and 'default'
+
+    Returns:
+        numpy array of labels, one per row
+    """
+    labels = [label for label, _ in family['rules']]
+    masks = [
+        np.logical_and.reduce([_condition_mask(df, *condition) for condition in conditions])
+        for _, conditions in family['rules']
+    ]
+    return np.select(masks, labels, default=family['default']).astype(object)
+
+
+def assign_labels(df, rules=LABEL_RULES):
+    """Assign every label family in `rules`, returning one column per family"""
+    return pd.DataFrame(
+        {name: assign_label_family(df, family) for name, family in rules.items()},
+        index=df.index
+    )
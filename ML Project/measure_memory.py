@@ -0,0 +1,144 @@
+"""
+Measure serving memory per worker process with shared vs private arrays.
+
+Starts N worker processes that each open the current model bundle, warm up
+the engine and answer a few queries, then reports every worker's RSS and
+PSS (proportional set size, where pages shared by k processes count 1/k)
+from /proc/self/smaps_rollup. With memory-mapped arrays the PSS per worker
+falls as workers are added; with private copies it stays flat.
+
+Usage:
+
+    python measure_memory.py                 # 1, 2, 4 and 8 workers
+    python measure_memory.py --workers 1 4 16
+"""
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from queue import Empty
+
+# Worker counts measured by default
+WORKER_COUNTS = (1, 2, 4, 8)
+
+# Seed tracks queried by each worker before measuring
+SAMPLE_QUERIES = 50
+
+# Seconds a worker may take to load and warm up before the measurement is abandoned
+WORKER_TIMEOUT = 600
+
+# Seconds between checks that every worker is still alive
+RESULT_POLL_SECONDS = 1
+
+
+def memory_usage():
+    """RSS and PSS of this process in bytes (Linux only)"""
+    usage = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            fields = line.split()
+            if fields[0] in ('Rss:', 'Pss:'):
+                usage[fields[0][:-1].lower()] = int(fields[1]) * 1024
+    return usage
+
+
+def worker(mmap, bundle_path, ready, measure, results):
+    # Imported in the worker so the parent process stays small
+    from spotify_utils import RecommendationEngine
+
+    engine = RecommendationEngine(bundle_path, feature_store_path=None, mmap=mmap).warm_up()
+    track_ids = engine.tracks_df['track_id'].iloc[:SAMPLE_QUERIES].tolist()
+    for track_id in track_ids:
+        engine.get_similar_tracks(track_id)
+    engine.get_similar_tracks_batch(track_ids)
+    engine.get_mood_playlist('Happy', seed=0)
+    engine.score_playlist(track_ids)
+
+    # Measure once every worker is loaded, so shared pages are split between all of them
+    ready.wait(WORKER_TIMEOUT)
+    results.put(memory_usage())
+    measure.wait(WORKER_TIMEOUT)
+
+
+def measure(n_workers, mmap, bundle_path=None):
+    """
+    Run n_workers serving processes and collect their memory usage.
+
+    Returns:
+        dict: Worker count, mode and the total and per-worker RSS and PSS in MB
+
+    Raises:
+        RuntimeError: If a worker exits early or does not report within WORKER_TIMEOUT
+    """
+    context = multiprocessing.get_context('spawn')
+    ready = context.Barrier(n_workers)
+    done = context.Barrier(n_workers + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(mmap, bundle_path, ready, done, results))
+        for _ in range(n_workers)
+    ]
+    for process in processes:
+        process.start()
+    usages = []
+    deadline = time.monotonic() + WORKER_TIMEOUT
+    while len(usages) < n_workers:
+        try:
+            usages.append(results.get(timeout=RESULT_POLL_SECONDS))
+        except Empty:
+            crashed = any(process.exitcode is not None for process in processes)
+            if crashed or time.monotonic() > deadline:
+                # Release workers blocked on the barriers before stopping them
+                ready.abort()
+                done.abort()
+                for process in processes:
+                    process.terminate()
+                    process.join()
+                raise RuntimeError(
+                    f"{'A worker exited early' if crashed else 'Workers timed out'}; "
+                    f"worker exit codes: {[process.exitcode for process in processes]}"
+                )
+    done.wait(WORKER_TIMEOUT)
+    for process in processes:
+        process.join()
+
+    total_rss = sum(usage['rss'] for usage in usages) / 2 ** 20
+    total_pss = sum(usage['pss'] for usage in usages) / 2 ** 20
+    return {
+        'workers': n_workers,
+        'mode': 'shared' if mmap else 'private',
+        'total_rss_mb': round(total_rss, 1),
+        'total_pss_mb': round(total_pss, 1),
+        'pss_per_worker_mb': round(total_pss / n_workers, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-worker memory with shared vs private arrays")
+    parser.add_argument('--workers', type=int, nargs='+', default=list(WORKER_COUNTS),
+                        help="Worker counts to measure")
+    parser.add_argument('--bundle', default=None, help="Model bundle path, the current one by default")
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    args = parser.parse_args()
+
+    try:
+        results = [
+            measure(n_workers, mmap, args.bundle)
+            for n_workers in args.workers
+            for mmap in (True, False)
+        ]
+    except RuntimeError as e:
+        sys.exit(f"Memory measurement failed: {e}")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'workers':>7} {'mode':>8} {'total RSS':>12} {'total PSS':>12} {'PSS/worker':>12}")
+    for result in results:
+        print(f"{result['workers']:>7} {result['mode']:>8} {result['total_rss_mb']:>9.1f} MB "
+              f"{result['total_pss_mb']:>9.1f} MB {result['pss_per_worker_mb']:>9.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+Counters and histograms are plain Python objects guarded by a lock, so
+recording a value costs a dict lookup, a bisect and a few additions and can
+stay on under full load. Values that already live elsewhere (cache stats,
+the served bundle) are read by collectors when /metrics is scraped instead
+of being kept in sync.
+
+Metrics are per process: with several workers, scrape each of them.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Histogram buckets in seconds, from sub-millisecond lookups to slow upstream calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def family_name(metric):
+    """Name on the HELP/TYPE lines; counter samples and their family both end in _total"""
+    return metric.name + '_total' if metric.type == 'counter' else metric.name
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield family_name(self), format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        names = self.labelnames + ('le',)
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', format_labels(names, key + (format_value(bound),)), cumulative
+            labels = format_labels(self.labelnames, key)
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+class Collected:
+    """Metric whose samples are produced by a callback at scrape time"""
+
+    def __init__(self, name, documentation, type, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.type = type
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        for key, value in self.collect():
+            yield family_name(self), format_labels(self.labelnames, key), value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collected(self, name, documentation, type='gauge', labelnames=()):
+        """Decorator registering a callback that yields (label values tuple, value) pairs"""
+        def register(collect):
+            self.register(Collected(name, documentation, type, labelnames, collect))
+            return collect
+        return register
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception:
+                # A failing collector must not break the whole scrape
+                continue
+            lines.append(f'# HELP {family_name(metric)} {metric.documentation}')
+            lines.append(f'# TYPE {family_name(metric)} {metric.type}')
+            lines.extend(f'{name}{labels} {format_value(value)}' for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Time spent serving a request, by route', ('route', 'method')
+)
+REQUEST_UPSTREAM = REGISTRY.histogram(
+    'http_request_upstream_seconds', 'Time a request spent waiting on Spotify', ('route',)
+)
+REQUEST_COMPUTE = REGISTRY.histogram(
+    'http_request_compute_seconds', 'Time a request spent outside Spotify calls', ('route',)
+)
+REQUESTS = REGISTRY.counter(
+    'http_requests', 'Requests served, by route and status code', ('route', 'method', 'status')
+)
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    'spotify_request_duration_seconds', 'Duration of Spotify API calls', ('operation',)
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    'spotify_request_errors', 'Spotify API calls that raised, by operation', ('operation',)
+)
+ENGINE_LATENCY = REGISTRY.histogram(
+    'engine_operation_duration_seconds', 'Duration of RecommendationEngine operations', ('operation',)
+)
+FEATURE_STORE_LOOKUPS = REGISTRY.counter(
+    'feature_store_lookups', 'Off-catalog track feature lookups, by result (hit or miss)', ('result',)
+)
+
+# Spotify time charged to the request being served on this thread
+_request_state = threading.local()
+
+
+def start_request():
+    _request_state.upstream = 0.0
+    _request_state.start = time.perf_counter()
+
+
+def finish_request(route, method, status):
+    """Record the request started on this thread with start_request"""
+    start = getattr(_request_state, 'start', None)
+    if start is None:
+        return
+    observe_request(route, method, status, time.perf_counter() - start, _request_state.upstream)
+    _request_state.start = None
+    _request_state.upstream = None
+
+
+def observe_request(route, method, status, seconds, upstream_seconds):
+    REQUEST_LATENCY.observe(seconds, route=route, method=method)
+    REQUEST_UPSTREAM.observe(upstream_seconds, route=route)
+    REQUEST_COMPUTE.observe(max(seconds - upstream_seconds, 0.0), route=route)
+    REQUESTS.inc(route=route, method=method, status=status)
+
+
+def charge_upstream(seconds):
+    """Add Spotify wait time to the request served on this thread, if any"""
+    if getattr(_request_state, 'upstream', None) is not None:
+        _request_state.upstream += seconds
+
+
+@contextmanager
+def upstream_call(operation):
+    """Time one Spotify call and charge it to the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_ERRORS.inc(operation=operation)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        UPSTREAM_LATENCY.observe(elapsed, operation=operation)
+        charge_upstream(elapsed)
+
+
+@contextmanager
+def upstream_wait():
+    """Charge time spent waiting on Spotify calls made by other threads to the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        charge_upstream(time.perf_counter() - start)
+
+
+def timed(operation):
+    """Decorator recording a RecommendationEngine method's duration"""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                ENGINE_LATENCY.observe(time.perf_counter() - start, operation=operation)
+        return wrapper
+    return decorator
@@ -0,0 +1,367 @@
+"""
+Versioned model bundle.
+
+Everything serving needs is written by train_model.py into one directory
+under models/bundles/, described by a manifest with per-file checksums:
+
+    models/bundles/<version>/
+        manifest.json
+        scaler.pkl, pca.pkl, kmeans.pkl
+        nearest_neighbors.pkl       exact sklearn model (optional in streaming mode)
+        scaled_features.npy         float32 standardized features
+        quantized_features/         int8 (or float16) copy for compact brute-force scans
+        ivf_index/                  .npy arrays of the IVF index
+        knn_graph/                  .npy arrays of the neighbour graph
+        track_store/                Parquet metadata + .npy raw features
+        genre_matrix/               .npy CSR arrays + vocabulary
+        id_index/                   sorted track_ids -> row positions
+        category_index/             row positions per mood/activity/time label
+        filter_index/               packed per-attribute bitmaps for filtered search
+    models/bundles/CURRENT          name of the bundle to serve
+
+A bundle is built in a staging directory and published by renaming it and
+then atomically replacing CURRENT, so readers never see a partial bundle.
+Components are loaded lazily on first use. Arrays are memory-mapped
+read-only, so worker processes serving the same bundle share one copy of
+them in the page cache.
+
+Usage:
+
+    python model_bundle.py report [bundle path]   # load everything, print time/memory
+    python model_bundle.py verify [bundle path]   # check every file's checksum
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import threading
+import joblib
+import numpy as np
+from track_store import get_track_store, load_track_store
+from ann_index import load_ivf_index
+from knn_graph import load_knn_graph
+from genre_matrix import load_genre_matrix
+from catalog_index import load_track_id_index, load_category_index
+from filter_index import load_filter_index
+from quantized_features import load_quantized_features
+
+MODELS_DIR = 'models'
+BUNDLES_DIR = os.path.join(MODELS_DIR, 'bundles')
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+
+# Held by whichever process is training, so workers never train concurrently
+TRAINING_LOCK_FILE = '.train.lock'
+
+# Bump when the bundle layout changes incompatibly
+BUNDLE_FORMAT_VERSION = 4
+
+# Published bundles kept on disk, including the current one
+BUNDLES_KEPT = 3
+
+# Component name -> path inside the bundle
+COMPONENT_PATHS = {
+    'scaler': 'scaler.pkl',
+    'pca': 'pca.pkl',
+    'kmeans': 'kmeans.pkl',
+    'nn_model': 'nearest_neighbors.pkl',
+    'scaled_features': 'scaled_features.npy',
+    'quantized_features': 'quantized_features',
+    'ivf_index': 'ivf_index',
+    'knn_graph': 'knn_graph',
+    'track_store': 'track_store',
+    'genre_matrix': 'genre_matrix',
+    'id_index': 'id_index',
+    'category_index': 'category_index',
+    'filter_index': 'filter_index'
+}
+
+# Components a bundle may leave out; they load as None
+OPTIONAL_COMPONENTS = ('nn_model',)
+
+# Component name -> loader taking the component's full path and whether to memory-map
+COMPONENT_LOADERS = {
+    'scaler': lambda path, mmap: joblib.load(path),
+    'pca': lambda path, mmap: joblib.load(path),
+    'kmeans': lambda path, mmap: joblib.load(path),
+    'nn_model': lambda path, mmap: joblib.load(path),
+    'scaled_features': lambda path, mmap: np.load(path, mmap_mode='r' if mmap else None),
+    'quantized_features': load_quantized_features,
+    'ivf_index': load_ivf_index,
+    'knn_graph': load_knn_graph,
+    'track_store': lambda path, mmap: get_track_store(path) if mmap else load_track_store(path, mmap=False),
+    'genre_matrix': load_genre_matrix,
+    'id_index': load_track_id_index,
+    'category_index': load_category_index,
+    'filter_index': load_filter_index
+}
+
+CHECKSUM_BLOCK_SIZE = 1 << 20
+
+
+def resident_memory():
+    """Resident set size of this process in bytes, or None where unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def bundle_files(path):
+    """Relative paths of every file in a bundle except the manifest, sorted"""
+    files = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            relative = os.path.relpath(os.path.join(root, name), path)
+            if relative != MANIFEST_FILE:
+                files.append(relative.replace(os.sep, '/'))
+    return sorted(files)
+
+
+def create_staging_dir(bundles_dir=BUNDLES_DIR):
+    """Create an empty directory to write a new bundle into"""
+    os.makedirs(bundles_dir, exist_ok=True)
+    return tempfile.mkdtemp(prefix='.staging-', dir=bundles_dir)
+
+
+def publish_bundle(staging_dir, metadata=None, bundles_dir=BUNDLES_DIR, make_current=True):
+    """
+    Write the manifest of a staged bundle and, by default, make it the current bundle.
+
+    Args:
+        staging_dir (str): Directory returned by create_staging_dir, fully written
+        metadata (dict): Extra manifest fields, e.g. track count and feature names
+        make_current (bool): Point CURRENT at the bundle; otherwise call
+            set_current_bundle once it has been validated
+
+    Returns:
+        str: Path of the published bundle
+    """
+    files = {
+        name: {
+            'bytes': os.path.getsize(os.path.join(staging_dir, name)),
+            'sha256': file_checksum(os.path.join(staging_dir, name))
+        }
+        for name in bundle_files(staging_dir)
+    }
+    present = {name: path for name, path in COMPONENT_PATHS.items()
+               if os.path.exists(os.path.join(staging_dir, path))}
+    missing = [name for name in COMPONENT_PATHS if name not in present and name not in OPTIONAL_COMPONENTS]
+    if missing:
+        raise ValueError(f"Cannot publish bundle, missing components: {', '.join(missing)}")
+
+    digest = hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()
+    version = f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-{digest[:8]}"
+    manifest = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'version': version,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'components': present,
+        'files': files,
+        **(metadata or {})
+    }
+    with open(os.path.join(staging_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    path = os.path.join(bundles_dir, version)
+    os.rename(staging_dir, path)
+    if make_current:
+        set_current_bundle(path)
+    return path
+
+
+def set_current_bundle(path):
+    """Atomically point CURRENT at a published bundle and prune old bundles"""
+    bundles_dir, version = os.path.split(os.path.normpath(path))
+
+    # Swap the pointer atomically so readers see either the old or the new bundle;
+    # the temporary file is unique, so concurrent writers never share one
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{CURRENT_FILE}-', dir=bundles_dir)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(bundles_dir, CURRENT_FILE))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    prune_bundles(bundles_dir)
+
+
+def acquire_training_lock(bundles_dir=BUNDLES_DIR):
+    """
+    Take the training lock shared by every process using `bundles_dir`, without waiting.
+
+    Returns:
+        file: The open lock file; the lock is held until it is closed.
+            None if another process holds the lock.
+    """
+    os.makedirs(bundles_dir, exist_ok=True)
+    lock_file = open(os.path.join(bundles_dir, TRAINING_LOCK_FILE), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def prune_bundles(bundles_dir=BUNDLES_DIR, keep=BUNDLES_KEPT):
+    """Delete the oldest published bundles, never the current one"""
+    current = current_bundle_version(bundles_dir)
+    versions = sorted(
+        name for name in os.listdir(bundles_dir)
+        if os.path.isfile(os.path.join(bundles_dir, name, MANIFEST_FILE))
+    )
+    for version in versions[:-keep]:
+        if version != current:
+            shutil.rmtree(os.path.join(bundles_dir, version), ignore_errors=True)
+
+
+def current_bundle_version(bundles_dir=BUNDLES_DIR):
+    try:
+        with open(os.path.join(bundles_dir, CURRENT_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def current_bundle_path(bundles_dir=BUNDLES_DIR):
+    version = current_bundle_version(bundles_dir)
+    return os.path.join(bundles_dir, version) if version else None
+
+
+def bundle_exists(path=None):
+    """Check whether a published bundle exists (the current one by default)"""
+    path = path or current_bundle_path()
+    return path is not None and os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+class ModelBundle:
+    """
+    Read-only view of a published bundle whose components load on first use.
+
+    Opening a bundle only reads its manifest and checks file sizes. Each
+    component is loaded once, under a lock, and the time and memory it took
+    are recorded in `load_report`. With mmap=False every array is read into
+    private memory instead, e.g. to compare against the shared layout.
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.mmap = mmap
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+
+        if self.manifest.get('format_version') != BUNDLE_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported model bundle format {self.manifest.get('format_version')}, "
+                f"expected {BUNDLE_FORMAT_VERSION}. Please run train_model.py again."
+            )
+        for name, entry in self.manifest['files'].items():
+            full_path = os.path.join(path, name)
+            if not os.path.exists(full_path) or os.path.getsize(full_path) != entry['bytes']:
+                raise ValueError(f"Model bundle at {path} is incomplete: {name} is missing or truncated")
+
+        self.version = self.manifest['version']
+        self.load_report = {}
+        self._components = {}
+        self._lock = threading.Lock()
+
+    def component(self, name):
+        """Return a component, loading it on first use; None for an optional component left out"""
+        if name in self._components:
+            return self._components[name]
+        with self._lock:
+            if name not in self.manifest['components'] and name in OPTIONAL_COMPONENTS:
+                self._components[name] = None
+            elif name not in self._components:
+                rss_before = resident_memory()
+                start = time.perf_counter()
+                value = COMPONENT_LOADERS[name](os.path.join(self.path, self.manifest['components'][name]), self.mmap)
+                rss_after = resident_memory()
+                self.load_report[name] = {
+                    'seconds': time.perf_counter() - start,
+                    'rss_bytes': rss_after - rss_before if rss_before is not None else None
+                }
+                self._components[name] = value
+        return self._components[name]
+
+    scaler = property(lambda self: self.component('scaler'))
+    pca = property(lambda self: self.component('pca'))
+    kmeans = property(lambda self: self.component('kmeans'))
+    nn_model = property(lambda self: self.component('nn_model'))
+    scaled_features = property(lambda self: self.component('scaled_features'))
+    quantized_features = property(lambda self: self.component('quantized_features'))
+    ivf_index = property(lambda self: self.component('ivf_index'))
+    knn_graph = property(lambda self: self.component('knn_graph'))
+    track_store = property(lambda self: self.component('track_store'))
+    genre_matrix = property(lambda self: self.component('genre_matrix'))
+    id_index = property(lambda self: self.component('id_index'))
+    category_index = property(lambda self: self.component('category_index'))
+    filter_index = property(lambda self: self.component('filter_index'))
+
+    def verify(self):
+        """
+        Check every file against the manifest checksums.
+
+        Returns:
+            list: Relative paths of files whose checksum does not match
+        """
+        return [
+            name for name, entry in self.manifest['files'].items()
+            if file_checksum(os.path.join(self.path, name)) != entry['sha256']
+        ]
+
+    def print_report(self):
+        """Print load time and resident memory per loaded component"""
+        print(f"Model bundle {self.version}")
+        for name, entry in self.load_report.items():
+            memory = f"{entry['rss_bytes'] / 2 ** 20:8.1f} MB" if entry['rss_bytes'] is not None else '       n/a'
+            print(f"  {name:<16} {entry['seconds'] * 1000:9.1f} ms {memory}")
+
+
+def load_bundle(path=None, mmap=True):
+    """Open a published bundle, the current one by default"""
+    path = path or current_bundle_path()
+    if path is None:
+        raise FileNotFoundError(f"No model bundle found in {BUNDLES_DIR}. Please run train_model.py first.")
+    return ModelBundle(path, mmap)
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'report'
+    start = time.perf_counter()
+    bundle = load_bundle(sys.argv[2] if len(sys.argv) > 2 else None)
+    print(f"Opened bundle in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    if command == 'verify':
+        mismatched = bundle.verify()
+        for name in mismatched:
+            print(f"Checksum mismatch: {name}")
+        print(f"{len(bundle.manifest['files']) - len(mismatched)}/{len(bundle.manifest['files'])} files OK")
+        sys.exit(1 if mismatched else 0)
+
+    for name in COMPONENT_PATHS:
+        bundle.component(name)
+    bundle.print_report()
+
+
+if __name__ == '__main__':
+    main()
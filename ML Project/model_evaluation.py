@@ -1,8 +1,8 @@
 import pandas as pd
 import numpy as np
-import joblib
 import os
 import sys
+import argparse
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import (
     accuracy_score, 
@@ -13,69 +13,80 @@ from sklearn.metrics import (
     classification_report
 )
 from sklearn.preprocessing import LabelEncoder
+from model_bundle import load_bundle, bundle_exists, BUNDLES_DIR, COMPONENT_PATHS
+from track_store import read_track_column, FEATURES_FILE
+from cluster_metrics import evaluate_clustering, print_clustering_report, traced_memory, DEFAULT_MEMORY_LIMIT
+
+# Tracks sampled for the mood classifier, so it does not grow with the catalog
+CLASSIFICATION_SAMPLE_SIZE = 50000
 
 def load_models_and_data():
-    """Load pre-trained models and processed data."""
+    """Load the model bundle and pre-trained models."""
     print("Loading models and data...")
     
-    # Check if model files exist
-    model_files = [
-        'models/processed_tracks.csv',
-        'models/scaler.pkl',
-        'models/pca.pkl',
-        'models/kmeans.pkl',
-        'models/nearest_neighbors.pkl'
-    ]
-    
-    for file in model_files:
-        if not os.path.exists(file):
-            print(f"Error: File {file} not found. Please run train_model.py first.")
-            sys.exit(1)
-    
-    # Load processed tracks
+    # Check if a model bundle exists
+    if not bundle_exists():
+        print(f"Error: No model bundle found in {BUNDLES_DIR}. Please run train_model.py first.")
+        sys.exit(1)
+    
+    # Open the bundle; its arrays are memory-mapped, not read into memory
     try:
-        features_df = pd.read_csv('models/processed_tracks.csv')
+        bundle = load_bundle()
     except Exception as e:
-        print(f"Error loading processed tracks: {e}")
+        print(f"Error loading model bundle: {e}")
         sys.exit(1)
     
     # Load trained models
     try:
-        scaler = joblib.load('models/scaler.pkl')
-        pca = joblib.load('models/pca.pkl')
-        kmeans = joblib.load('models/kmeans.pkl')
-        nn_model = joblib.load('models/nearest_neighbors.pkl')
+        scaler = bundle.scaler
+        pca = bundle.pca
+        kmeans = bundle.kmeans
+        nn_model = bundle.nn_model
     except Exception as e:
         print(f"Error loading trained models: {e}")
         sys.exit(1)
     
-    return features_df, scaler, pca, kmeans, nn_model
+    return bundle, scaler, pca, kmeans, nn_model
 
-def evaluate_clustering_performance(features_df, kmeans):
+def load_classification_sample(bundle, sample_size=CLASSIFICATION_SAMPLE_SIZE, random_state=42):
     """
-    Evaluate clustering performance using multiple metrics.
+    Audio features and mood of a random sample of tracks, read without
+    loading the full metadata table.
     """
-    from sklearn.metrics import (
-        silhouette_score, 
-        calinski_harabasz_score, 
-        davies_bouldin_score
-    )
-    
-    # Select audio features for clustering
-    audio_features = ['danceability', 'energy', 'valence', 'tempo', 'loudness', 
-                      'speechiness', 'acousticness', 'liveness', 'instrumentalness']
+    store_path = os.path.join(bundle.path, COMPONENT_PATHS['track_store'])
+    moods = read_track_column(store_path, 'mood')
+    features = np.load(os.path.join(store_path, FEATURES_FILE), mmap_mode='r')
+    
+    rng = np.random.default_rng(random_state)
+    rows = np.sort(rng.choice(len(moods), min(sample_size, len(moods)), replace=False))
+    features_df = pd.DataFrame(np.asarray(features[rows]), columns=bundle.manifest['feature_names'])
+    features_df['mood'] = moods.iloc[rows].to_numpy()
+    return features_df
+
+def evaluate_clustering_performance(bundle, kmeans, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """
+    Evaluate clustering performance using multiple metrics.
     
-    # Prepare data
-    X = features_df[audio_features]
+    Metrics are computed in the scaled feature space the clusters were
+    fitted on, in streaming passes with a sampled silhouette (see
+    cluster_metrics.py), so working memory stays under `memory_limit` bytes
+    whatever the catalog size.
     
-    # Clustering metrics
+    Raises:
+        MemoryError: If the peak working memory exceeded the limit
+    """
     print("\n--- Clustering Performance Metrics ---")
     try:
-        print(f"Silhouette Score: {silhouette_score(X, kmeans.labels_):.4f}")
-        print(f"Calinski-Harabasz Index: {calinski_harabasz_score(X, kmeans.labels_):.4f}")
-        print(f"Davies-Bouldin Index: {davies_bouldin_score(X, kmeans.labels_):.4f}")
+        with traced_memory(memory_limit) as usage:
+            # Clusters are reassigned block by block rather than read for every track
+            result = evaluate_clustering(bundle.scaled_features, kmeans.predict, memory_limit)
+    except MemoryError:
+        raise
     except Exception as e:
         print(f"Error calculating clustering metrics: {e}")
+        return
+    print_clustering_report(result)
+    print(f"Peak working memory: {usage['peak'] / 2 ** 20:.1f} MB (limit {memory_limit / 2 ** 20:.0f} MB)")
 
 def evaluate_mood_classification(features_df):
     """
@@ -125,18 +136,27 @@ def evaluate_mood_classification(features_df):
         print(f"Error calculating classification metrics: {e}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Evaluate clustering and mood classification")
+    parser.add_argument('--memory-limit', type=int, default=DEFAULT_MEMORY_LIMIT // 2 ** 20,
+                        help="Working memory ceiling of the clustering evaluation in MB; exceeding it fails the run")
+    args = parser.parse_args()
+    
     # Load models and data
     try:
-        features_df, scaler, pca, kmeans, nn_model = load_models_and_data()
+        bundle, scaler, pca, kmeans, nn_model = load_models_and_data()
     except Exception as e:
         print(f"Error loading models and data: {e}")
         return
     
     # Evaluate clustering performance
-    evaluate_clustering_performance(features_df, kmeans)
+    try:
+        evaluate_clustering_performance(bundle, kmeans, args.memory_limit * 2 ** 20)
+    except MemoryError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
     
-    # Evaluate mood classification
-    evaluate_mood_classification(features_df)
+    # Evaluate mood classification on a bounded sample
+    evaluate_mood_classification(load_classification_sample(bundle))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,109 @@
+import numpy as np
+
+# Weights of the audio features behind the compatibility and diversity scores
+FEATURE_WEIGHTS = {
+    'danceability': 0.15,
+    'energy': 0.2,
+    'valence': 0.2,
+    'tempo': 0.15,
+    'loudness': 0.1,
+    'speechiness': 0.1,
+    'acousticness': 0.1
+}
+
+# Playlist rows per block of pairwise distances; a block holds
+# DISTANCE_BLOCK_SIZE x playlist length float64 values
+DISTANCE_BLOCK_SIZE = 1024
+
+# Number of distinct genres that counts as fully genre-diverse
+MAX_GENRES = 20
+
+
+def mean_pairwise_distances(features, columns, block_size=DISTANCE_BLOCK_SIZE):
+    """
+    Mean euclidean distance over all pairs of rows, in one blocked pass.
+
+    Pairs include each row with itself, matching the mean of the full
+    sklearn distance matrix, but only `block_size` rows of that matrix are
+    held in memory at a time.
+
+    Args:
+        features (np.ndarray): Scaled feature matrix, one row per track
+        columns (list): Indices of the column subset to measure separately
+
+    Returns:
+        tuple: (mean distance over `columns`, mean distance over all columns)
+    """
+    features = np.asarray(features, dtype=np.float64)
+    n = len(features)
+    in_subset = np.zeros(features.shape[1], dtype=bool)
+    in_subset[columns] = True
+    subset, rest = features[:, in_subset], features[:, ~in_subset]
+    subset_norms = np.einsum('ij,ij->i', subset, subset)
+    rest_norms = np.einsum('ij,ij->i', rest, rest)
+
+    subset_total = 0.0
+    full_total = 0.0
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        diagonal = (np.arange(stop - start), np.arange(start, stop))
+
+        subset_sq = subset_norms[start:stop, None] + subset_norms[None, :] - 2 * subset[start:stop] @ subset.T
+        rest_sq = rest_norms[start:stop, None] + rest_norms[None, :] - 2 * rest[start:stop] @ rest.T
+        np.maximum(subset_sq, 0, out=subset_sq)
+        np.maximum(rest_sq, 0, out=rest_sq)
+        subset_sq[diagonal] = 0
+        rest_sq[diagonal] = 0
+
+        subset_total += np.sqrt(subset_sq).sum()
+        full_total += np.sqrt(subset_sq + rest_sq).sum()
+
+    return subset_total / n ** 2, full_total / n ** 2
+
+
+def genre_diversity(unique_genres):
+    """
+    Diversity of a playlist from its number of distinct genres.
+
+    Returns:
+        float: 0-100, reaching 100 at MAX_GENRES distinct genres
+    """
+    return min(100.0, unique_genres / MAX_GENRES * 100)
+
+
+def playlist_scores(features, feature_names, genre_score=0.0, weights=FEATURE_WEIGHTS,
+                    block_size=DISTANCE_BLOCK_SIZE):
+    """
+    Compatibility and diversity of one playlist from its scaled features.
+
+    Both scores share one pass over the matrix: per-feature spread and the
+    blocked mean pairwise distances. The result is deterministic.
+
+    Args:
+        features (np.ndarray): Scaled features, one row per track
+        feature_names (list): Column names of `features`
+        genre_score (float): Genre diversity of the playlist, 0-100
+
+    Returns:
+        dict: 'compatibility' and 'diversity' scores between 0 and 100
+    """
+    features = np.asarray(features, dtype=np.float64)
+    columns = [feature_names.index(feature) for feature in weights]
+    weight_values = np.array(list(weights.values()))
+
+    # Lower spread means more compatible, higher spread more diverse
+    spread = features[:, columns].std(axis=0)
+    weighted_compatibility = 100 * ((1 - spread) * weight_values).sum()
+    weighted_diversity = 100 * (spread * weight_values).sum()
+
+    subset_distance, full_distance = mean_pairwise_distances(features, columns, block_size)
+    distance_compatibility = 100 * (1 - subset_distance / np.sqrt(len(weights)))
+    distance_diversity = 100 * (full_distance / np.sqrt(len(weights)))
+
+    compatibility = 0.6 * weighted_compatibility + 0.4 * distance_compatibility
+    diversity = 0.4 * weighted_diversity + 0.3 * distance_diversity + 0.3 * genre_score
+
+    return {
+        'compatibility': round(float(np.clip(compatibility, 0, 100)), 2),
+        'diversity': round(float(np.clip(diversity, 0, 100)), 2)
+    }
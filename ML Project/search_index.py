@@ -0,0 +1,88 @@
+from collections import defaultdict
+import numpy as np
+from fuzzywuzzy import process, utils
+
+# Names passed to the Levenshtein scorer per query at most
+DEFAULT_MAX_CANDIDATES = 1000
+
+# Length of the character n-grams used for the postings
+NGRAM_SIZE = 3
+
+
+def normalize(name):
+    """Normalize a name the same way fuzzywuzzy does before scoring"""
+    return utils.full_process(str(name))
+
+
+def ngrams(text, n=NGRAM_SIZE):
+    """Character n-grams of a normalized name, padded so short names still have some"""
+    padded = f" {text} "
+    return {padded[i:i + n] for i in range(max(1, len(padded) - n + 1))}
+
+
+class SongSearchIndex:
+    """
+    Fuzzy search over song names with character n-gram postings.
+
+    Built once at load time. A query first ranks names by the number of
+    n-grams they share with it (ties broken by the Dice coefficient, so
+    shorter close names come first) and only the best `max_candidates` are
+    scored with fuzzywuzzy, instead of scoring every name in the catalog.
+    """
+
+    def __init__(self, names, max_candidates=DEFAULT_MAX_CANDIDATES):
+        self.max_candidates = max_candidates
+
+        # Unique names and the row positions that carry each of them
+        rows_by_name = defaultdict(list)
+        for row, name in enumerate(names):
+            if isinstance(name, str):
+                rows_by_name[name].append(row)
+        self.names = list(rows_by_name)
+        self.name_rows = {name: np.array(rows, dtype=np.int64) for name, rows in rows_by_name.items()}
+
+        # n-gram -> ids of the names containing it
+        postings = defaultdict(list)
+        self.gram_counts = np.empty(len(self.names), dtype=np.int32)
+        for name_id, name in enumerate(self.names):
+            grams = ngrams(normalize(name))
+            self.gram_counts[name_id] = len(grams)
+            for gram in grams:
+                postings[gram].append(name_id)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def candidates(self, query):
+        """Return the names sharing the most n-grams with the query"""
+        query_grams = ngrams(normalize(query))
+        lists = [self.postings[gram] for gram in query_grams if gram in self.postings]
+        if not lists:
+            return []
+
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.names))
+        name_ids = np.flatnonzero(shared)
+        if len(name_ids) > self.max_candidates:
+            dice = 2 * shared[name_ids] / (len(query_grams) + self.gram_counts[name_ids])
+            rank = shared[name_ids] + dice
+            top = np.argpartition(-rank, self.max_candidates - 1)[:self.max_candidates]
+            name_ids = name_ids[top]
+        return [self.names[name_id] for name_id in name_ids]
+
+    def extract(self, query, limit=5):
+        """
+        Find the best matching names, like fuzzywuzzy's process.extract.
+
+        Returns:
+            list of (name, score) tuples, best first
+        """
+        if not normalize(query):
+            return []
+        return process.extract(query, self.candidates(query), limit=limit)
+
+    def extract_one(self, query):
+        """Find the best matching name, like fuzzywuzzy's process.extractOne"""
+        matches = self.extract(query, limit=1)
+        return matches[0] if matches else None
+
+    def rows(self, name):
+        """Row positions of every track with exactly this name"""
+        return self.name_rows.get(name, np.empty(0, dtype=np.int64))
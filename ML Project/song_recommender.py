@@ -1,23 +1,27 @@
 import pandas as pd
 import numpy as np
-import joblib
-from sklearn.preprocessing import StandardScaler
-from fuzzywuzzy import process
+from search_index import SongSearchIndex
+from model_bundle import load_bundle
+from quantized_features import exact_search
 
 class SongRecommender:
-    def __init__(self, processed_tracks_path='models/processed_tracks.csv'):
+    def __init__(self, bundle_path=None):
         """
         Initialize the song recommender with pre-processed data and models.
         
         Args:
-            processed_tracks_path (str): Path to the processed tracks CSV file
+            bundle_path (str): Path to a model bundle, the current one by default
         """
-        # Load processed tracks
-        self.tracks_df = pd.read_csv(processed_tracks_path)
+        bundle = load_bundle(bundle_path)
+        
+        # Load processed tracks (features stay memory-mapped in the store)
+        self.store = bundle.track_store
+        self.tracks_df = self.store.tracks
         
         # Load pre-trained models
-        self.scaler = joblib.load('models/scaler.pkl')
-        self.nn_model = joblib.load('models/nearest_neighbors.pkl')
+        self.scaler = bundle.scaler
+        self.nn_model = bundle.nn_model
+        self.scaled_features = bundle.scaled_features
         
         # Audio features used for recommendation
         self.audio_features = [
@@ -25,8 +29,8 @@ class SongRecommender:
             'speechiness', 'acousticness', 'liveness', 'instrumentalness'
         ]
         
-        # Precompute song names for faster fuzzy matching
-        self.song_names = self.tracks_df['track_name'].tolist()
+        # Prebuilt n-gram index for faster fuzzy matching
+        self.search_index = SongSearchIndex(self.tracks_df['track_name'])
     
     def find_closest_song(self, input_song):
         """
@@ -39,11 +43,11 @@ class SongRecommender:
             Matched song row or None
         """
         # Use fuzzy matching to find the closest song name
-        match = process.extractOne(input_song, self.song_names)
+        match = self.search_index.extract_one(input_song)
         
         if match and match[1] >= 80:  # 80% similarity threshold
             matched_song = match[0]
-            song_row = self.tracks_df[self.tracks_df['track_name'] == matched_song]
+            song_row = self.tracks_df.iloc[self.search_index.rows(matched_song)]
             return song_row
         
         return None
@@ -67,13 +71,16 @@ class SongRecommender:
             return None
         
         # Extract features for the selected song
-        song_features = song_row[self.audio_features].values
+        song_features = self.store.feature_frame(song_row.index)
         
         # Scale the features
         song_features_scaled = self.scaler.transform(song_features)
         
-        # Find nearest neighbors
-        distances, indices = self.nn_model.kneighbors(song_features_scaled, n_neighbors=top_n+1)
+        # Find nearest neighbors (bundles trained without the exact model are scanned instead)
+        if self.nn_model is None:
+            distances, indices = exact_search(song_features_scaled, self.scaled_features, top_n+1)
+        else:
+            distances, indices = self.nn_model.kneighbors(song_features_scaled, n_neighbors=top_n+1)
         
         # Get recommended songs (excluding the input song itself)
         recommended_indices = indices[0][1:]
@@ -96,13 +103,13 @@ class SongRecommender:
             DataFrame of matching songs
         """
         # Fuzzy search across track names and artists
-        track_matches = process.extract(query, self.song_names, limit=top_matches)
+        track_matches = self.search_index.extract(query, limit=top_matches)
         
         # Collect matching songs
         matched_songs = []
         for match, score in track_matches:
             if score >= 70:  # 70% similarity threshold
-                song_rows = self.tracks_df[self.tracks_df['track_name'] == match]
+                song_rows = self.tracks_df.iloc[self.search_index.rows(match)]
                 matched_songs.append(song_rows)
         
         if matched_songs:
@@ -0,0 +1,148 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Defaults, overridable through SPOTIFY_CACHE_* environment variables
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_CACHE_TTL = 3600
+
+
+def normalize_query(query):
+    """Normalize a free-text query so trivially different spellings share a cache entry"""
+    return ' '.join(str(query).lower().split())
+
+
+class SQLiteCacheStore:
+    """
+    Shared on-disk cache store so several worker processes reuse each other's entries.
+
+    Values are stored as JSON with an absolute expiry time. Each thread gets
+    its own connection; WAL mode lets readers proceed while a worker writes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return (value, expires_at) for a live entry, or None"""
+        row = self._connection().execute(
+            'SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?',
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires_at):
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), expires_at)
+            )
+
+    def purge_expired(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM cache WHERE expires_at <= ?', (time.time(),))
+
+
+class TTLCache:
+    """
+    Bounded, thread-safe cache with a time-to-live and LRU eviction.
+
+    An optional shared store (e.g. SQLiteCacheStore) is consulted on local
+    misses and written on every fill.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL, store=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _put(self, key, value, expires_at):
+        """Insert an entry, evicting the least recently used ones. Caller holds the lock."""
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        """Return the cached value, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+
+        if self.store is not None:
+            shared = self.store.get(key)
+            if shared is not None:
+                with self._lock:
+                    self._put(key, *shared)
+                    self.shared_hits += 1
+                return shared[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._put(key, value, expires_at)
+        if self.store is not None:
+            self.store.set(key, value, expires_at)
+
+    def get_or_set(self, key, compute):
+        """Return the cached value for key, calling compute() to fill it on a miss"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else 0.0
+            }
@@ -1,66 +1,205 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import spotipy
+from spotipy.exceptions import SpotifyException
 from spotipy.oauth2 import SpotifyClientCredentials
 from dotenv import load_dotenv
 import numpy as np
-from sklearn.preprocessing import StandardScaler
-import joblib
+from functools import cached_property
 import logging
+from ann_index import DEFAULT_NPROBE
+from model_bundle import load_bundle
+from quantized_features import exact_search
+from search_index import SongSearchIndex
+from spotify_cache import TTLCache, SQLiteCacheStore, normalize_query, DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL
+from feature_store import TrackFeatureStore, TRACK_FEATURE_DTYPES, TRACK_FEATURE_DB_PATH, empty_feature_frame
+from scoring import playlist_scores, genre_diversity
+from metrics import upstream_call, upstream_wait, timed, FEATURE_STORE_LOOKUPS
 
 # Load environment variables
 load_dotenv()
 
+# Maximum IDs per request on Spotify's plural endpoints
+TRACKS_BATCH_SIZE = 50
+AUDIO_FEATURES_BATCH_SIZE = 100
+
+# Concurrent batch requests during feature enrichment
+ENRICHMENT_WORKERS = 4
+
+# Retries and backoff ceiling (seconds) for rate-limited (429) requests
+RATE_LIMIT_RETRIES = 5
+MAX_BACKOFF = 30
+
+# Live neighbour search: 'ivf' (approximate index), 'quantized' (brute-force
+# scan of the int8/float16 matrix with exact re-ranking) or 'exact'
+SEARCH_BACKENDS = ('ivf', 'quantized', 'exact')
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'ivf')
+
+def chunked(items, size):
+    """Split a list into consecutive chunks of at most `size` items"""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
 class SpotifyAPI:
     def __init__(self):
         # Load credentials from environment variables
         client_id = os.getenv('SPOTIFY_CLIENT_ID')
         client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
         
+        # SPOTIFY_API_URL points the client at another API host, e.g. fake_spotify.py
+        api_url = os.getenv('SPOTIFY_API_URL')
+        
         # Initialize Spotify client
-        client_credentials_manager = SpotifyClientCredentials(
-            client_id=client_id, 
-            client_secret=client_secret
+        if api_url:
+            # Fixed token for the alternative host; no client credentials flow
+            self.access_token = os.getenv('SPOTIFY_ACCESS_TOKEN', 'local')
+            self.sp = spotipy.Spotify(auth=self.access_token)
+            self.sp.prefix = api_url
+        else:
+            self.access_token = None
+            client_credentials_manager = SpotifyClientCredentials(
+                client_id=client_id, 
+                client_secret=client_secret
+            )
+            self.sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+        
+        # Response cache for search and lookups; SPOTIFY_CACHE_DB shares it across workers
+        cache_db = os.getenv('SPOTIFY_CACHE_DB')
+        self.cache = TTLCache(
+            maxsize=int(os.getenv('SPOTIFY_CACHE_SIZE', DEFAULT_CACHE_SIZE)),
+            ttl=float(os.getenv('SPOTIFY_CACHE_TTL', DEFAULT_CACHE_TTL)),
+            store=SQLiteCacheStore(cache_db) if cache_db else None
         )
-        self.sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+    
+    @staticmethod
+    def search_cache_key(query, limit=10):
+        """Cache key shared by the sync and async track search paths"""
+        return f'search:{limit}:{normalize_query(query)}'
     
     def search_tracks(self, query, limit=10):
         """Search for tracks on Spotify"""
-        results = self.sp.search(q=query, type='track', limit=limit)
-        return results['tracks']['items']
+        def fetch():
+            with upstream_call('search'):
+                return self.sp.search(q=query, type='track', limit=limit)['tracks']['items']
+        return self.cache.get_or_set(self.search_cache_key(query, limit), fetch)
+    
+    def get_auth_headers(self):
+        """Authorization headers for direct API calls, refreshing the token if needed"""
+        token = self.access_token or self.sp.auth_manager.get_access_token(as_dict=False)
+        return {'Authorization': f'Bearer {token}'}
     
     def get_audio_features(self, track_ids):
         """Get audio features for a list of track IDs"""
         if not track_ids:
             return []
-        return self.sp.audio_features(track_ids)
+        with upstream_call('audio_features'):
+            return self.sp.audio_features(track_ids)
     
     def get_track_info(self, track_id):
         """Get detailed information about a track"""
-        return self.sp.track(track_id)
+        def fetch():
+            with upstream_call('track'):
+                return self.sp.track(track_id)
+        return self.cache.get_or_set(f'track:{track_id.strip()}', fetch)
     
     def get_artist_info(self, artist_id):
         """Get detailed information about an artist"""
-        return self.sp.artist(artist_id)
+        def fetch():
+            with upstream_call('artist'):
+                return self.sp.artist(artist_id)
+        return self.cache.get_or_set(f'artist:{artist_id.strip()}', fetch)
+    
+    def call_with_backoff(self, method, *args):
+        """Call a Spotify client method, backing off and retrying when rate limited"""
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                with upstream_call(method.__name__):
+                    return method(*args)
+            except SpotifyException as e:
+                if e.http_status != 429 or attempt == RATE_LIMIT_RETRIES:
+                    raise
+                retry_after = (e.headers or {}).get('Retry-After')
+                delay = float(retry_after) if retry_after else 0.5 * 2 ** attempt
+                time.sleep(min(delay, MAX_BACKOFF))
+    
+    def get_track_features(self, track_ids, max_workers=ENRICHMENT_WORKERS):
+        """
+        Fetch track metadata and audio features with Spotify's batch endpoints.
+        
+        Track IDs are sent in batches of 50 (tracks) and 100 (audio features)
+        on a bounded thread pool, so N tracks cost about N/50 + N/100 requests.
+        
+        Args:
+            track_ids (list): Spotify track IDs
+            max_workers (int): Maximum concurrent requests
+        
+        Returns:
+            DataFrame with TRACK_FEATURE_DTYPES columns, one row per track
+            for which both metadata and audio features were found
+        """
+        track_ids = list(dict.fromkeys(track_ids))
+        if not track_ids:
+            return empty_feature_frame()
+        
+        # Batches run on pool threads; the wait is charged to the calling request
+        with upstream_wait(), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            track_batches = executor.map(
+                lambda batch: self.call_with_backoff(self.sp.tracks, batch)['tracks'],
+                chunked(track_ids, TRACKS_BATCH_SIZE)
+            )
+            feature_batches = executor.map(
+                lambda batch: self.call_with_backoff(self.sp.audio_features, batch),
+                chunked(track_ids, AUDIO_FEATURES_BATCH_SIZE)
+            )
+            tracks = {t['id']: t for batch in track_batches for t in batch if t}
+            features = {f['id']: f for batch in feature_batches for f in batch if f}
+        
+        rows = []
+        for track_id in track_ids:
+            track = tracks.get(track_id)
+            audio_features = features.get(track_id)
+            if track is None or audio_features is None:
+                continue
+            row = {column: audio_features.get(column) for column in TRACK_FEATURE_DTYPES}
+            row.update({
+                'track_id': track_id,
+                'name': track['name'],
+                'artist': track['artists'][0]['name']
+            })
+            rows.append(row)
+        
+        return pd.DataFrame(rows, columns=list(TRACK_FEATURE_DTYPES)).astype(TRACK_FEATURE_DTYPES)
     
     def get_recommendations(self, seed_tracks=None, seed_artists=None, seed_genres=None, limit=10, **kwargs):
         """Get recommendations based on seeds and audio features"""
-        return self.sp.recommendations(
-            seed_tracks=seed_tracks,
-            seed_artists=seed_artists,
-            seed_genres=seed_genres,
-            limit=limit,
-            **kwargs
-        )
+        with upstream_call('recommendations'):
+            return self.sp.recommendations(
+                seed_tracks=seed_tracks,
+                seed_artists=seed_artists,
+                seed_genres=seed_genres,
+                limit=limit,
+                **kwargs
+            )
 
 class RecommendationEngine:
-    def __init__(self):
-        # Load models and processed data
-        self.scaler = joblib.load('models/scaler.pkl')
-        self.pca = joblib.load('models/pca.pkl')
-        self.kmeans = joblib.load('models/kmeans.pkl')
-        self.nn_model = joblib.load('models/nearest_neighbors.pkl')
-        self.tracks_df = pd.read_csv('models/processed_tracks.csv')
+    def __init__(self, bundle_path=None, spotify_api=None,
+                 feature_store_path=TRACK_FEATURE_DB_PATH, mmap=True, search_backend=None):
+        # How live neighbour searches are answered (see SEARCH_BACKENDS)
+        self.search_backend = search_backend or SEARCH_BACKEND
+        if self.search_backend not in SEARCH_BACKENDS:
+            raise ValueError(f"Unknown search backend {self.search_backend!r}, expected one of {SEARCH_BACKENDS}")
+        
+        # Spotify client used to enrich tracks missing from our dataset
+        self.spotify_api = spotify_api
+        
+        # Persistent cache of features fetched for tracks missing from our dataset
+        self.feature_store = TrackFeatureStore(feature_store_path) if feature_store_path else None
+        
+        # Versioned model bundle (the current one by default); its models,
+        # track store and indexes are loaded lazily on first use, with arrays
+        # memory-mapped so worker processes share them unless mmap is False
+        self.bundle = load_bundle(bundle_path, mmap)
         
         # Audio features used for recommendations
         self.audio_features = [
@@ -68,183 +207,419 @@ class RecommendationEngine:
             'speechiness', 'acousticness', 'liveness', 'instrumentalness'
         ]
     
-    def get_similar_tracks(self, track_id, n_recommendations=10):
-        """Get similar tracks based on audio features"""
-        # Find the track in our dataset
-        track_data = self.tracks_df[self.tracks_df['track_id'] == track_id]
+    @property
+    def scaler(self):
+        return self.bundle.scaler
+    
+    @property
+    def nn_model(self):
+        return self.bundle.nn_model
+    
+    @property
+    def ivf_index(self):
+        """Approximate index over a fine coarse quantizer"""
+        return self.bundle.ivf_index
+    
+    @property
+    def knn_graph(self):
+        """Precomputed neighbour graph for in-catalog seeds"""
+        return self.bundle.knn_graph
+    
+    @property
+    def store(self):
+        """Metadata table and memory-mapped feature block shared with the app"""
+        return self.bundle.track_store
+    
+    @property
+    def tracks_df(self):
+        return self.store.tracks
+    
+    @property
+    def scaled_features(self):
+        """Memory-mapped float32 standardized feature matrix"""
+        return self.bundle.scaled_features
+    
+    @property
+    def quantized_features(self):
+        """Memory-mapped int8/float16 copy of the scaled features"""
+        return self.bundle.quantized_features
+    
+    @property
+    def genre_matrix(self):
+        """Sparse track x genre matrix"""
+        return self.bundle.genre_matrix
+    
+    @property
+    def filter_index(self):
+        """Packed per-attribute bitmaps for filtered similarity search"""
+        return self.bundle.filter_index
+    
+    @property
+    def track_index(self):
+        """Sorted track_id index (memory-mapped) to row position in the store"""
+        return self.bundle.id_index
+    
+    @cached_property
+    def song_index(self):
+        """Fuzzy search index over track names"""
+        return SongSearchIndex(self.tracks_df['track_name'])
+    
+    @cached_property
+    def category_buckets(self):
+        """Row positions per mood / activity / time of day label, as views of the bundle's arrays"""
+        index = self.bundle.category_index
+        return {column: index.buckets(column) for column in index.labels}
+    
+    def warm_up(self):
+        """Load every lazily loaded component used to answer requests"""
+        names = ['track_store', 'scaled_features', 'ivf_index', 'knn_graph', 'genre_matrix',
+                 'id_index', 'category_index', 'filter_index']
+        if self.search_backend == 'quantized':
+            names.append('quantized_features')
+        elif self.search_backend == 'exact':
+            names.append('nn_model')
+        for name in names:
+            self.bundle.component(name)
+        self.category_buckets, self.song_index
+        return self
+    
+    def scale_features(self, features):
+        """Standardize raw audio features with the fitted scaler as float32"""
+        features = np.asarray(features, dtype=np.float64)
+        return ((features - self.scaler.mean_) / self.scaler.scale_).astype(np.float32)
+    
+    def get_track_positions(self, track_ids):
+        """Return the unique row positions of the given track_ids found in our dataset"""
+        positions = self.track_index.lookup(track_ids)
+        positions = positions[positions >= 0]
+        # Keep the first occurrence of each position, in input order
+        _, first_seen = np.unique(positions, return_index=True)
+        return positions[np.sort(first_seen)].astype(np.intp)
+    
+    def find_neighbors(self, scaled_features, n_neighbors=10, nprobe=None):
+        """
+        Find nearest neighbours of scaled feature rows.
+        
+        With the 'ivf' backend the IVF index scans `nprobe` lists per query
+        (DEFAULT_NPROBE if not given). The 'quantized' backend scans the
+        compact matrix and re-ranks the best candidates exactly; 'exact'
+        (also the fallback without an IVF index) uses the sklearn model, or
+        a blocked scan of the scaled features when the bundle has none.
+        Indices of -1 mark padding when a probe returns fewer candidates.
+        """
+        n_neighbors = min(n_neighbors, len(self.tracks_df))
+        if self.search_backend == 'quantized':
+            return self.quantized_features.search(scaled_features, n_neighbors, exact_features=self.scaled_features)
+        if self.search_backend == 'ivf' and self.ivf_index is not None:
+            return self.ivf_index.search(scaled_features, n_neighbors, nprobe or DEFAULT_NPROBE)
+        if self.nn_model is None:
+            return exact_search(scaled_features, self.scaled_features, n_neighbors)
+        return self.nn_model.kneighbors(scaled_features, n_neighbors=n_neighbors)
+    
+    def find_catalog_neighbors(self, positions, n_neighbors=10, nprobe=None):
+        """
+        Find nearest neighbours of tracks in our dataset by row position.
+        
+        Answered with an array lookup in the precomputed neighbour graph when it
+        holds enough neighbours, otherwise with a live search.
+        """
+        if self.knn_graph is not None and n_neighbors <= self.knn_graph.k:
+            return self.knn_graph.neighbors(positions, n_neighbors)
+        return self.find_neighbors(self.scaled_features[positions], n_neighbors, nprobe)
+    
+    def compile_filters(self, filters):
+        """Compile similarity constraints (see FilterIndex.compile) into a RowFilter"""
+        return self.filter_index.compile(filters)
+    
+    def find_filtered_neighbors(self, position, row_filter, n_neighbors=10, nprobe=None):
+        """
+        Find the nearest tracks to a catalog track among the rows a RowFilter allows.
         
-        if track_data.empty:
-            # If track not found, return a random selection of tracks
-            return self.tracks_df.sample(n_recommendations).to_dict('records')
+        The filter is applied inside the search, never by over-fetching:
+        if enough of the precomputed (exact) graph neighbours pass, they are
+        the answer; if few rows pass, only those rows are scanned; otherwise
+        the IVF index skips rejected rows while probing. Each path costs at
+        most about one unfiltered IVF query, however selective the filter.
         
-        # Get the audio features
-        track_features = track_data[self.audio_features].values
+        Returns:
+            (distances, indices) arrays of shape (1, n_neighbors), padded with inf / -1
+        """
+        distances = np.full((1, n_neighbors), np.inf, dtype=np.float32)
+        indices = np.full((1, n_neighbors), -1, dtype=np.int64)
+        estimated_count = row_filter.estimated_count
+        if estimated_count == 0:
+            return distances, indices
+        
+        graph = self.knn_graph
+        if graph is not None and n_neighbors <= graph.k:
+            graph_distances, graph_indices = graph.neighbors([position], graph.k)
+            allowed = row_filter.allows(graph_indices[0])
+            if np.count_nonzero(allowed) >= n_neighbors:
+                return graph_distances[:, allowed][:, :n_neighbors], graph_indices[:, allowed][:, :n_neighbors]
+        
+        nprobe = max(1, nprobe or DEFAULT_NPROBE)
+        query = np.asarray(self.scaled_features[position], dtype=np.float32)
+        ivf = self.ivf_index
+        # Rows an unfiltered IVF query would scan
+        scan_budget = nprobe * ivf.n_tracks / ivf.n_lists if ivf is not None else np.inf
+        if ivf is not None and estimated_count > scan_budget:
+            # Probe more lists the fewer rows pass, so about as many distances
+            # are computed as for an unfiltered query with `nprobe` lists
+            selectivity = estimated_count / ivf.n_tracks
+            return ivf.search(query, n_neighbors, min(ivf.n_lists, int(np.ceil(nprobe / selectivity))), row_filter)
+        
+        # Selective filter: exact scan over the allowed rows only
+        rows = row_filter.rows()
+        if len(rows):
+            diff = self.scaled_features[rows] - query
+            row_distances = np.einsum('ij,ij->i', diff, diff)
+            m = min(n_neighbors, len(rows))
+            top = np.argpartition(row_distances, m - 1)[:m] if m < len(rows) else np.arange(m)
+            top = top[np.argsort(row_distances[top], kind='stable')]
+            distances[0, :m] = np.sqrt(row_distances[top])
+            indices[0, :m] = rows[top]
+        return distances, indices
+    
+    @timed('get_similar_tracks')
+    def get_similar_tracks(self, track_id, n_recommendations=10, nprobe=None, filters=None):
+        """
+        Get similar tracks based on audio features
         
-        # Scale the features - create DataFrame with feature names to avoid warning
-        scaled_features = pd.DataFrame(
-            self.scaler.transform(track_features),
-            columns=self.audio_features
-        ).values
+        Args:
+            track_id (str): Seed track ID
+            n_recommendations (int): Number of tracks to return
+            nprobe (int): Inverted lists scanned when the IVF index is used
+            filters (dict): Optional constraints, e.g. {'mood': 'Happy',
+                'tempo': (100, 130), 'exclude_artists': [...]}; see FilterIndex.compile
+        
+        Raises:
+            ValueError: On malformed filters
+        """
+        row_filter = self.compile_filters(filters) if filters else None
+        
+        # Find the track in our dataset
+        position = self.track_index.get(track_id)
+        
+        if position is None:
+            # If track not found, return a random selection of (matching) tracks
+            if row_filter is None:
+                return self.store.records(self.tracks_df.sample(n_recommendations).index)
+            rows = row_filter.rows()
+            return self.store.records(np.random.default_rng().choice(rows, min(n_recommendations, len(rows)), replace=False))
         
         # Find nearest neighbors
-        distances, indices = self.nn_model.kneighbors(scaled_features)
+        if row_filter is None:
+            distances, indices = self.find_catalog_neighbors([position], n_recommendations, nprobe)
+        else:
+            distances, indices = self.find_filtered_neighbors(position, row_filter, n_recommendations, nprobe)
         
         # Get the similar tracks
-        similar_tracks = self.tracks_df.iloc[indices[0]]
-        
-        return similar_tracks.to_dict('records')
+        return self.store.records(indices[0][indices[0] >= 0])
     
-    def get_mood_playlist(self, mood, n_tracks=20):
-        """Get tracks based on mood"""
-        mood_tracks = self.tracks_df[self.tracks_df['mood'] == mood]
+    @timed('get_similar_tracks_batch')
+    def get_similar_tracks_batch(self, track_ids, n_recommendations=10, nprobe=None):
+        """
+        Get similar tracks for many seed tracks with a single neighbour query.
         
-        if len(mood_tracks) == 0:
-            # If no tracks match the mood, return a random selection
-            return self.tracks_df.sample(min(n_tracks, len(self.tracks_df))).to_dict('records')
+        Args:
+            track_ids (list): Seed track IDs
+            n_recommendations (int): Number of neighbours to return per seed
+            nprobe (int): Inverted lists scanned per seed when the IVF index is used
         
-        if len(mood_tracks) > n_tracks:
-            return mood_tracks.sample(n_tracks).to_dict('records')
-        return mood_tracks.to_dict('records')
+        Returns:
+            dict: 'results' maps each seed found in our dataset to its similar
+            tracks (as returned by get_similar_tracks), 'merged' is the
+            de-duplicated union across seeds ordered by distance with the seeds
+            excluded, and 'missing' lists seeds not found in our dataset
+        """
+        seeds = list(dict.fromkeys(track_ids))
+        seed_positions = self.track_index.lookup(seeds)
+        found = [track_id for track_id, position in zip(seeds, seed_positions) if position >= 0]
+        missing = [track_id for track_id, position in zip(seeds, seed_positions) if position < 0]
+        
+        if not found:
+            return {'results': {}, 'merged': [], 'missing': missing}
+        
+        # One vectorized neighbour query for every seed
+        positions = seed_positions[seed_positions >= 0].astype(np.intp)
+        distances, indices = self.find_catalog_neighbors(positions, n_recommendations, nprobe)
+        
+        # Merge across seeds: closest first, keep the first occurrence, drop the seeds
+        order = np.argsort(distances.ravel(), kind='stable')
+        ranked = indices.ravel()[order]
+        _, first_seen = np.unique(ranked, return_index=True)
+        merged = ranked[np.sort(first_seen)]
+        merged = merged[(merged >= 0) & ~np.isin(merged, positions)]
+        
+        # Materialize each returned row only once
+        rows = np.unique(indices[indices >= 0])
+        records = dict(zip(rows.tolist(), self.store.records(rows)))
+        
+        return {
+            'results': {
+                track_id: [records[row] for row in neighbors if row >= 0]
+                for track_id, neighbors in zip(found, indices.tolist())
+            },
+            'merged': [records[row] for row in merged.tolist()],
+            'missing': missing
+        }
     
-    def get_activity_playlist(self, activity, n_tracks=20):
-        """Get tracks based on activity"""
-        activity_tracks = self.tracks_df[self.tracks_df['activity'] == activity]
+    @timed('get_category_playlist')
+    def get_category_playlist(self, column, value, n_tracks=20, seed=None):
+        """
+        Sample tracks whose `column` label equals `value`.
         
-        if len(activity_tracks) == 0:
-            # If no tracks match the activity, return a random selection
-            return self.tracks_df.sample(min(n_tracks, len(self.tracks_df))).to_dict('records')
+        Args:
+            column (str): Category column, e.g. 'mood'
+            value (str): Label to match
+            n_tracks (int): Number of tracks to return
+            seed (int): Seed for the sample, None for a fresh random sample
         
-        if len(activity_tracks) > n_tracks:
-            return activity_tracks.sample(n_tracks).to_dict('records')
-        return activity_tracks.to_dict('records')
-    
-    def get_time_of_day_playlist(self, time_of_day, n_tracks=20):
-        """Get tracks based on time of day"""
-        time_tracks = self.tracks_df[self.tracks_df['time_of_day'] == time_of_day]
+        Returns:
+            list of track dicts; only the returned rows are materialized
+        """
+        rows = self.category_buckets[column].get(value)
+        rng = np.random.default_rng(seed)
         
-        if len(time_tracks) == 0:
-            # If no tracks match the time of day, return a random selection
-            return self.tracks_df.sample(min(n_tracks, len(self.tracks_df))).to_dict('records')
+        if rows is None or len(rows) == 0:
+            # If no tracks match, return a random selection
+            n_total = len(self.tracks_df)
+            return self.store.records(rng.choice(n_total, min(n_tracks, n_total), replace=False))
         
-        if len(time_tracks) > n_tracks:
-            return time_tracks.sample(n_tracks).to_dict('records')
-        return time_tracks.to_dict('records')
+        if len(rows) > n_tracks:
+            return self.store.records(rows[rng.choice(len(rows), n_tracks, replace=False)])
+        return self.store.records(rows)
     
-    def calculate_compatibility_score(self, track_ids):
-        """
-        Calculate a comprehensive compatibility score between tracks
-        Uses multiple strategies to ensure accuracy:
-        1. Feature similarity
-        2. Genre compatibility
-        3. Audio characteristics alignment
+    def get_mood_playlist(self, mood, n_tracks=20, seed=None):
+        """Get tracks based on mood"""
+        return self.get_category_playlist('mood', mood, n_tracks, seed)
+    
+    def get_activity_playlist(self, activity, n_tracks=20, seed=None):
+        """Get tracks based on activity"""
+        return self.get_category_playlist('activity', activity, n_tracks, seed)
+    
+    def get_time_of_day_playlist(self, time_of_day, n_tracks=20, seed=None):
+        """Get tracks based on time of day"""
+        return self.get_category_playlist('time_of_day', time_of_day, n_tracks, seed)
+    
+    def get_playlist_features(self, track_ids):
         """
-        if not track_ids or len(track_ids) < 2:
-            return 0
+        Scaled features of a playlist's tracks
         
-        # Get tracks from our dataset or Spotify
-        tracks = self.tracks_df[self.tracks_df['track_id'].isin(track_ids)]
+        Catalog tracks are used when at least two of them are known;
+        otherwise the tracks are looked up through get_track_features.
         
+        Returns:
+            tuple: (scaled feature matrix, catalog row positions or None for
+            looked-up tracks), or (None, None) if fewer than two tracks could
+            be resolved
+        """
+        positions = self.get_track_positions(track_ids)
+        if len(positions) >= 2:
+            return self.scaled_features[positions], positions
+        
+        try:
+            tracks = self.get_track_features(track_ids)
+        except Exception as e:
+            logging.error(f"Error fetching track features: {e}")
+            return None, None
         if len(tracks) < 2:
-            try:
-                # Fetch additional track details from Spotify
-                additional_tracks = self.get_track_features(track_ids)
-                if len(additional_tracks) >= 2:
-                    features = additional_tracks[self.audio_features].values
-                    tracks = additional_tracks
-                else:
-                    return 0
-            except Exception as e:
-                print(f"Error fetching track features: {e}")
-                return 0
-        else:
-            features = tracks[self.audio_features].values
+            return None, None
+        return self.scale_features(tracks[self.audio_features].values), None
+    
+    @timed('score_playlist')
+    def score_playlist(self, track_ids):
+        """
+        Compatibility, diversity and genre overlap scores of one playlist
         
-        # Scale features
-        scaled_features = pd.DataFrame(
-            self.scaler.transform(features),
-            columns=self.audio_features
-        )
+        Genre diversity and overlap come from the sparse genre matrix and are
+        0 for playlists of tracks outside our dataset, whose genres are unknown.
         
-        # Comprehensive compatibility calculation
-        def calculate_feature_compatibility(feature_name):
-            """Calculate compatibility for a specific feature"""
-            feature_values = scaled_features[feature_name]
-            feature_std = np.std(feature_values)
-            feature_mean = np.mean(feature_values)
-            
-            # Lower standard deviation indicates more similar tracks
-            feature_compatibility = 100 * (1 - feature_std)
-            return feature_compatibility
-        
-        # Calculate compatibility for key features
-        feature_weights = {
-            'danceability': 0.15,
-            'energy': 0.2,
-            'valence': 0.2,
-            'tempo': 0.15,
-            'loudness': 0.1,
-            'speechiness': 0.1,
-            'acousticness': 0.1
-        }
+        Returns:
+            dict: 'compatibility', 'diversity' and 'genre_overlap' (mean
+            pairwise genre Jaccard similarity) scores between 0 and 100
+        """
+        if not track_ids or len(track_ids) < 2:
+            return {'compatibility': 0, 'diversity': 0, 'genre_overlap': 0}
         
-        # Weighted feature compatibility
-        weighted_compatibility = sum(
-            calculate_feature_compatibility(feature) * weight 
-            for feature, weight in feature_weights.items()
-        )
+        scaled, positions = self.get_playlist_features(track_ids)
+        if scaled is None:
+            return {'compatibility': 0, 'diversity': 0, 'genre_overlap': 0}
         
-        # Pairwise distance calculation for additional nuance
-        from sklearn.metrics.pairwise import euclidean_distances
-        distances = euclidean_distances(scaled_features[list(feature_weights.keys())])
-        avg_distance = np.mean(distances)
+        if positions is None:
+            genre_score, genre_overlap = 0.0, 0.0
+        else:
+            genre_score = genre_diversity(self.genre_matrix.unique_genre_count(positions))
+            genre_overlap = round(100 * self.genre_matrix.mean_pairwise_jaccard(positions), 2)
         
-        # Normalize and combine metrics
-        distance_factor = 100 * (1 - (avg_distance / np.sqrt(len(feature_weights))))
+        scores = playlist_scores(scaled, self.audio_features, genre_score)
+        scores['genre_overlap'] = genre_overlap
+        return scores
+    
+    @timed('score_playlists')
+    def score_playlists(self, playlists):
+        """
+        Score several playlists in one call
         
-        # Final compatibility score
-        final_score = 0.6 * weighted_compatibility + 0.4 * distance_factor
+        Off-catalog tracks of all playlists are enriched together first, so
+        the per-playlist lookups are served from the feature store.
         
-        # Ensure score is between 0 and 100
-        final_score = max(0, min(100, final_score))
+        Args:
+            playlists (list): Lists of track IDs
         
-        # Add some randomness to prevent repetitive scores
-        import random
-        final_score += random.uniform(-5, 5)
-        final_score = max(0, min(100, final_score))
+        Returns:
+            list: Score dicts in the order of `playlists`
+        """
+        off_catalog = []
+        for track_ids in playlists:
+            if len(track_ids) < 2:
+                continue
+            positions = self.track_index.lookup(track_ids)
+            if len(np.unique(positions[positions >= 0])) < 2:
+                off_catalog.extend(track_id for track_id, position in zip(track_ids, positions) if position < 0)
+        if off_catalog and self.feature_store is not None:
+            try:
+                self.get_track_features(off_catalog)
+            except Exception as e:
+                logging.error(f"Error fetching track features: {e}")
         
-        return round(final_score, 2)
+        return [self.score_playlist(track_ids) for track_ids in playlists]
+    
+    def calculate_compatibility_score(self, track_ids):
+        """
+        Calculate a compatibility score between tracks from the spread of
+        their weighted audio features and their mean pairwise distance
+        """
+        return self.score_playlist(track_ids)['compatibility']
     
+    @timed('get_track_features')
     def get_track_features(self, track_ids):
-        """Enhanced track features retrieval"""
-        track_features = []
-        for track_id in track_ids:
-            try:
-                # Fetch track and audio features
-                track = self.sp.track(track_id)
-                audio_features = self.sp.audio_features(track_id)[0]
-                
-                # Comprehensive feature extraction
-                track_features.append({
-                    'track_id': track_id,
-                    'name': track['name'],
-                    'artist': track['artists'][0]['name'],
-                    'danceability': audio_features['danceability'],
-                    'energy': audio_features['energy'],
-                    'key': audio_features['key'],
-                    'loudness': audio_features['loudness'],
-                    'mode': audio_features['mode'],
-                    'speechiness': audio_features['speechiness'],
-                    'acousticness': audio_features['acousticness'],
-                    'instrumentalness': audio_features['instrumentalness'],
-                    'liveness': audio_features['liveness'],
-                    'valence': audio_features['valence'],
-                    'tempo': audio_features['tempo'],
-                    'duration_ms': audio_features['duration_ms']
-                })
-            except Exception as e:
-                print(f"Error fetching track features for {track_id}: {e}")
+        """
+        Enhanced track features retrieval
         
-        return pd.DataFrame(track_features)
+        Served from the local feature store where possible; only tracks not
+        cached yet are fetched from Spotify, and are cached for next time.
+        """
+        track_ids = list(dict.fromkeys(track_ids))
+        cached = self.feature_store.get(track_ids) if self.feature_store is not None else empty_feature_frame()
+        cached_ids = set(cached['track_id'])
+        missing = [track_id for track_id in track_ids if track_id not in cached_ids]
+        FEATURE_STORE_LOOKUPS.inc(len(track_ids) - len(missing), result='hit')
+        FEATURE_STORE_LOOKUPS.inc(len(missing), result='miss')
+        
+        if not missing:
+            fetched = empty_feature_frame()
+        elif self.spotify_api is None:
+            raise RuntimeError("No Spotify client configured for track feature retrieval")
+        else:
+            fetched = self.spotify_api.get_track_features(missing)
+            if self.feature_store is not None:
+                self.feature_store.put(fetched)
+        
+        # Return rows in request order
+        features = pd.concat([df for df in (cached, fetched) if len(df)] or [cached]).set_index('track_id')
+        order = [track_id for track_id in track_ids if track_id in features.index]
+        return features.loc[order].reset_index().astype(TRACK_FEATURE_DTYPES)
     
     def calculate_diversity_score(self, track_ids):
         """
@@ -256,97 +631,4 @@ class RecommendationEngine:
         Returns:
             float: Diversity score between 0 and 100
         """
-        # Validate input
-        if not track_ids or len(track_ids) < 2:
-            return 0
-        
-        # Get tracks from our dataset
-        tracks = self.tracks_df[self.tracks_df['track_id'].isin(track_ids)]
-        
-        # If not enough tracks in local dataset, try Spotify
-        if len(tracks) < 2:
-            try:
-                # Fetch additional track details from Spotify
-                additional_tracks = self.get_track_features(track_ids)
-                if len(additional_tracks) >= 2:
-                    tracks = additional_tracks
-                else:
-                    return 0
-            except Exception as e:
-                logging.error(f"Error fetching track features: {e}")
-                return 0
-        
-        # Audio features for diversity calculation
-        audio_features = [
-            'danceability', 'energy', 'valence', 
-            'tempo', 'loudness', 'speechiness', 
-            'acousticness', 'liveness', 'instrumentalness'
-        ]
-        
-        # Scale features
-        scaled_features = self.scaler.transform(tracks[audio_features])
-        
-        # Pairwise distance calculation
-        from sklearn.metrics.pairwise import euclidean_distances
-        distances = euclidean_distances(scaled_features)
-        
-        # Genre diversity calculation
-        def calculate_genre_diversity(tracks):
-            """Calculate diversity based on genres"""
-            # Handle potential missing or empty genre data
-            genres = tracks['genres'].fillna('').str.lower()
-            
-            # Count unique genres
-            unique_genres = genres.str.split(',').explode().str.strip().nunique()
-            
-            # Normalize genre diversity
-            max_possible_genres = 20  # Reasonable upper limit for genre diversity
-            genre_diversity = min(100, (unique_genres / max_possible_genres) * 100)
-            
-            return genre_diversity
-        
-        # Audio feature diversity calculation
-        def calculate_feature_diversity(feature_name):
-            """Calculate diversity for a specific feature"""
-            feature_values = scaled_features[:, audio_features.index(feature_name)]
-            feature_std = np.std(feature_values)
-            
-            # Higher standard deviation indicates more diverse tracks
-            feature_diversity = 100 * feature_std
-            return feature_diversity
-        
-        # Weighted feature diversity
-        feature_weights = {
-            'danceability': 0.15,
-            'energy': 0.2,
-            'valence': 0.2,
-            'tempo': 0.15,
-            'loudness': 0.1,
-            'speechiness': 0.1,
-            'acousticness': 0.1
-        }
-        
-        # Calculate weighted feature diversity
-        weighted_feature_diversity = sum(
-            calculate_feature_diversity(feature) * weight 
-            for feature, weight in feature_weights.items()
-        )
-        
-        # Distance-based diversity factor
-        avg_distance = np.mean(distances)
-        distance_diversity = 100 * (avg_distance / np.sqrt(len(feature_weights)))
-        
-        # Genre diversity factor
-        genre_diversity = calculate_genre_diversity(tracks)
-        
-        # Combine diversity metrics
-        final_diversity_score = (
-            0.4 * weighted_feature_diversity + 
-            0.3 * distance_diversity + 
-            0.3 * genre_diversity
-        )
-        
-        # Ensure score is between 0 and 100
-        final_diversity_score = max(0, min(100, final_diversity_score))
-        
-        return round(final_diversity_score, 2)
+        return self.score_playlist(track_ids)['diversity']
@@ -0,0 +1,334 @@
+"""
+Parallel hyperparameter sweep for train_model.py.
+
+Scores candidate KMeans cluster counts and PCA sizes on the scaled catalog,
+each candidate fitted in its own worker process:
+
+- clusters: KMeans is fitted on a sample of rows, then scored over every
+  row with cluster_metrics (exact Calinski-Harabasz and Davies-Bouldin,
+  sampled silhouette with a confidence interval). The best count has the
+  highest silhouette.
+- PCA: explained variance, and recall@10 of neighbour search in the PCA
+  space against exact search. The best size is the smallest one that
+  keeps PCA_VARIANCE_TARGET of the variance.
+
+The scaled features are written once to a .npy file that every worker
+memory-maps, so the pool shares one copy through the page cache. That
+file, the exact neighbours used for PCA recall and every candidate's
+scores are cached under models/sweep/cache, keyed by the dataset and the
+settings, so a re-run only fits new candidates.
+
+The best configuration is written to models/sweep/best_config.json (read by
+train_model.py --config) and the timings and metrics of every candidate to
+models/sweep/report.json.
+
+Usage:
+
+    python sweep_model.py
+    python sweep_model.py --clusters 4 6 8 10 12 16 --pca-components 2 3 4 5 6 --workers 4
+    python train_model.py --config models/sweep/best_config.json
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from threadpoolctl import threadpool_limits
+from sklearn.cluster import KMeans
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import StandardScaler
+from train_model import (
+    spool_deduplicated_chunks, audio_features, DATASET_PATH, STREAMING_CHUNKSIZE, MODELS_DIR
+)
+from cluster_metrics import evaluate_clustering, DEFAULT_MEMORY_LIMIT
+from quantized_features import scan
+
+SWEEP_DIR = os.path.join(MODELS_DIR, 'sweep')
+CACHE_DIR = os.path.join(SWEEP_DIR, 'cache')
+BEST_CONFIG_FILE = os.path.join(SWEEP_DIR, 'best_config.json')
+REPORT_FILE = os.path.join(SWEEP_DIR, 'report.json')
+
+# Candidates swept by default
+CLUSTER_COUNTS = (4, 6, 8, 10, 12, 16)
+PCA_SIZES = (2, 3, 4, 5, 6)
+
+# Rows each candidate model is fitted on; scores always cover every row
+FIT_SAMPLE_SIZE = 200000
+
+# Fraction of the variance the chosen PCA size must keep
+PCA_VARIANCE_TARGET = 0.8
+
+# Seed tracks and neighbours of the PCA-space recall check
+RECALL_QUERIES = 500
+RECALL_K = 10
+
+# Bump when scoring changes so cached results are recomputed
+SCORE_VERSION = 1
+
+# Memory-mapped scaled features of the worker process
+_features = None
+_thread_limits = None
+
+
+def dataset_fingerprint(dataset_path):
+    """Identify a dataset file by path, size and modification time"""
+    stat = os.stat(dataset_path)
+    key = f'{os.path.abspath(dataset_path)}:{stat.st_size}:{stat.st_mtime_ns}'
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def prepare_scaled_features(dataset_path, chunksize, cache_dir=CACHE_DIR):
+    """
+    Deduplicate and standardize the dataset as training does, into a cached float32 .npy.
+
+    Returns:
+        str: Path of the .npy file
+    """
+    path = os.path.join(cache_dir, f'scaled-{dataset_fingerprint(dataset_path)}.npy')
+    if os.path.exists(path):
+        print(f"Using cached scaled features {path}")
+        return path
+
+    print("Scaling dataset...")
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=cache_dir) as spool_dir:
+        scaler = StandardScaler()
+        parts, n_tracks = spool_deduplicated_chunks(dataset_path, chunksize, spool_dir, scaler)
+        staging = os.path.join(spool_dir, 'scaled.npy')
+        features = np.lib.format.open_memmap(staging, mode='w+', dtype=np.float32, shape=(n_tracks, len(audio_features)))
+        offset = 0
+        for part in parts:
+            scaled = scaler.transform(pd.read_parquet(part, columns=audio_features))
+            features[offset:offset + len(scaled)] = scaled
+            offset += len(scaled)
+        features.flush()
+        del features
+        # Publish atomically so an interrupted run never leaves a partial cache entry
+        os.replace(staging, path)
+    return path
+
+
+def exact_neighbors(features_path, n_queries=RECALL_QUERIES, k=RECALL_K, random_state=42):
+    """Seed rows and their exact top-k neighbours, cached next to the scaled features"""
+    path = features_path[:-len('.npy')] + f'-truth-{n_queries}-{k}-{random_state}.npz'
+    if os.path.exists(path):
+        cached = np.load(path)
+        return cached['seeds'], cached['truth']
+    features = np.load(features_path, mmap_mode='r')
+    rng = np.random.default_rng(random_state)
+    seeds = np.sort(rng.choice(len(features), min(n_queries, len(features)), replace=False))
+    _, truth = scan(np.asarray(features[seeds]), features, k)
+    np.savez(path, seeds=seeds, truth=truth)
+    return seeds, truth
+
+
+class ProjectedRows:
+    """Row blocks of a feature matrix projected by a fitted PCA on access, for scan()"""
+
+    def __init__(self, pca, features):
+        self.pca = pca
+        self.features = features
+
+    def __len__(self):
+        return len(self.features)
+
+    def __getitem__(self, rows):
+        return self.pca.transform(np.asarray(self.features[rows], dtype=np.float64)).astype(np.float32)
+
+
+def init_worker(features_path, blas_threads):
+    global _features, _thread_limits
+    _features = np.load(features_path, mmap_mode='r')
+    # Kept referenced so the limit holds for the life of the worker
+    _thread_limits = threadpool_limits(blas_threads)
+
+
+def fit_sample(size, random_state):
+    rng = np.random.default_rng(random_state)
+    rows = np.sort(rng.choice(len(_features), min(size, len(_features)), replace=False))
+    return np.asarray(_features[rows], dtype=np.float64)
+
+
+def score_candidate(kind, value, settings, seeds=None, truth=None):
+    """Fit and score one candidate in a worker process"""
+    start = time.perf_counter()
+    X = fit_sample(settings['fit_sample_size'], settings['random_state'])
+
+    if kind == 'clusters':
+        model = KMeans(n_clusters=value, random_state=settings['random_state']).fit(X)
+        fit_seconds = time.perf_counter() - start
+        metrics = evaluate_clustering(
+            _features, model.predict, settings['memory_limit'], random_state=settings['random_state']
+        )
+        result = {
+            'silhouette': metrics['silhouette'],
+            'silhouette_interval': list(metrics['silhouette_interval']),
+            'calinski_harabasz': metrics['calinski_harabasz'],
+            'davies_bouldin': metrics['davies_bouldin'],
+            'inertia_per_row': float(model.inertia_ / len(X))
+        }
+    else:
+        model = PCA(n_components=value).fit(X)
+        fit_seconds = time.perf_counter() - start
+        projected = ProjectedRows(model, _features)
+        _, found = scan(projected[seeds], projected, truth.shape[1])
+        hits = sum(len(np.intersect1d(f, t)) for f, t in zip(found, truth))
+        result = {
+            'explained_variance': float(model.explained_variance_ratio_.sum()),
+            'recall': hits / truth.size
+        }
+
+    return {
+        'kind': kind,
+        'value': value,
+        'fit_seconds': fit_seconds,
+        'score_seconds': time.perf_counter() - start - fit_seconds,
+        **result
+    }
+
+
+def cache_path(fingerprint, kind, value, settings, cache_dir=CACHE_DIR):
+    key = json.dumps({'data': fingerprint, 'version': SCORE_VERSION, **settings}, sort_keys=True)
+    return os.path.join(cache_dir, f'{kind}-{value}-{hashlib.sha256(key.encode()).hexdigest()[:16]}.json')
+
+
+def choose_best(results):
+    """Highest-silhouette cluster count and smallest PCA size reaching the variance target"""
+    clusters = [r for r in results if r['kind'] == 'clusters']
+    sizes = sorted((r for r in results if r['kind'] == 'pca'), key=lambda r: r['value'])
+    best = {}
+    if clusters:
+        best['n_clusters'] = max(clusters, key=lambda r: r['silhouette'])['value']
+    if sizes:
+        reaching = [r for r in sizes if r['explained_variance'] >= PCA_VARIANCE_TARGET]
+        best['pca_components'] = (reaching[0] if reaching else sizes[-1])['value']
+    return best
+
+
+def sweep(dataset_path=DATASET_PATH, cluster_counts=CLUSTER_COUNTS, pca_sizes=PCA_SIZES,
+          workers=None, fit_sample_size=FIT_SAMPLE_SIZE, memory_limit=DEFAULT_MEMORY_LIMIT,
+          chunksize=STREAMING_CHUNKSIZE, random_state=42, use_cache=True):
+    """
+    Score every candidate across a process pool, reusing cached scores.
+
+    Returns:
+        dict: The report written to REPORT_FILE, with 'best' holding the chosen
+        n_clusters and pca_components
+    """
+    if any(k < 2 for k in cluster_counts):
+        raise ValueError("Cluster counts must be at least 2")
+    if any(not 1 <= n <= len(audio_features) for n in pca_sizes):
+        raise ValueError(f"PCA sizes must be between 1 and {len(audio_features)}")
+
+    start = time.perf_counter()
+    features_path = prepare_scaled_features(dataset_path, chunksize)
+    fingerprint = dataset_fingerprint(dataset_path)
+    n_tracks = len(np.load(features_path, mmap_mode='r'))
+    settings = {'fit_sample_size': fit_sample_size, 'memory_limit': memory_limit, 'random_state': random_state}
+
+    # Largest models first, so the slowest candidates do not start last
+    candidates = [('clusters', k) for k in sorted(cluster_counts, reverse=True)] + \
+                 [('pca', n) for n in sorted(pca_sizes, reverse=True)]
+    results, pending = [], []
+    for kind, value in candidates:
+        path = cache_path(fingerprint, kind, value, settings)
+        if use_cache and os.path.exists(path):
+            with open(path) as f:
+                results.append({**json.load(f), 'cached': True})
+        else:
+            pending.append((kind, value, path))
+    print(f"{len(results)} candidates cached, {len(pending)} to fit")
+
+    if pending:
+        seeds, truth = exact_neighbors(features_path) if any(kind == 'pca' for kind, _, _ in pending) else (None, None)
+        workers = workers or min(len(pending), os.cpu_count() or 1)
+        blas_threads = max(1, (os.cpu_count() or 1) // workers)
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker, initargs=(features_path, blas_threads)
+        ) as executor:
+            futures = {
+                executor.submit(score_candidate, kind, value, settings,
+                                *((seeds, truth) if kind == 'pca' else ())): path
+                for kind, value, path in pending
+            }
+            for future in as_completed(futures):
+                result = future.result()
+                with open(futures[future], 'w') as f:
+                    json.dump(result, f, indent=2)
+                print(f"  {result['kind']}={result['value']} done in "
+                      f"{result['fit_seconds'] + result['score_seconds']:.1f}s")
+                results.append({**result, 'cached': False})
+
+    results.sort(key=lambda r: (r['kind'], r['value']))
+    report = {
+        'dataset': os.path.abspath(dataset_path),
+        'n_tracks': int(n_tracks),
+        'settings': settings,
+        'wall_seconds': time.perf_counter() - start,
+        'candidates': results,
+        'best': choose_best(results)
+    }
+    os.makedirs(SWEEP_DIR, exist_ok=True)
+    with open(REPORT_FILE, 'w') as f:
+        json.dump(report, f, indent=2)
+    with open(BEST_CONFIG_FILE, 'w') as f:
+        json.dump({
+            **report['best'],
+            'dataset': report['dataset'],
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        }, f, indent=2)
+    return report
+
+
+def print_report(report):
+    print(f"\nSweep over {report['n_tracks']} tracks in {report['wall_seconds']:.1f}s")
+    print(f"{'clusters':>8} {'silhouette':>10} {'95% CI':>17} {'CH':>11} {'DB':>7} {'fit s':>7} {'score s':>8}")
+    for r in report['candidates']:
+        if r['kind'] == 'clusters':
+            low, high = r['silhouette_interval']
+            print(f"{r['value']:>8} {r['silhouette']:>10.4f} {low:>8.4f}-{high:<8.4f} {r['calinski_harabasz']:>11.1f} "
+                  f"{r['davies_bouldin']:>7.4f} {r['fit_seconds']:>7.2f} {r['score_seconds']:>8.2f}"
+                  f"{'  (cached)' if r['cached'] else ''}")
+    print(f"\n{'pca':>8} {'variance':>10} {'recall@' + str(RECALL_K):>10} {'fit s':>7} {'score s':>8}")
+    for r in report['candidates']:
+        if r['kind'] == 'pca':
+            print(f"{r['value']:>8} {r['explained_variance']:>10.4f} {r['recall']:>10.4f} "
+                  f"{r['fit_seconds']:>7.2f} {r['score_seconds']:>8.2f}{'  (cached)' if r['cached'] else ''}")
+    print(f"\nBest configuration: {report['best']} (written to {BEST_CONFIG_FILE})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep KMeans cluster counts and PCA sizes in parallel")
+    parser.add_argument('--dataset', default=DATASET_PATH, help="Source CSV with audio features")
+    parser.add_argument('--clusters', type=int, nargs='*', default=list(CLUSTER_COUNTS),
+                        help="Cluster counts to try")
+    parser.add_argument('--pca-components', type=int, nargs='*', default=list(PCA_SIZES),
+                        help="PCA sizes to try")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per core)")
+    parser.add_argument('--fit-sample', type=int, default=FIT_SAMPLE_SIZE, help="Rows each candidate is fitted on")
+    parser.add_argument('--memory-limit', type=int, default=DEFAULT_MEMORY_LIMIT // 2 ** 20,
+                        help="Working memory per worker for the clustering metrics, in MB")
+    parser.add_argument('--chunksize', type=int, default=STREAMING_CHUNKSIZE,
+                        help="Rows read from the source per chunk when scaling it")
+    parser.add_argument('--no-cache', action='store_true', help="Refit every candidate")
+    parser.add_argument('--clear-cache', action='store_true', help="Delete cached data and scores first")
+    args = parser.parse_args()
+
+    if args.clear_cache:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+    report = sweep(
+        args.dataset, args.clusters, args.pca_components, args.workers, args.fit_sample,
+        args.memory_limit * 2 ** 20, args.chunksize, use_cache=not args.no_cache
+    )
+    print_report(report)
+
+
+if __name__ == '__main__':
+    main()
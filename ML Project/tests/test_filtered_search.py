@@ -0,0 +1,151 @@
+"""
+Filtered similarity search against a brute-force masked kNN.
+
+A small bundle is trained once on a synthetic catalog. Every search path of
+RecommendationEngine.find_filtered_neighbors (graph shortcut, IVF with widened
+probes, exact scan over the allowed rows, and the empty result) is compared
+with an exact search over the rows that satisfy the filter, evaluated
+directly on the track columns instead of through the bitmaps.
+"""
+import os
+import numpy as np
+import pytest
+
+N_TRACKS = 3000
+SEEDS = (0, 17, 512, 1999)
+
+
+@pytest.fixture(scope='session')
+def engine(tmp_path_factory):
+    import benchmark
+    import train_model
+    from spotify_utils import RecommendationEngine
+
+    workdir = tmp_path_factory.mktemp('filtered_search')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        benchmark.generate_catalog(N_TRACKS, 'catalog.csv')
+        bundle_path = os.path.abspath(train_model.train('catalog.csv', make_current=False))
+    finally:
+        os.chdir(cwd)
+    return RecommendationEngine(bundle_path, feature_store_path=None)
+
+
+@pytest.fixture(scope='session')
+def tracks(engine):
+    # Metadata and audio features (tempo) in one frame
+    return engine.store.frame()
+
+
+def matching_rows(tracks, filters):
+    """Row positions satisfying `filters`, evaluated on the track columns"""
+    mask = np.ones(len(tracks), dtype=bool)
+    for column in ('mood', 'activity', 'time_of_day'):
+        if column in filters:
+            labels = filters[column] if isinstance(filters[column], list) else [filters[column]]
+            mask &= tracks[column].isin(labels).to_numpy()
+    for column in ('release_year', 'tempo'):
+        if column in filters:
+            low, high = filters[column]
+            values = tracks[column].to_numpy(dtype=np.float64)
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+    if 'exclude_artists' in filters:
+        mask &= ~tracks['artist'].isin(filters['exclude_artists']).to_numpy()
+    return np.flatnonzero(mask)
+
+
+def brute_force(engine, tracks, position, filters, n_neighbors):
+    """
+    Exact search over the matching rows.
+
+    Returns:
+        tuple: (distances padded with inf, nearest rows, every matching row as a set)
+    """
+    features = np.asarray(engine.scaled_features, dtype=np.float64)
+    rows = matching_rows(tracks, filters)
+    row_distances = np.linalg.norm(features[rows] - features[position], axis=1)
+    order = np.argsort(row_distances, kind='stable')[:n_neighbors]
+    distances = np.concatenate([row_distances[order], np.full(n_neighbors - len(order), np.inf)])
+    return distances, rows[order], set(rows.tolist())
+
+
+def check_against_brute_force(engine, tracks, position, filters, n_neighbors, nprobe=None):
+    distances, indices = engine.find_filtered_neighbors(
+        position, engine.compile_filters(filters), n_neighbors, nprobe
+    )
+    expected, _, allowed = brute_force(engine, tracks, position, filters, n_neighbors)
+    found = indices[0][indices[0] >= 0]
+
+    assert distances.shape == indices.shape == (1, n_neighbors)
+    assert set(found.tolist()) <= allowed
+    assert len(set(found.tolist())) == len(found)
+    assert len(found) == np.isfinite(expected).sum()
+    np.testing.assert_allclose(distances[0], expected, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize('position', SEEDS)
+def test_graph_shortcut_matches_brute_force(engine, tracks, position):
+    # Broad filter, fewer neighbours than the graph holds
+    artist = tracks['artist'].iloc[position]
+    check_against_brute_force(engine, tracks, position, {'exclude_artists': [artist]}, 5)
+
+
+@pytest.mark.parametrize('position', SEEDS)
+def test_filtered_ivf_with_every_list_matches_brute_force(engine, tracks, position):
+    # The IVF path of find_filtered_neighbors, probing every list so the answer is exact
+    filters = {'mood': ['Neutral', 'Happy'], 'tempo': (90, 150)}
+    n_neighbors = engine.knn_graph.k + 10
+    ivf = engine.ivf_index
+    query = np.asarray(engine.scaled_features[position], dtype=np.float32)
+    distances, indices = ivf.search(query, n_neighbors, ivf.n_lists, engine.compile_filters(filters))
+    expected, _, allowed = brute_force(engine, tracks, position, filters, n_neighbors)
+
+    assert set(indices[0].tolist()) <= allowed
+    np.testing.assert_allclose(distances[0], expected, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize('position', SEEDS)
+def test_ivf_default_probes_stay_close_to_brute_force(engine, tracks, position):
+    # More neighbours than the graph holds and more matching rows than the scan budget
+    filters = {'mood': ['Neutral', 'Happy'], 'tempo': (90, 150)}
+    n_neighbors = engine.knn_graph.k + 10
+    distances, indices = engine.find_filtered_neighbors(position, engine.compile_filters(filters), n_neighbors)
+    expected, nearest, allowed = brute_force(engine, tracks, position, filters, n_neighbors)
+    found = indices[0][indices[0] >= 0]
+
+    assert set(found.tolist()) <= allowed
+    # Approximate: never closer than the exact answer, and mostly the same rows
+    assert np.all(distances[0][:len(found)] >= expected[:len(found)] - 1e-4)
+    assert len(set(found.tolist()) & set(nearest.tolist())) >= 0.8 * n_neighbors
+
+
+@pytest.mark.parametrize('position', SEEDS)
+def test_selective_filter_scan_matches_brute_force(engine, tracks, position):
+    # One artist and a year range: a handful of rows, scanned exactly
+    artist = tracks['artist'].value_counts().index[0]
+    years = tracks.loc[tracks['artist'] == artist, 'release_year']
+    filters = {
+        'exclude_artists': sorted(set(tracks['artist']) - {artist}),
+        'release_year': (float(years.quantile(0.25)), float(years.quantile(0.75)))
+    }
+    assert 0 < len(matching_rows(tracks, filters)) < 30
+    check_against_brute_force(engine, tracks, position, filters, 10)
+
+
+@pytest.mark.parametrize('position', SEEDS)
+def test_fewer_matches_than_neighbours_are_padded(engine, tracks, position):
+    artist = tracks['artist'].value_counts().index[-1]
+    filters = {'exclude_artists': sorted(set(tracks['artist']) - {artist})}
+    n_matching = len(matching_rows(tracks, filters))
+    check_against_brute_force(engine, tracks, position, filters, n_matching + 5)
+
+
+@pytest.mark.parametrize('nprobe', [None, 1, -1])
+def test_zero_matches_return_empty_result(engine, nprobe):
+    distances, indices = engine.find_filtered_neighbors(0, engine.compile_filters({'mood': 'Nope'}), 10, nprobe)
+    assert np.all(indices == -1)
+    assert np.all(np.isinf(distances))
@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import weakref
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Default location of the processed track store written by train_model.py
+TRACK_STORE_PATH = 'models/track_store'
+
+# Bumped whenever the on-disk layout changes
+STORE_VERSION = 1
+
+# Audio features held in the dense feature block, in column order
+AUDIO_FEATURES = [
+    'danceability', 'energy', 'valence', 'tempo', 'loudness',
+    'speechiness', 'acousticness', 'liveness', 'instrumentalness'
+]
+
+# Explicit dtypes for the columnar metadata table
+METADATA_DTYPES = {
+    'track_id': 'object',
+    'track_name': 'object',
+    'artist': 'object',
+    'album': 'object',
+    'release_year': 'int32',
+    'genres': 'object',
+    'cluster': 'int32',
+    'mood': 'category',
+    'activity': 'category',
+    'time_of_day': 'category'
+}
+
+# Arrow types the metadata columns are written with
+ARROW_TYPES = {
+    'object': pa.string(),
+    'int32': pa.int32(),
+    'category': pa.string()
+}
+
+FEATURE_DTYPE = np.float64
+
+TRACKS_FILE = 'tracks.parquet'
+FEATURES_FILE = 'features.npy'
+MANIFEST_FILE = 'manifest.json'
+
+
+class TrackStore:
+    """
+    Processed track catalog split into a columnar metadata table and a
+    dense (optionally memory-mapped) audio feature matrix.
+    """
+
+    def __init__(self, tracks, features, feature_names=None):
+        self.tracks = tracks
+        self.features = features
+        self.feature_names = list(feature_names or AUDIO_FEATURES)
+
+        # Column order of the legacy processed_tracks.csv, kept for records
+        self.columns = (
+            ['track_id', 'track_name', 'artist', 'album', 'release_year', 'genres'] +
+            self.feature_names +
+            [col for col in tracks.columns if col not in
+             ('track_id', 'track_name', 'artist', 'album', 'release_year', 'genres')]
+        )
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def feature_frame(self, rows=None):
+        """Return the audio features for the given row positions as a DataFrame"""
+        values = self.features if rows is None else self.features[rows]
+        return pd.DataFrame(np.asarray(values), columns=self.feature_names)
+
+    def frame(self, rows=None):
+        """
+        Materialize metadata and audio features as a single DataFrame.
+
+        Args:
+            rows (array-like): Row positions to materialize, or None for all rows
+
+        Returns:
+            DataFrame with the same columns as the legacy processed_tracks.csv
+        """
+        tracks = self.tracks if rows is None else self.tracks.iloc[rows]
+        features = self.feature_frame(rows)
+        features.index = tracks.index
+        return pd.concat([tracks, features], axis=1)[self.columns]
+
+    def records(self, rows):
+        """Materialize only the given row positions as a list of dicts"""
+        return self.frame(rows).to_dict('records')
+
+
+def _prepare_metadata(df):
+    """Select the metadata columns and cast them to their stored dtypes"""
+    tracks = df[list(METADATA_DTYPES)].copy()
+    # 0 marks an unknown release year
+    tracks['release_year'] = tracks['release_year'].fillna(0)
+    tracks['genres'] = tracks['genres'].fillna('')
+    return tracks.astype(METADATA_DTYPES)
+
+
+class TrackStoreWriter:
+    """
+    Write a track store chunk by chunk.
+
+    Metadata chunks are appended to the Parquet file as row groups and
+    features are written into a pre-allocated memory-mapped .npy block, so
+    only the current chunk is held in memory.
+    """
+
+    def __init__(self, path, n_tracks, feature_names=None):
+        self.path = path
+        self.n_tracks = int(n_tracks)
+        self.feature_names = list(feature_names or AUDIO_FEATURES)
+        self.n_written = 0
+
+        os.makedirs(path, exist_ok=True)
+        self.schema = pa.schema([
+            (col, ARROW_TYPES[dtype]) for col, dtype in METADATA_DTYPES.items()
+        ])
+        self.tracks_writer = pq.ParquetWriter(os.path.join(path, TRACKS_FILE), self.schema)
+        self.features = np.lib.format.open_memmap(
+            os.path.join(path, FEATURES_FILE), mode='w+',
+            dtype=FEATURE_DTYPE, shape=(self.n_tracks, len(self.feature_names))
+        )
+
+    def write(self, chunk):
+        """Append a chunk of processed tracks including audio feature columns"""
+        end = self.n_written + len(chunk)
+        if end > self.n_tracks:
+            raise ValueError(f"Track store writer expected {self.n_tracks} tracks, got at least {end}")
+
+        tracks = _prepare_metadata(chunk.reset_index(drop=True))
+        tracks = tracks.astype({col: 'object' for col, dtype in METADATA_DTYPES.items() if dtype == 'category'})
+        self.tracks_writer.write_table(
+            pa.Table.from_pandas(tracks[self.schema.names], schema=self.schema, preserve_index=False)
+        )
+        self.features[self.n_written:end] = chunk[self.feature_names].values
+        self.n_written = end
+
+    def close(self):
+        """Finish the store and write its manifest"""
+        self.tracks_writer.close()
+        self.features.flush()
+        if self.n_written != self.n_tracks:
+            raise ValueError(f"Track store writer expected {self.n_tracks} tracks, got {self.n_written}")
+
+        manifest = {
+            'version': STORE_VERSION,
+            'n_tracks': self.n_tracks,
+            'feature_names': self.feature_names,
+            'feature_dtype': np.dtype(FEATURE_DTYPE).name,
+            'metadata_dtypes': dict(METADATA_DTYPES)
+        }
+        with open(os.path.join(self.path, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+
+def save_track_store(features_df, path=TRACK_STORE_PATH, feature_names=None):
+    """
+    Write processed tracks as a Parquet metadata table plus a raw .npy feature block.
+
+    Args:
+        features_df (DataFrame): Processed tracks including audio feature columns
+        path (str): Directory to write the store into
+        feature_names (list): Audio feature columns to store in the feature block
+    """
+    writer = TrackStoreWriter(path, len(features_df), feature_names)
+    writer.write(features_df)
+    writer.close()
+
+
+def track_store_exists(path=TRACK_STORE_PATH):
+    """Check whether a complete track store exists at the given path"""
+    return all(
+        os.path.exists(os.path.join(path, name))
+        for name in (TRACKS_FILE, FEATURES_FILE, MANIFEST_FILE)
+    )
+
+
+def load_track_store(path=TRACK_STORE_PATH, mmap=True):
+    """
+    Load a track store from disk.
+
+    Args:
+        path (str): Directory containing the store
+        mmap (bool): Memory-map the feature block instead of reading it into memory
+
+    Returns:
+        TrackStore
+    """
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+
+    if manifest.get('version') != STORE_VERSION:
+        raise ValueError(
+            f"Unsupported track store version {manifest.get('version')}, "
+            f"expected {STORE_VERSION}. Please run train_model.py again."
+        )
+
+    tracks = pd.read_parquet(os.path.join(path, TRACKS_FILE), engine='pyarrow')
+    tracks = tracks.astype({col: METADATA_DTYPES[col] for col in tracks.columns if col in METADATA_DTYPES})
+    features = np.load(os.path.join(path, FEATURES_FILE), mmap_mode='r' if mmap else None)
+
+    if len(features) != len(tracks) or len(features) != manifest['n_tracks']:
+        raise ValueError(f"Track store at {path} is inconsistent: row counts do not match")
+
+    return TrackStore(tracks, features, manifest['feature_names'])
+
+
+def read_track_column(path, column):
+    """Read one metadata column of a track store without loading the rest of the table"""
+    dtype = METADATA_DTYPES[column]
+    table = pq.read_table(
+        os.path.join(path, TRACKS_FILE), columns=[column],
+        read_dictionary=[column] if dtype == 'category' else None
+    )
+    return table.column(column).to_pandas().astype(dtype)
+
+
+# Weak references only: a store is freed with the last bundle using it, so hot swaps do not pile up old catalogs
+_shared_stores = weakref.WeakValueDictionary()
+
+
+def get_track_store(path=TRACK_STORE_PATH):
+    """Return a process-wide shared TrackStore so every loader uses the same copy"""
+    key = os.path.abspath(path)
+    store = _shared_stores.get(key)
+    if store is None:
+        store = _shared_stores[key] = load_track_store(path)
+    return store
+
+
+def convert_csv(csv_path='models/processed_tracks.csv', path=TRACK_STORE_PATH):
+    """Convert a legacy processed_tracks.csv into a track store"""
+    print(f"Converting {csv_path} to {path}...")
+    save_track_store(pd.read_csv(csv_path), path)
+    print("Conversion complete!")
+
+
+if __name__ == '__main__':
+    convert_csv(*sys.argv[1:3])
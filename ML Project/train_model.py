@@ -1,119 +1,490 @@
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
-from sklearn.cluster import KMeans
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.neighbors import NearestNeighbors
 import joblib
 import os
+import sys
+import argparse
+import shutil
+import tempfile
+import json
+from track_store import save_track_store, TrackStoreWriter
+from ann_index import IVFIndex, DEFAULT_NPROBE
+from knn_graph import build_knn_graph, KNN_GRAPH_K
+from labeling import assign_labels, LABEL_RULES
+from genre_matrix import build_genre_matrix, GenreMatrixWriter
+from catalog_index import TrackIdIndex, CategoryIndex, encode_ids, TrackIdIndexWriter, CategoryIndexWriter
+from filter_index import FilterIndex, FilterIndexWriter
+from quantized_features import QuantizedFeatures
+from model_bundle import create_staging_dir, publish_bundle, acquire_training_lock, COMPONENT_PATHS, MODELS_DIR, BUNDLES_DIR, TRAINING_LOCK_FILE
 
-print("Loading dataset...")
-# Load the dataset
-df = pd.read_csv("spotify_data_with_instrumentalness.csv")
-
-# Remove duplicates
-df_nodup = df.drop_duplicates(subset=['track_id'])
-
-# Fill missing values
-df_nodup['genres'] = df_nodup['genres'].fillna('')
+DATASET_PATH = "spotify_data_with_instrumentalness.csv"
 
 # Select features for clustering and recommendation
-audio_features = ['danceability', 'energy', 'valence', 'tempo', 'loudness', 
+audio_features = ['danceability', 'energy', 'valence', 'tempo', 'loudness',
                  'speechiness', 'acousticness', 'liveness', 'instrumentalness']
 
-# Create a copy of the dataset with only the needed columns
-features_df = df_nodup[['track_id', 'track_name', 'artist', 'album', 'release_year', 'genres'] + audio_features].copy()
-
-# Normalize the audio features
-scaler = StandardScaler()
-features_scaled = pd.DataFrame(scaler.fit_transform(features_df[audio_features]), columns=audio_features)
-
-print("Training models...")
-# Dimensionality reduction with PCA
-pca = PCA(n_components=3)
-features_pca = pca.fit_transform(features_scaled.values)
-
-# Clustering for mood/genre categorization
-kmeans = KMeans(n_clusters=8, random_state=42)
-clusters = kmeans.fit_predict(features_scaled.values)
-features_df['cluster'] = clusters
-
-# Create a nearest neighbors model for recommendations
-nn_model = NearestNeighbors(n_neighbors=10, algorithm='auto')
-nn_model.fit(features_scaled.values)
-
-# Create mood mappings based on audio features
-def assign_mood(row):
-    # High valence and energy = Happy
-    if row['valence'] > 0.6 and row['energy'] > 0.6:
-        return 'Happy'
-    # Low valence, high energy = Angry
-    elif row['valence'] < 0.4 and row['energy'] > 0.6:
-        return 'Angry'
-    # High valence, low energy = Relaxed
-    elif row['valence'] > 0.6 and row['energy'] < 0.4:
-        return 'Relaxed'
-    # Low valence, low energy = Sad
-    elif row['valence'] < 0.4 and row['energy'] < 0.4:
-        return 'Sad'
-    # Everything else = Neutral
+# Metadata columns kept alongside the audio features
+metadata_columns = ['track_id', 'track_name', 'artist', 'album', 'release_year', 'genres']
+
+# Default hyperparameters; sweep_model.py writes tuned values for --config
+N_PCA_COMPONENTS = 3
+N_CLUSTERS = 8
+
+# Rows read from the source per chunk in streaming mode
+STREAMING_CHUNKSIZE = 100000
+
+# Scalar quantization of the compact feature copy ('int8' or 'float16')
+QUANTIZED_DTYPE = 'int8'
+
+# Source bytes per deduplication partition in streaming mode. Every CSV row is
+# longer than its 16-byte (hash, row) record, so a partition takes less memory.
+DEDUP_PARTITION_BYTES = 64 * 2 ** 20
+MAX_DEDUP_PARTITION_BITS = 12
+DEDUP_RECORD = np.dtype([('hash', np.uint64), ('row', np.int64)])
+
+# Inverted lists probed per track when the streaming neighbour graph is built from the IVF index
+GRAPH_NPROBE = 2 * DEFAULT_NPROBE
+
+
+def report_progress(progress, message, fraction):
+    """Print a training stage and pass it to the optional progress callback"""
+    print(message)
+    if progress is not None:
+        progress(message, fraction)
+
+
+def build_neighbor_models(features_scaled, bundle_dir, progress=None, fraction=0.5, streaming=False, exact_model=True):
+    """
+    Fit the exact nearest neighbours model, the IVF index and the neighbour graph.
+
+    Args:
+        features_scaled (array): Scaled feature matrix, one row per track
+        bundle_dir (str): Bundle directory the neighbour graph is written into
+        progress (callable): Called with (message, fraction done) at each stage
+        fraction (float): Fraction of the whole training run done before this step
+        streaming (bool): Features may be larger than memory (a memory map):
+            the IVF index is written straight into the bundle
+        exact_model (bool): Fit the exact model; without it the neighbour
+            graph comes from the IVF index and exact search scans the features
+
+    Returns:
+        (nn_model or None, ivf_index)
+    """
+    # Create a nearest neighbors model for recommendations
+    nn_model = NearestNeighbors(n_neighbors=10, algorithm='auto').fit(features_scaled) if exact_model else None
+
+    # Build an IVF approximate nearest neighbours index. The coarse quantizer is a
+    # finer set of centroids than the 8 mood clusters so each probe stays small.
+    report_progress(progress, "Building IVF index...", fraction)
+    if streaming:
+        ivf_index = IVFIndex.write(features_scaled, os.path.join(bundle_dir, COMPONENT_PATHS['ivf_index']))
     else:
-        return 'Neutral'
-
-# Assign moods to each track
-features_df['mood'] = features_df.apply(assign_mood, axis=1)
-
-# Create activity mappings
-def assign_activity(row):
-    # High tempo and energy = Workout
-    if row['tempo'] > 120 and row['energy'] > 0.7:
-        return 'Workout'
-    # High acousticness, low energy = Study/Focus
-    elif row['acousticness'] > 0.6 and row['energy'] < 0.5:
-        return 'Study/Focus'
-    # High danceability and energy = Party
-    elif row['danceability'] > 0.7 and row['energy'] > 0.6:
-        return 'Party'
-    # Moderate tempo, low energy = Relaxation
-    elif 70 <= row['tempo'] <= 110 and row['energy'] < 0.4:
-        return 'Relaxation'
-    # Everything else = General
+        ivf_index = IVFIndex.build(features_scaled)
+    recall = ivf_index.measure_recall(features_scaled, k=10, exact_model=nn_model)
+    print(f"IVF index: {ivf_index.n_lists} lists over {ivf_index.n_tracks} tracks")
+    for nprobe, value in recall.items():
+        print(f"  nprobe={nprobe:<3} recall@10={value:.4f}")
+
+    # Precompute the neighbour graph so in-catalog seeds need no live search
+    report_progress(progress, f"Computing top-{KNN_GRAPH_K} neighbour graph...", fraction + 0.15)
+    graph_path = os.path.join(bundle_dir, COMPONENT_PATHS['knn_graph'])
+    if nn_model is not None:
+        build_knn_graph(features_scaled, KNN_GRAPH_K, graph_path, nn_model=nn_model)
     else:
-        return 'General'
-
-# Assign activities to each track
-features_df['activity'] = features_df.apply(assign_activity, axis=1)
-
-# Create time-of-day mappings
-def assign_time_of_day(row):
-    # High energy and tempo = Morning
-    if row['energy'] > 0.7 and row['tempo'] > 110:
-        return 'Morning'
-    # Moderate energy and valence = Afternoon
-    elif 0.4 <= row['energy'] <= 0.7 and row['valence'] >= 0.5:
-        return 'Afternoon'
-    # Low energy, low tempo = Evening
-    elif row['energy'] < 0.4 and row['tempo'] < 100:
-        return 'Evening'
-    # Low energy, high valence = Night
-    elif row['energy'] < 0.5 and row['valence'] > 0.6:
-        return 'Night'
-    # Everything else = Any Time
+        build_knn_graph(features_scaled, KNN_GRAPH_K, graph_path,
+                        search=lambda queries, k: ivf_index.search(queries, k, GRAPH_NPROBE))
+
+    return nn_model, ivf_index
+
+
+def save_models(bundle_dir, scaler, pca, kmeans, nn_model=None, ivf_index=None, genre_matrix=None):
+    """
+    Save the fitted models and the genre matrix into a bundle directory.
+
+    Components passed as None are skipped: the exact model is optional, and
+    streaming training writes the IVF index and genre matrix in place.
+    """
+    # Per-track labels live in the track store's cluster column
+    if hasattr(kmeans, 'labels_'):
+        del kmeans.labels_
+
+    def component_path(name):
+        return os.path.join(bundle_dir, COMPONENT_PATHS[name])
+
+    joblib.dump(scaler, component_path('scaler'))
+    joblib.dump(pca, component_path('pca'))
+    joblib.dump(kmeans, component_path('kmeans'))
+    if nn_model is not None:
+        joblib.dump(nn_model, component_path('nn_model'))
+    if ivf_index is not None:
+        ivf_index.save(component_path('ivf_index'))
+    if genre_matrix is not None:
+        genre_matrix.save(component_path('genre_matrix'))
+
+
+def save_quantized_features(bundle_dir, features_scaled, streaming=False):
+    """Write the compact copy of the scaled features used for quantized brute-force search"""
+    path = os.path.join(bundle_dir, COMPONENT_PATHS['quantized_features'])
+    if streaming:
+        # Quantize straight into the saved codes file instead of memory
+        os.makedirs(path, exist_ok=True)
+        codes = np.lib.format.open_memmap(
+            os.path.join(path, 'codes.npy'), mode='w+', dtype=QUANTIZED_DTYPE, shape=features_scaled.shape
+        )
+        quantized = QuantizedFeatures.build(features_scaled, QUANTIZED_DTYPE, out=codes)
+        codes.flush()
+        quantized.save_parameters(path)
     else:
-        return 'Any Time'
+        quantized = QuantizedFeatures.build(features_scaled, QUANTIZED_DTYPE)
+        quantized.save(path)
+    print(f"Quantized features: {quantized.dtype}, {quantized.nbytes / 2 ** 20:.1f} MB")
+
+
+def save_catalog_indexes(bundle_dir, encoded_ids, tracks):
+    """Save the track_id, category and filter lookup arrays, row-aligned with the track store"""
+    TrackIdIndex.build(encoded_ids).save(os.path.join(bundle_dir, COMPONENT_PATHS['id_index']))
+    CategoryIndex.build(tracks).save(os.path.join(bundle_dir, COMPONENT_PATHS['category_index']))
+    FilterIndex.build(tracks).save(os.path.join(bundle_dir, COMPONENT_PATHS['filter_index']))
+
+
+def publish(bundle_dir, n_tracks, make_current, n_clusters, pca_components):
+    """Publish a fully written bundle"""
+    metadata = {
+        'n_tracks': int(n_tracks),
+        'feature_names': audio_features,
+        'hyperparameters': {'n_clusters': n_clusters, 'pca_components': pca_components}
+    }
+    path = publish_bundle(bundle_dir, metadata, make_current=make_current)
+    print(f"Published model bundle {path}")
+    return path
+
+
+def load_training_config(path):
+    """Read the hyperparameters written by sweep_model.py as keyword arguments for train()"""
+    with open(path) as f:
+        config = json.load(f)
+    return {'n_clusters': int(config['n_clusters']), 'pca_components': int(config['pca_components'])}
+
+
+def train(dataset_path=DATASET_PATH, progress=None, make_current=True,
+          n_clusters=N_CLUSTERS, pca_components=N_PCA_COMPONENTS):
+    """
+    Train every model with the whole dataset held in memory.
+
+    Args:
+        dataset_path (str): Source CSV with audio features
+        progress (callable): Called with (message, fraction done) at each stage
+        make_current (bool): Serve the new bundle right away
+        n_clusters (int): KMeans cluster count
+        pca_components (int): PCA components kept
+
+    Returns:
+        str: Path of the published model bundle
+    """
+    bundle_dir = create_staging_dir()
+    try:
+        n_tracks = train_into(dataset_path, bundle_dir, progress, n_clusters, pca_components)
+        return publish(bundle_dir, n_tracks, make_current, n_clusters, pca_components)
+    except BaseException:
+        shutil.rmtree(bundle_dir, ignore_errors=True)
+        raise
+
+
+def train_into(dataset_path, bundle_dir, progress=None, n_clusters=N_CLUSTERS, pca_components=N_PCA_COMPONENTS):
+    """Fit the in-memory models and write them into a staging bundle, returning the track count"""
+    report_progress(progress, "Loading dataset...", 0.0)
+    # Load the dataset
+    df = pd.read_csv(dataset_path)
+
+    # Remove duplicates
+    df_nodup = df.drop_duplicates(subset=['track_id'])
+
+    # Create a copy of the dataset with only the needed columns
+    features_df = df_nodup[metadata_columns + audio_features].copy()
+
+    # Fill missing values
+    features_df['genres'] = features_df['genres'].fillna('')
+
+    # Normalize the audio features
+    scaler = StandardScaler()
+    features_scaled = pd.DataFrame(scaler.fit_transform(features_df[audio_features]), columns=audio_features)
+
+    report_progress(progress, "Training models...", 0.1)
+    # Dimensionality reduction with PCA
+    pca = PCA(n_components=pca_components)
+    features_pca = pca.fit_transform(features_scaled.values)
+
+    # Clustering for mood/genre categorization
+    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
+    clusters = kmeans.fit_predict(features_scaled.values)
+    features_df['cluster'] = clusters
+
+    nn_model, ivf_index = build_neighbor_models(features_scaled.values, bundle_dir, progress, 0.4)
+
+    # Track x genre matrix, row-aligned with the track store
+    genre_matrix = build_genre_matrix(features_df['genres'])
+    print(f"Genre vocabulary: {len(genre_matrix.vocabulary)} genres")
+
+    # Assign mood, activity and time-of-day labels with the vectorized rule table
+    report_progress(progress, "Assigning labels...", 0.8)
+    labels = assign_labels(features_df, LABEL_RULES)
+    for name in labels.columns:
+        features_df[name] = labels[name]
+
+    # Save the models and processed data
+    report_progress(progress, "Saving models and processed data...", 0.9)
+    save_models(bundle_dir, scaler, pca, kmeans, nn_model, ivf_index, genre_matrix)
+    scaled = features_scaled.values.astype(np.float32)
+    np.save(os.path.join(bundle_dir, COMPONENT_PATHS['scaled_features']), scaled)
+    save_quantized_features(bundle_dir, scaled)
+
+    # Save the processed tracks as a columnar store with a raw feature block
+    save_track_store(features_df, os.path.join(bundle_dir, COMPONENT_PATHS['track_store']), audio_features)
+    save_catalog_indexes(bundle_dir, encode_ids(features_df['track_id']), features_df)
+    return len(features_df)
+
+
+def dedup_partition_bits(dataset_path):
+    """Hash bits that split the source into partitions of at most DEDUP_PARTITION_BYTES"""
+    n_partitions = max(1, os.path.getsize(dataset_path) // DEDUP_PARTITION_BYTES + 1)
+    return min(int(np.ceil(np.log2(n_partitions))), MAX_DEDUP_PARTITION_BITS)
+
+
+def first_occurrences(partition_files, n_rows, path):
+    """
+    Flag the first spooled row of every track_id hash, one partition at a time.
+
+    Returns:
+        np.memmap: bool per spooled row, True for the rows to keep
+    """
+    keep = np.lib.format.open_memmap(path, mode='w+', dtype=bool, shape=(n_rows,))
+    for partition in partition_files:
+        if not os.path.exists(partition):
+            continue
+        # Rows were appended in increasing order, so a stable sort keeps the first one first
+        records = np.fromfile(partition, dtype=DEDUP_RECORD)
+        order = np.argsort(records['hash'], kind='stable')
+        hashes = records['hash'][order]
+        first = np.concatenate([[True], hashes[1:] != hashes[:-1]])
+        keep[records['row'][order][first]] = True
+    return keep
+
+
+def spool_deduplicated_chunks(dataset_path, chunksize, spool_dir, scaler):
+    """
+    Read the source in chunks, drop duplicate track_ids across chunks and
+    spool the surviving rows to Parquet parts while fitting the scaler.
+
+    Every row's 64-bit track_id hash is appended to one of up to 2 **
+    MAX_DEDUP_PARTITION_BITS partition files on disk. Partitions are then
+    deduplicated one at a time, so memory is bounded by a chunk plus one
+    partition, not by the catalog.
+
+    Returns:
+        (list of spooled part paths, number of unique tracks)
+    """
+    bits = dedup_partition_bits(dataset_path)
+    partition_files = [os.path.join(spool_dir, f'dedup-{i:04d}.bin') for i in range(2 ** bits)]
+    parts, part_rows = [], []
+    n_rows = 0
+
+    # Pass 1: spool every chunk and partition its hashes
+    for chunk in pd.read_csv(dataset_path, chunksize=chunksize, usecols=metadata_columns + audio_features):
+        chunk = chunk.drop_duplicates(subset=['track_id'])
+        if chunk.empty:
+            continue
+        records = np.empty(len(chunk), dtype=DEDUP_RECORD)
+        records['hash'] = pd.util.hash_pandas_object(chunk['track_id'], index=False).to_numpy()
+        records['row'] = np.arange(n_rows, n_rows + len(chunk))
+        partitions = records['hash'] >> np.uint64(64 - bits) if bits else np.zeros(len(chunk), dtype=np.uint64)
+        order = np.argsort(partitions, kind='stable')
+        bounds = np.searchsorted(partitions[order], np.arange(2 ** bits + 1))
+        for i in np.flatnonzero(np.diff(bounds)):
+            with open(partition_files[i], 'ab') as f:
+                records[order[bounds[i]:bounds[i + 1]]].tofile(f)
+
+        part = os.path.join(spool_dir, f'part-{len(parts):05d}.parquet')
+        chunk.to_parquet(part, index=False)
+        parts.append(part)
+        part_rows.append(len(chunk))
+        n_rows += len(chunk)
+        print(f"  read {n_rows} tracks")
+
+    # Pass 2: keep the first occurrence of every track_id across all chunks
+    keep = first_occurrences(partition_files, n_rows, os.path.join(spool_dir, 'keep.npy'))
+    for partition in partition_files:
+        if os.path.exists(partition):
+            os.remove(partition)
+
+    kept_parts = []
+    n_tracks = offset = 0
+    for part, rows in zip(parts, part_rows):
+        part_keep = np.asarray(keep[offset:offset + rows])
+        offset += rows
+        if not part_keep.any():
+            os.remove(part)
+            continue
+        chunk = pd.read_parquet(part)
+        if not part_keep.all():
+            chunk = chunk[part_keep].reset_index(drop=True)
+        chunk['genres'] = chunk['genres'].fillna('')
+        scaler.partial_fit(chunk[audio_features])
+        chunk.to_parquet(part, index=False)
+        kept_parts.append(part)
+        n_tracks += len(chunk)
+    del keep
+    os.remove(os.path.join(spool_dir, 'keep.npy'))
+    print(f"  {n_tracks} unique tracks")
+
+    return kept_parts, n_tracks
+
+
+def train_streaming(dataset_path=DATASET_PATH, chunksize=STREAMING_CHUNKSIZE, progress=None, make_current=True,
+                    n_clusters=N_CLUSTERS, pca_components=N_PCA_COMPONENTS, exact_model=False):
+    """
+    Train out-of-core, holding at most one chunk of the source in memory.
+
+    The source is read once and spooled to Parquet, and duplicate track_ids
+    are dropped using hash partitions on disk. Incremental
+    PCA and mini-batch KMeans are fitted over the spool, then the track store,
+    scaled features, genre matrix and catalog indexes are written chunk by
+    chunk into memory-mapped files. The IVF index is fitted on a sample and
+    filled block by block, and the neighbour graph is computed from it, so
+    memory does not grow with the catalog. The exact sklearn model holds the
+    whole matrix in memory and is only fitted with exact_model=True.
+
+    Args:
+        dataset_path (str): Source CSV with audio features
+        chunksize (int): Rows read from the source per chunk
+        progress (callable): Called with (message, fraction done) at each stage
+        make_current (bool): Serve the new bundle right away
+        n_clusters (int): KMeans cluster count
+        pca_components (int): PCA components kept
+        exact_model (bool): Also fit the exact NearestNeighbors model
+
+    Returns:
+        str: Path of the published model bundle
+    """
+    bundle_dir = create_staging_dir()
+    try:
+        n_tracks = train_streaming_into(
+            dataset_path, chunksize, bundle_dir, progress, n_clusters, pca_components, exact_model
+        )
+        return publish(bundle_dir, n_tracks, make_current, n_clusters, pca_components)
+    except BaseException:
+        shutil.rmtree(bundle_dir, ignore_errors=True)
+        raise
+
+
+def train_streaming_into(dataset_path, chunksize, bundle_dir, progress=None,
+                         n_clusters=N_CLUSTERS, pca_components=N_PCA_COMPONENTS, exact_model=False):
+    """Fit the streaming models and write them into a staging bundle, returning the track count"""
+    with tempfile.TemporaryDirectory(dir=MODELS_DIR) as spool_dir:
+        # Pass 1: deduplicate, spool and fit the scaler
+        report_progress(progress, "Loading dataset in chunks...", 0.0)
+        scaler = StandardScaler()
+        parts, n_tracks = spool_deduplicated_chunks(dataset_path, chunksize, spool_dir, scaler)
+
+        # Pass 2: fit incremental PCA and clustering
+        report_progress(progress, "Training models...", 0.2)
+        pca = IncrementalPCA(n_components=pca_components)
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3)
+        for part in parts:
+            scaled = scaler.transform(pd.read_parquet(part, columns=audio_features))
+            # Incremental estimators need at least as many rows as components
+            if len(scaled) >= pca_components:
+                pca.partial_fit(scaled)
+            if len(scaled) >= n_clusters:
+                kmeans.partial_fit(scaled)
+
+        # Pass 3: cluster, label and write every row-aligned component chunk by chunk
+        report_progress(progress, "Assigning clusters and labels...", 0.35)
+
+        def component_path(name):
+            return os.path.join(bundle_dir, COMPONENT_PATHS[name])
+
+        writer = TrackStoreWriter(component_path('track_store'), n_tracks, audio_features)
+        genres = GenreMatrixWriter(component_path('genre_matrix'), spool_dir)
+        id_index = TrackIdIndexWriter(component_path('id_index'), spool_dir)
+        category_index = CategoryIndexWriter(component_path('category_index'), n_tracks, spool_dir)
+        filter_index = FilterIndexWriter(component_path('filter_index'), n_tracks, spool_dir)
+        features_scaled = np.lib.format.open_memmap(
+            component_path('scaled_features'), mode='w+', dtype=np.float32, shape=(n_tracks, len(audio_features))
+        )
+        offset = 0
+        for part in parts:
+            chunk = pd.read_parquet(part)
+            scaled = scaler.transform(chunk[audio_features])
+            chunk['cluster'] = kmeans.predict(scaled)
+            labels = assign_labels(chunk, LABEL_RULES)
+            for name in labels.columns:
+                chunk[name] = labels[name]
+            writer.write(chunk)
+            genres.write(chunk['genres'])
+            id_index.write(chunk['track_id'])
+            category_index.write(chunk)
+            filter_index.write(chunk)
+            features_scaled[offset:offset + len(chunk)] = scaled
+            offset += len(chunk)
+        writer.close()
+        genre_matrix = genres.close()
+        print(f"Genre vocabulary: {len(genre_matrix.vocabulary)} genres")
+        id_index.close()
+        category_index.close()
+        filter_index.close()
+        features_scaled.flush()
+
+        nn_model, ivf_index = build_neighbor_models(
+            features_scaled, bundle_dir, progress, 0.5, streaming=True, exact_model=exact_model
+        )
+
+        report_progress(progress, "Saving models...", 0.9)
+        save_models(bundle_dir, scaler, pca, kmeans, nn_model)
+        save_quantized_features(bundle_dir, features_scaled, streaming=True)
+        return n_tracks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the song recommendation models")
+    parser.add_argument('--dataset', default=DATASET_PATH, help="Source CSV with audio features")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Read the source in chunks so memory does not grow with its size")
+    parser.add_argument('--chunksize', type=int, default=STREAMING_CHUNKSIZE,
+                        help="Rows per chunk in streaming mode")
+    parser.add_argument('--exact-model', action='store_true',
+                        help="In streaming mode, also fit the exact nearest neighbours model (holds every row in memory)")
+    parser.add_argument('--config', default=None,
+                        help="JSON with n_clusters and pca_components, e.g. models/sweep/best_config.json")
+    parser.add_argument('--n-clusters', type=int, default=None, help=f"KMeans clusters (default {N_CLUSTERS})")
+    parser.add_argument('--pca-components', type=int, default=None,
+                        help=f"PCA components (default {N_PCA_COMPONENTS})")
+    args = parser.parse_args()
+
+    # Explicit flags override the config file, which overrides the defaults
+    hyperparameters = {'n_clusters': N_CLUSTERS, 'pca_components': N_PCA_COMPONENTS}
+    if args.config:
+        hyperparameters.update(load_training_config(args.config))
+    if args.n_clusters is not None:
+        hyperparameters['n_clusters'] = args.n_clusters
+    if args.pca_components is not None:
+        hyperparameters['pca_components'] = args.pca_components
+    print(f"Hyperparameters: {hyperparameters}")
 
-# Assign time of day to each track
-features_df['time_of_day'] = features_df.apply(assign_time_of_day, axis=1)
+    lock_file = acquire_training_lock()
+    if lock_file is None:
+        sys.exit(f"Another training job holds {os.path.join(BUNDLES_DIR, TRAINING_LOCK_FILE)}, try again once it finishes.")
+    with lock_file:
+        if args.streaming:
+            train_streaming(args.dataset, args.chunksize, exact_model=args.exact_model, **hyperparameters)
+        else:
+            train(args.dataset, **hyperparameters)
 
-# Save the models and processed data
-print("Saving models and processed data...")
-os.makedirs('models', exist_ok=True)
-joblib.dump(scaler, 'models/scaler.pkl')
-joblib.dump(pca, 'models/pca.pkl')
-joblib.dump(kmeans, 'models/kmeans.pkl')
-joblib.dump(nn_model, 'models/nearest_neighbors.pkl')
+    print("Model training complete!")
 
-# Save the processed dataframe
-features_df.to_csv('models/processed_tracks.csv', index=False)
 
-print("Model training complete!")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import shutil
+import threading
+import subprocess
+import time
+import uuid
+import numpy as np
+from model_bundle import set_current_bundle, acquire_training_lock
+
+# Tracks sampled when validating a freshly trained bundle
+VALIDATION_SAMPLE_SIZE = 20
+
+# Scheduling priority added to the training process, so serving threads win the CPU
+TRAINING_NICENESS = 10
+
+
+class TrainingInProgress(Exception):
+    """Raised when a training job is requested while another one is running"""
+
+
+def validate_engine(engine, sample_size=VALIDATION_SAMPLE_SIZE, seed=0):
+    """
+    Check that a freshly trained bundle is consistent and answers queries.
+
+    Verifies the checksums, that every component covers the same tracks, and
+    that sampled tracks come back as their own nearest neighbour from both
+    the neighbour graph and the IVF index.
+
+    Raises:
+        ValueError: Describing the first failed check
+    """
+    bundle = engine.bundle
+    mismatched = bundle.verify()
+    if mismatched:
+        raise ValueError(f"Checksum mismatch in {', '.join(mismatched)}")
+
+    n_tracks = bundle.manifest['n_tracks']
+    sizes = {
+        'track_store': len(engine.tracks_df),
+        'scaled_features': len(engine.scaled_features),
+        'knn_graph': len(engine.knn_graph),
+        'ivf_index': engine.ivf_index.n_tracks,
+        'genre_matrix': len(engine.genre_matrix),
+        'id_index': len(engine.track_index),
+        'filter_index': engine.filter_index.n_tracks
+    }
+    wrong = {name: size for name, size in sizes.items() if size != n_tracks}
+    if wrong:
+        raise ValueError(f"Components do not cover the {n_tracks} tracks of the manifest: {wrong}")
+
+    positions = np.random.default_rng(seed).choice(n_tracks, min(sample_size, n_tracks), replace=False)
+    graph_distances, _ = engine.knn_graph.neighbors(positions, 1)
+    ivf_distances, _ = engine.ivf_index.search(engine.scaled_features[positions], 1, engine.ivf_index.n_lists)
+    if not (np.allclose(graph_distances[:, 0], 0, atol=1e-3) and np.allclose(ivf_distances[:, 0], 0, atol=1e-3)):
+        raise ValueError("Sampled tracks are not their own nearest neighbour")
+
+    track_id = engine.tracks_df['track_id'].iloc[positions[0]]
+    if not engine.get_similar_tracks(track_id):
+        raise ValueError("No recommendations returned for a catalog track")
+
+
+def train_in_child(dataset_path, streaming, chunksize, messages):
+    """
+    Body of the training process: trains and publishes a bundle without
+    making it current. Reports to the file `messages` as JSON lines:
+    ["progress", message, fraction], then ["done", bundle_path] or ["error", message].
+    """
+    import train_model
+
+    def send(*message):
+        messages.write(json.dumps(message) + '\n')
+        messages.flush()
+
+    try:
+        dataset_path = dataset_path or train_model.DATASET_PATH
+        if streaming:
+            bundle_path = train_model.train_streaming(
+                dataset_path, chunksize or train_model.STREAMING_CHUNKSIZE,
+                progress=lambda message, fraction: send('progress', message, fraction), make_current=False
+            )
+        else:
+            bundle_path = train_model.train(
+                dataset_path, progress=lambda message, fraction: send('progress', message, fraction),
+                make_current=False
+            )
+        send('done', bundle_path)
+    except Exception as e:
+        send('error', str(e))
+
+
+class TrainingJob:
+    """State of one training run, readable from any thread"""
+
+    def __init__(self, dataset_path, streaming, chunksize):
+        self.id = uuid.uuid4().hex[:12]
+        self.dataset_path = dataset_path
+        self.streaming = streaming
+        self.chunksize = chunksize
+        self.status = 'queued'
+        self.stage = None
+        self.progress = 0.0
+        self.bundle_version = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': round(self.progress, 3),
+            'streaming': self.streaming,
+            'bundle_version': self.bundle_version,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+
+class TrainingManager:
+    """
+    Runs training in a spawned child process, one job at a time across every
+    worker process sharing the bundles directory.
+
+    Training never shares the serving process's GIL or memory: a background
+    thread only relays the child's progress. The child publishes the bundle
+    without serving it; back in this process it is loaded with `load_engine`,
+    validated and only then made current and handed to `on_success`, which
+    swaps it in. A failed or killed job leaves the served model untouched.
+    """
+
+    def __init__(self, load_engine, on_success):
+        self.load_engine = load_engine
+        self.on_success = on_success
+        self.last_job = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.last_job is not None and self.last_job.status in ('queued', 'running', 'validating')
+
+    def start(self, dataset_path=None, streaming=False, chunksize=None):
+        """
+        Start a training job.
+
+        Args:
+            dataset_path (str): Source CSV, train_model.DATASET_PATH by default
+            streaming (bool): Train out-of-core with train_model.train_streaming
+            chunksize (int): Rows per chunk in streaming mode
+
+        Returns:
+            TrainingJob
+
+        Raises:
+            TrainingInProgress: If a job is already running
+        """
+        with self._lock:
+            if self.running:
+                raise TrainingInProgress(f"Training job {self.last_job.id} is already running")
+            # The thread lock covers this process, the file lock the other workers
+            lock_file = acquire_training_lock()
+            if lock_file is None:
+                raise TrainingInProgress("A training job is already running in another worker process")
+            job = TrainingJob(dataset_path, streaming, chunksize)
+            self.last_job = job
+        threading.Thread(target=self._run, args=(job, lock_file), name=f'training-{job.id}', daemon=True).start()
+        return job
+
+    def _train(self, job):
+        """Run the training process for a job and return the path of the bundle it published"""
+        # A fresh interpreter running this file, so none of the server's state is copied or re-imported
+        read_fd, write_fd = os.pipe()
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(write_fd),
+             json.dumps([job.dataset_path, job.streaming, job.chunksize])],
+            pass_fds=(write_fd,)
+        )
+        os.close(write_fd)
+        try:
+            # Ends when the child closes the pipe, including when it is killed
+            with os.fdopen(read_fd) as messages:
+                for line in messages:
+                    message = json.loads(line)
+                    if message[0] == 'progress':
+                        job.stage = message[1]
+                        job.progress = message[2] * 0.9
+                    elif message[0] == 'done':
+                        return message[1]
+                    else:
+                        raise RuntimeError(message[1])
+        finally:
+            process.wait()
+        raise RuntimeError(f"Training process exited with code {process.returncode}")
+
+    def _run(self, job, lock_file):
+        bundle_path = None
+        try:
+            job.status = 'running'
+            bundle_path = self._train(job)
+
+            job.status = 'validating'
+            job.stage = "Validating new models..."
+            job.progress = 0.9
+            engine = self.load_engine(bundle_path)
+            validate_engine(engine)
+
+            set_current_bundle(bundle_path)
+            bundle_path = None
+            self.on_success(engine)
+            job.bundle_version = engine.bundle.version
+            job.stage = "Serving new models"
+            job.progress = 1.0
+            job.status = 'succeeded'
+        except Exception as e:
+            print(f"Training job {job.id} failed: {e}")
+            # Remove a bundle that never became current
+            if bundle_path is not None:
+                shutil.rmtree(bundle_path, ignore_errors=True)
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            lock_file.close()
+
+
+if __name__ == '__main__':
+    # Started by TrainingManager: argv holds the message pipe and the job's JSON arguments
+    os.nice(TRAINING_NICENESS)
+    with os.fdopen(int(sys.argv[1]), 'w') as messages:
+        train_in_child(*json.loads(sys.argv[2]), messages)